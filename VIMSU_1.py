@@ -11,18 +11,159 @@ Licence: GPLv3
 # -----------------------------------------------------------------------------------------------------------------------------------
 import os.path
 import numpy as np
-from pyvims import VIMS
-import pandas as pd
 import time
 import re
 
-from VIMS_uncertainties import VIMS_uncert
+from VIMSU_fetch import prefetch_cubes, VIMS_DATA_PORTAL
 
+# 'pandas', 'pyvims' and 'VIMS_uncertainties' (which brings 'matplotlib' and 'scipy' with 'pyvims') are
+# imported in the functions using them, so that light tasks (sharding, merging, ...) start quickly.
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+# Descriptions of the columns, recorded as metadata of the HDF5 stores:
+Cubes_metadata = {'Cube name': 'Cube identification',
+                  'Nsample'  : "Max. index value in 'sample' axis",
+                  'Nline'    : "Max. index value in 'line' axis",
+                  'Npix'     : 'Total number of cube pixels',
+                  'Expo Time': 'Exposure time',
+                  'Ls'       : 'Solar longitude (in degrees)',
+                  'dT1'      : 'Detector temperature 1 (Detector IR high resolution) in K',
+                  'dT2'      : 'Detector temperature 2 (Detector IR low resolution) in K',
+                  'dT3'      : 'Detector temperature 3 (Detector Visible) in K',
+                  'iT1'      : 'Instrument temperature 1 (Instrument IR spectrometer) in K',
+                  'iT2'      : 'Instrument temperature 2 (Instrument grating) in K',
+                  'oT1'      : 'Optics temperature 1 (Optics IR primary) in K',
+                  'oT2'      : 'Optics temperature 2 (Optics IR secondary) in K',
+                  'oT3'      : 'Optics temperature 3 (Optics Visible) in K'}
+
+Pav_metadata = {'Cube name': 'Cube identification',
+                'Npav'     : 'Number of boxes drawn in the cube, for each box size',
+                'iPav'     : 'Index of the box among those of the cube',
+                's'        : "'sample' of the central pixel of the box",
+                'l'        : "'line' of the central pixel of the box",
+                'lat'      : 'Planetocentric North latitude of the central pixel (in degrees)',
+                'lon'      : 'West longitude of the central pixel (in degrees)',
+                'res'      : 'Resolution of the central pixel (in km)',
+                'box'      : 'Size of the box (3 for 3x3 pixels, 5 for 5x5, ...)',
+                'Fmask'    : 'Fraction of invalid I/F values (NaN, non-positive, saturated, ISIS special) in the box, over the mask channels (all by default)',
+                'DIsF_i'   : 'log10 of the relative standard deviation of I/F over the box, VIMS channel i (NaN if invalid values)',
+                'IFav_i'   : 'Average I/F over the box, VIMS channel i (NaN if invalid values)',
+                'Dinc'     : 'Relative standard deviation of incidence angles over the box',
+                'incAv'    : 'Average incidence angle over the box (in degrees)',
+                'Deme'     : 'Relative standard deviation of emergence angles over the box',
+                'emeAv'    : 'Average emergence angle over the box (in degrees)',
+                'Dphase'   : 'Relative standard deviation of phase angles over the box',
+                'phaseAv'  : 'Average phase angle over the box (in degrees)'}
+
+# Keys of the DataFrames in the HDF5 stores:
+Cubes_key = 'Cubes_global_data'
+Pav_key   = 'Paves3x3_data'
+
+# Columns of boxes data which are indexed, and can be used in queries (see 'VIMSU_2.read_Pav_chunks'):
+Pav_data_columns = ['Cube name', 'lat', 'lon', 'res', 'box', 'Fmask', 'Dinc', 'Deme', 'Dphase']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def shard_list(clist, i, N):
+    """
+    Select the i-th shard, among N, of a list of cubes. Cubes are dealt in turn (i, i+N, i+2N, ...) so
+    that shards have the same size within one cube, whatever the order of the list.
+    Inputs:
+      - clist (numpy array) --: list of cube names.
+      - i (int) --------------: index of the shard, 0 <= i < N.
+      - N (int) --------------: number of shards.
+    Outputs:
+      - the cube names belonging to the shard.
+    """
+    if N < 1 or i < 0 or i >= N:
+        raise ValueError(f'Bad shard specification: {i}/{N}, 0 <= i < N is required.')
+    return clist[i::N]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def put_table(store, key, DF, data_columns):
+    """
+    Write a DataFrame in PyTables 'table' format in an open HDF5 store, with indexed data columns. pandas
+    writes nothing for an empty DataFrame: an empty table, with the same columns, is then created, so that
+    the key exists (e.g. for a shard with no box).
+    Inputs:
+      - store (HDFStore) -------: the store, open for writing.
+      - key (string) -----------: key of the DataFrame in the store.
+      - DF (Pandas DataFrame) --: data to be written.
+      - data_columns (list) ----: columns to be indexed, all if True.
+    """
+    import pandas as pd
+
+    DF = DF.infer_objects() # Columns built row by row have the 'object' type.
+    data_columns = list(DF.columns) if data_columns is True else [c for c in data_columns if c in DF.columns]
+    min_itemsize = {'Cube name': 32} if 'Cube name' in data_columns else None
+    if len(DF):
+        store.put(key, DF, format='table', data_columns=data_columns, index=False, min_itemsize=min_itemsize)
+    else:
+        # A row is written, to create the table, then removed:
+        row = pd.DataFrame({c: np.array(['']) if c == 'Cube name' else
+                               np.zeros(1, dtype=float if DF[c].dtype == object else DF[c].dtype)
+                            for c in DF.columns})
+        store.put(key, row, format='table', data_columns=data_columns, index=False, min_itemsize=min_itemsize)
+        store.remove(key, start=0, stop=1)
+    store.create_table_index(key, columns=data_columns, optlevel=9, kind='full')
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def write_DF_HDF5(DF, filename, key, metadata=None, data_columns=None):
+    """
+    Write a DataFrame into a compressed HDF5 store, with the description of its columns as metadata.
+    Inputs:
+      - DF (Pandas DataFrame) --: data to be written.
+      - filename (string) ------: name of the HDF5 file.
+      - key (string) -----------: key of the DataFrame in the store ('Cubes_global_data' or 'Paves3x3_data').
+      - metadata (dict) --------: description of the columns.
+      - data_columns (list) ----: if given, the store is written in PyTables 'table' format, with these
+                                  columns indexed, so that rows can be selected at reading time
+                                  (e.g. 'Pav_data_columns'); otherwise the 'fixed' format is used.
+    """
+    import warnings
+    import pandas as pd
+    import tables
+
+    # 'Cube name' is not a Python identifier, harmless for PyTables but it warns for each attribute:
+    with warnings.catch_warnings(), \
+         pd.HDFStore(filename, mode='w', complevel=9, complib='zlib') as store:
+        warnings.simplefilter('ignore', tables.NaturalNameWarning)
+        if data_columns is None:
+            store.put(key, DF)
+        else:
+            put_table(store, key, DF, data_columns)
+        if metadata is not None:
+            store.get_storer(key).attrs.metadata = metadata
+
+# -----------------------------------------------------------------------------------------------------------------------------------
 class VIMS_u:
     """
     D. Cordier - January 2023.
     """
-    def __init__(self, cub_list_CSV, cubes_dir, frac):
+    def __init__(self, cub_list_CSV, cubes_dir, frac, shard=None, base_url=VIMS_DATA_PORTAL, max_workers=8, \
+                 boxes=(3,), sampling=None, max_masked=None, IsF_max=None, mask_channels=None):
+        """
+        Inputs:
+          - cub_list_CSV (string) --: CSV file containing the list of cubes.
+          - cubes_dir (string) -----: directory containing the cubes.
+          - frac (float) -----------: fraction of cube pixels used as central pixels of boxes.
+          - shard (tuple) ----------: (i, N), only the i-th of N shards of the list of cubes is
+                                      processed (0 <= i < N), see 'shard_list'.
+          - base_url (string) ------: URL of the VIMS Data Portal (or of a mirror) for missing cubes.
+          - max_workers (int) ------: number of concurrent downloads of missing cubes.
+          - boxes (list of int) ----: sizes of pixels boxes (odd), several sizes give a multi-scale
+                                      study, with boxes of all sizes centered on the same pixels.
+          - sampling (dict) --------: None for a uniform random choice of central pixels, or options of
+                                      the stratified choice based on the geometry of cubes ('Dang',
+                                      'strata', 'n_stratum', see 'VIMS_uncert.choice_pix_strata').
+          - max_masked (float) -----: boxes with a larger fraction of invalid I/F values are not kept
+                                      (see 'VIMS_uncert.valid_mask'); all are kept if None.
+          - mask_channels (tuple) --: (i0, i1), VIMS channels (1-based) over which the fraction of invalid
+                                      I/F values of boxes is computed, e.g. the band to be analysed (all
+                                      channels if None).
+          - IsF_max (float) --------: I/F saturation threshold, larger values are invalid (none if None).
+        """
+        import pandas as pd
+
         # -------------------------------------------------------------------------------
         if os.path.isfile(cub_list_CSV):
             print (" > CSV file containing the list of cubes ---: ",  cub_list_CSV)
@@ -47,14 +188,14 @@ class VIMS_u:
         # We check if all the listed cubes are available in the directory:
         self.clist = np.loadtxt(cub_list_CSV, delimiter=",", dtype=str)
         self.clist = np.delete(self.clist, 0)
-        for i, cname in enumerate(self.clist):
-            fname = "C"+cname+"_ir.cub"
-            if not os.path.isfile(cubes_dir+"/"+fname):
-            #    print ("   - ", i, " : ", fname, " is present in '", cubes_dir ,"'")
-            #else:
-                print ("   - This cube is note present, we download: ", fname)
-                cvims = VIMS(cname, root=cubes_dir)
-                cNs   = cvims.NS # To force downloading.
+        if shard is not None:
+            self.clist = shard_list(self.clist, *shard)
+        # Missing cubes are downloaded concurrently, and verified (see 'VIMSU_fetch'):
+        fetched, failed = prefetch_cubes(self.clist, cubes_dir, base_url=base_url, max_workers=max_workers)
+        if failed:
+            print (" > ", len(failed), " cube(s) could not be downloaded!")
+            print ("   We stop!")
+            return
 
         # -------------------------------------------------------------------------------
         # We set the number of VIMS channels:
@@ -64,6 +205,20 @@ class VIMS_u:
         # Fraction of cube pixels to be used:
         self.frac_px = frac
 
+        # -------------------------------------------------------------------------------
+        # Sizes of pixels boxes:
+        self.boxes = sorted(set(boxes))
+
+        # -------------------------------------------------------------------------------
+        # Choice of central pixels (uniform if None, stratified otherwise):
+        self.sampling = sampling
+
+        # -------------------------------------------------------------------------------
+        # Invalid I/F values (see 'VIMS_uncert.valid_mask'):
+        self.max_masked    = max_masked
+        self.mask_channels = mask_channels
+        self.IsF_max       = IsF_max
+
         # -------------------------------------------------------------------------------
         # We initialized the Pandas DataFrame that will contain the global data of cubes:
         #
@@ -84,14 +239,16 @@ class VIMS_u:
         # We initialized the Pandas DataFrame that will contain the data of 3x3 pixels blocks:
         #
         # Cube name : identifiant du cube.
-        # Npav      : nombre total de pavés 3x3 dans le cube en question.
+        # Npav      : nombre de pavés tirés dans le cube en question, pour chaque taille de pavé.
         # iPav      : indice du pavé considéré, parmi ceux du cube en cours d'utilisation.
         # s         : 'sample' du pixel central du pavé.
         # l         : 'line' du pixel central du pavé.
         # lat       : latitude du pixel central du pavé.
         # lon       : longitude du pixel central du pavé.
         # res       : résolution (diagonale ?) du pixel central.
-        self.columns_Pav = ['Cube name', 'Npav', 'iPav', 's', 'l', 'lat', 'lon', 'res' ]
+        # box       : taille du pavé (3 pour 3x3, 5 pour 5x5, ...).
+        # Fmask     : fraction de valeurs de I/F invalides dans le pavé, sur les canaux 'mask_channels'.
+        self.columns_Pav = ['Cube name', 'Npav', 'iPav', 's', 'l', 'lat', 'lon', 'res', 'box', 'Fmask' ]
 
         # We add the relative standard deviations:
         list_of_names    = ['DIsF_'+str(i+1) for i in range(self.Nchan_VIMS)]
@@ -114,6 +271,9 @@ class VIMS_u:
         """
         Extraction of 3x3 pixels boxes data.
         """
+        import pandas as pd
+        from VIMS_uncertainties import VIMS_uncert
+
         list_smooth_err = np.empty((0, self.Nchan_VIMS), dtype=float)
 
         list_av_IF = np.array([])          # List of the average I/F, for each cube.
@@ -126,6 +286,9 @@ class VIMS_u:
         nc = 0 # Number of cubes processed.
         Npx= 0 # Total number of pixels (i.e. over all cubes).
 
+        Cubes_DF_list = [] # DataFrames of each cube.
+        Pav_DF_list   = []
+
         tic = time.perf_counter()
 
         print ("")
@@ -141,61 +304,21 @@ class VIMS_u:
             cubname = "C"+cname+"_ir.cub"
             cubname_fig = re.sub(r"cub", "png", cubname) # Nom de la figure qu'on va enregistrer.
             #print (cubname)
-            cub_VIMS        = VIMS(cubname, root=cubes_dir) # Lecture du cube dans le répertoire de stockage
-            cub_VIMS_uncert = VIMS_uncert(cubname, root=cubes_dir)
+            cub_VIMS_uncert = VIMS_uncert(cubname, root=cubes_dir) # Lecture du cube dans le répertoire de stockage
+            cub_VIMS        = cub_VIMS_uncert # 'VIMS_uncert' est un cube 'VIMS', inutile de le lire deux fois.
 
             cubname = re.sub(r"_ir.cub", "", cubname)
             cubname = re.sub(r"C", "", cubname)
 
-            # On traite le cube en tirant au sort les pavés 3x3 et en faisant les calculs nécessaires dessus :
-            N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, \
-            ns_rand, nl_rand, latC_pav, lonC_pav, res_av, log10_ectype_relat, IsF_av, ectr_inc, inc_av, \
-            ectr_eme, eme_av, ectr_phase, phase_av = \
-            cub_VIMS_uncert.comp_logect_pave(frac=self.frac_px, root = cubes_dir)
-
-            # ---------------------------------------------------------------------------------
-            # Construction du DataFrame concernant les données globales des cubes :
-            Npix = N_sample*N_line
-            ligne = [cubname] + [N_sample] + [N_line] + [Npix] + [Expo_time] + [Ls] + \
-                [T for T in detect_temp] + [T for T in instru_temp] + [T for T in opt_temp]
-
-            Cubes_DF_temp = pd.DataFrame([ligne], columns=self.columns_Cubes)      # DataFrame temporaire d'une ligne.
-            self.Cubes_DF = pd.concat([self.Cubes_DF, Cubes_DF_temp], ignore_index=True) # On ajoute le DataFrame tempo. au DataFrame final
-
-            # ---------------------------------------------------------------------------------
-            # Construction du DataFrame concernant les données des paves :
-
-            Npav = len(ns_rand)
-            #print ('Npav = ', Npav)
-            for iPav in range(Npav):
-                s  = ns_rand[iPav]
-                l  = nl_rand[iPav]
-                lat= latC_pav[iPav]
-                lon= lonC_pav[iPav]
-                res= res_av[iPav]
-
-                lectype_relat_Pav = log10_ectype_relat[iPav] # Pour un pavé donné : log(ec_IsF) en fonc. des canaux
-                IsF_av_Pav        = IsF_av[iPav] # # Pour un pavé donné : I/F moy. en fonc. des canaux VIMS.
-
-                eri = ectr_inc[iPav]
-                i_av= inc_av[iPav]
-                ere = ectr_eme[iPav]
-                eav = eme_av[iPav]
-                erph= ectr_phase[iPav]
-                phav= phase_av[iPav]
-
-                ligne = [cubname] + [Npav] + [iPav] + [s] + [l] + [lat] + [lon] + [res] + \
-                        [DIsF  for DIsF  in lectype_relat_Pav] + [IsFav for IsFav in IsF_av_Pav] + \
-                        [eri] + [i_av] + [ere]  + [eav] + [erph] + [phav]
-
-
-
-                Pav_DF_temp = pd.DataFrame([ligne], columns=self.columns_Pav) # DataFrame temporaire d'une ligne.
-                self.Pav_DF = pd.concat([self.Pav_DF, Pav_DF_temp], ignore_index=True) # On ajoute le DataFrame tempo. au DataFrame final
+            # On traite le cube en tirant au sort les pavés et en faisant les calculs nécessaires dessus :
+            Cubes_DF_temp, Pav_DF_temp = self.cube_frames(cubname, cub_VIMS_uncert, cubes_dir)
+            Cubes_DF_list.append(Cubes_DF_temp) # Les DataFrames sont réunis à la fin, en une seule fois.
+            Pav_DF_list.append(Pav_DF_temp)
 
             # Plot of chosen box (central pixel):
             cub_VIMS_uncert.plot_pix_distri(frac=self.frac_px, root=cubes_dir, \
-                                                plotdir=self.cubes_PlotDistrib_dir, figname=cubname_fig)
+                                                plotdir=self.cubes_PlotDistrib_dir, figname=cubname_fig, \
+                                                box=max(self.boxes), sampling=self.sampling)
 
             Npx= Npx + cub_VIMS.NS * cub_VIMS.NL
             cube_px_number = np.append(cube_px_number, cub_VIMS.NS * cub_VIMS.NL)
@@ -218,6 +341,10 @@ class VIMS_u:
             #if nc == 2:
             #    break
 
+        if Cubes_DF_list:
+            self.Cubes_DF = pd.concat(Cubes_DF_list, ignore_index=True)
+            self.Pav_DF   = pd.concat(Pav_DF_list, ignore_index=True)
+
         toc = time.perf_counter()
 
         print ("")
@@ -227,6 +354,230 @@ class VIMS_u:
 
         return self.Cubes_DF, self.Pav_DF
 
+    # -----------------------------------------------------------------------------------
+    def cube_frames (self, cubname, cube, cubes_dir=None):
+        """
+        Random boxes of one cube, and their statistics.
+        Inputs:
+          - cubname (string) -----------: cube identifier.
+          - cube (VIMS_uncert) ---------: the cube.
+          - cubes_dir (string) ---------: directory containing the cubes.
+        Outputs:
+          - Cubes_DF (Pandas DataFrame) -: one row, global data of the cube ('columns_Cubes').
+          - Pav_DF (Pandas DataFrame) ---: one row per box and per box size ('columns_Pav').
+        """
+        import pandas as pd
+
+        if self.IsF_max is not None:
+            cube.IsF_max = self.IsF_max
+        N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, \
+        ns_rand, nl_rand, latC_pav, lonC_pav, res_av, per_box = \
+        cube.comp_logect_pave_multi(frac=self.frac_px, root = cubes_dir, boxes=self.boxes, sampling=self.sampling,
+                                    max_masked=self.max_masked, mask_channels=self.mask_channels)
+
+        # ---------------------------------------------------------------------------------
+        # Construction du DataFrame concernant les données globales des cubes :
+        Npix  = N_sample*N_line
+        ligne = [cubname] + [N_sample] + [N_line] + [Npix] + [Expo_time] + [Ls] + \
+            [T for T in detect_temp] + [T for T in instru_temp] + [T for T in opt_temp]
+        Cubes_DF = pd.DataFrame([ligne], columns=self.columns_Cubes)
+
+        # ---------------------------------------------------------------------------------
+        # Construction du DataFrame concernant les données des paves, colonne par colonne (les pavés
+        # de toutes les tailles sont centrés sur les mêmes pixels) :
+        Npav   = len(ns_rand)
+        nboxes = len(self.boxes)
+        blocks = []
+        for box in self.boxes:
+            log10_ectype_relat, IsF_av, ectr_inc, inc_av, ectr_eme, eme_av, ectr_phase, phase_av, Fmask = per_box[box]
+            blocks.append((np.asarray(log10_ectype_relat, dtype=float).reshape(Npav, self.Nchan_VIMS),
+                           np.asarray(IsF_av, dtype=float).reshape(Npav, self.Nchan_VIMS),
+                           np.column_stack([ectr_inc, inc_av, ectr_eme, eme_av, ectr_phase, phase_av]).astype(float)))
+
+        head = {'Cube name': np.repeat(str(cubname), Npav*nboxes),
+                'Npav'     : np.full(Npav*nboxes, Npav, dtype=np.int64),
+                'iPav'     : np.tile(np.arange(Npav, dtype=np.int64), nboxes),
+                's'        : np.tile(np.asarray(ns_rand, dtype=np.int64), nboxes),
+                'l'        : np.tile(np.asarray(nl_rand, dtype=np.int64), nboxes),
+                'lat'      : np.tile(np.asarray(latC_pav, dtype=float), nboxes),
+                'lon'      : np.tile(np.asarray(lonC_pav, dtype=float), nboxes),
+                'res'      : np.tile(np.asarray(res_av, dtype=float), nboxes),
+                'box'      : np.repeat(np.asarray(self.boxes, dtype=np.int64), Npav),
+                'Fmask'    : np.concatenate([np.asarray(per_box[box][8], dtype=float) for box in self.boxes])}
+        values = np.hstack([np.vstack([blk[k] for blk in blocks]) for k in range(3)]) if Npav else \
+                 np.empty((0, 2*self.Nchan_VIMS + 6))
+        Pav_DF = pd.concat([pd.DataFrame(head),
+                            pd.DataFrame(values, columns=self.columns_Pav[len(head):])], axis=1)
+        return Cubes_DF, Pav_DF
+
+    # -----------------------------------------------------------------------------------
+    def extract_pipelined (self, cubes_dir=None, prefetch=2, io_workers=1, out_cubes=None, out_pav=None,
+                           plot=True):
+        """
+        Same as 'extract_3x3box', with reading, computing and writing overlapped: 'io_workers' threads read
+        the next 'prefetch' cubes while the current one is processed, and a writer thread appends the results
+        to the HDF5 stores. At most 'prefetch' cubes are loaded (plus the current one), and at most 'prefetch'
+        results wait for the writer, whatever the number of cubes.
+        Inputs:
+          - cubes_dir (string) --: directory containing the cubes.
+          - prefetch (int) ------: depth of the queues (number of cubes read in advance).
+          - io_workers (int) ----: number of reading threads (the parsing of labels by 'pyvims' holds the
+                                   GIL, more threads only help when reading waits on a slow disk or network).
+          - out_cubes (string) --: HDF5 store of the data of cubes ('fixed' format, written at the end, as in
+                                   a sequential run); if None, the data are returned.
+          - out_pav (string) ----: HDF5 store of the data of boxes ('table' format, appended cube after cube);
+                                   if None, the data are returned.
+          - plot (bool) ---------: plot of the chosen boxes of each cube, as in 'extract_3x3box'.
+        Outputs:
+          - Cubes_DF, Pav_DF (Pandas DataFrames) --: None for the data written in a store.
+          - timings (dict) ------------------------: time (seconds) spent in each stage: 'read' (sum over
+                                                     reading threads), 'wait' (computation waiting for a
+                                                     cube), 'compute', 'plot', 'write' and 'total'.
+        """
+        import queue
+        import threading
+        import warnings
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+
+        import pandas as pd
+        import tables
+        from VIMS_uncertainties import VIMS_uncert
+
+        timings = dict.fromkeys(['read', 'wait', 'compute', 'plot', 'write', 'total'], 0.)
+        lock    = threading.Lock()
+
+        def read(cname):
+            tic_r = time.perf_counter()
+            cube  = VIMS_uncert("C" + cname + "_ir.cub", root=cubes_dir)
+            # pyvims reads lazily, everything needed by the computation is read here:
+            cube.data, cube.lat, cube.lon, cube.res, cube.inc, cube.eme, cube.phase
+            cube.isis['DETECTOR_TEMPERATURE'], cube.expo, cube.time
+            with lock:
+                timings['read'] += time.perf_counter() - tic_r
+            return cube
+
+        # ---------------------------------------------------------------------------------
+        # Writer: the stores are appended cube after cube.
+        results = queue.Queue(maxsize=prefetch)
+        Cubes_list, Pav_list = [], []
+        errors  = []
+        failed  = threading.Event() # Set by the writer when it fails: the computation stops.
+
+        def writer():
+            sink  = {}
+            nrows = {'cubes': 0, 'pav': 0}
+            empty = {'cubes': self.Cubes_DF.iloc[:0], 'pav': self.Pav_DF.iloc[:0]} # Columns of empty tables.
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', tables.NaturalNameWarning)
+                    for fname in (out_cubes, out_pav):
+                        if fname is not None:
+                            sink[fname] = pd.HDFStore(fname, mode='w', complevel=9, complib='zlib')
+                    while True:
+                        item = results.get()
+                        if item is None:
+                            break
+                        tic_w = time.perf_counter()
+                        Cubes_DF, Pav_DF = item
+                        empty['cubes'], empty['pav'] = Cubes_DF.iloc[:0], Pav_DF.iloc[:0]
+                        # Running index, as if all the cubes were in a single DataFrame:
+                        Cubes_DF.index = pd.RangeIndex(nrows['cubes'], nrows['cubes'] + len(Cubes_DF))
+                        Pav_DF.index   = pd.RangeIndex(nrows['pav'], nrows['pav'] + len(Pav_DF))
+                        nrows['cubes'] += len(Cubes_DF)
+                        nrows['pav']   += len(Pav_DF)
+                        Cubes_list.append(Cubes_DF) # One row per cube, written at the end.
+                        if out_pav is None:
+                            Pav_list.append(Pav_DF)
+                        else:
+                            sink[out_pav].append(Pav_key, Pav_DF, data_columns=Pav_data_columns,
+                                                 min_itemsize={'Cube name': 32}, index=False)
+                        timings['write'] += time.perf_counter() - tic_w
+
+                    tic_w = time.perf_counter()
+                    if out_cubes is not None:
+                        # 'fixed' format, as 'write_DF_HDF5' in a sequential run:
+                        sink[out_cubes].put(Cubes_key, pd.concat(Cubes_list) if Cubes_list else empty['cubes'])
+                        sink[out_cubes].get_storer(Cubes_key).attrs.metadata = Cubes_metadata
+                        Cubes_list.clear()
+                    if out_pav is not None:
+                        if Pav_key in sink[out_pav]:
+                            sink[out_pav].create_table_index(Pav_key, columns=Pav_data_columns, optlevel=9, kind='full')
+                        else:
+                            # No cube, or no box kept: the table is created empty.
+                            put_table(sink[out_pav], Pav_key, empty['pav'], Pav_data_columns)
+                        sink[out_pav].get_storer(Pav_key).attrs.metadata = Pav_metadata
+                    timings['write'] += time.perf_counter() - tic_w
+            except Exception as err:
+                errors.append(err)
+                failed.set()
+                while results.get() is not None: # The computation must not block on a full queue.
+                    pass
+            finally:
+                for st in sink.values():
+                    st.close()
+
+        print ("")
+        print (" > We have a total of '", len(self.clist), "' VIMS cubes to be processed (pipelined, ", \
+               prefetch, " cubes read in advance).")
+        print ("")
+
+        tic = time.perf_counter()
+        thread = threading.Thread(target=writer, daemon=True)
+        thread.start()
+
+        # ---------------------------------------------------------------------------------
+        # Reading in advance, in a window of 'prefetch' cubes:
+        clist = list(self.clist)
+        try:
+            with ThreadPoolExecutor(max_workers=io_workers) as pool:
+                pending = deque(pool.submit(read, cname) for cname in clist[:prefetch])
+                for nc, cname in enumerate(clist):
+                    if failed.is_set():
+                        break # The results could not be written: no need to process the other cubes.
+                    tic_1 = time.perf_counter()
+                    cube  = pending.popleft().result()
+                    if nc + prefetch < len(clist):
+                        pending.append(pool.submit(read, clist[nc + prefetch]))
+                    tic_2 = time.perf_counter()
+                    timings['wait'] += tic_2 - tic_1
+
+                    results.put(self.cube_frames(cname, cube, cubes_dir))
+                    tic_3 = time.perf_counter()
+                    timings['compute'] += tic_3 - tic_2
+
+                    if plot:
+                        cube.plot_pix_distri(frac=self.frac_px, root=cubes_dir, plotdir=self.cubes_PlotDistrib_dir,
+                                             figname="C" + cname + "_ir.png", box=max(self.boxes), sampling=self.sampling)
+                    timings['plot'] += time.perf_counter() - tic_3
+
+                    print ( '   - Cube ', nc + 1,':', cname, ':', cube.NS * cube.NL, ' px, ', \
+                            f' processing performed in {time.perf_counter() - tic_1:0.4f} seconds')
+                    del cube
+                for fut in pending: # Cubes read in advance, not processed after a failure.
+                    fut.cancel()
+        finally:
+            # The writer is always stopped, so that the stores are closed even if a cube cannot be read
+            # or processed:
+            results.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
+        timings['total'] = time.perf_counter() - tic
+
+        print ("")
+        print (f" > Cube processing performed in {timings['total']:0.4f} seconds")
+        print ("   " + ", ".join(f"{k}: {v:0.3f} s" for k, v in timings.items() if k != 'total'))
+        print ("")
+
+        Cubes_DF = pd.concat(Cubes_list) if out_cubes is None and Cubes_list else None
+        Pav_DF   = pd.concat(Pav_list) if out_pav is None and Pav_list else None
+        if Cubes_DF is not None:
+            self.Cubes_DF = Cubes_DF
+        if Pav_DF is not None:
+            self.Pav_DF = Pav_DF
+        return Cubes_DF, Pav_DF, timings
+
     # -----------------------------------------------------------------------------------
     def cub_av_IF (self, cube):
         """
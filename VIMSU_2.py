@@ -9,20 +9,254 @@ Licence: GPLv3
 #                 Python module of data extraction from VIMS cube for IR photometric uncertainties
 #
 # -----------------------------------------------------------------------------------------------------------------------------------
+import re
+
 import numpy as np
-import matplotlib.pyplot as plt
 
 import pandas as pd
-from pyvims import VIMS
 
-import matplotlib.colors as colors
+# Plotting modules ('matplotlib') and 'pyvims' are only imported by the plotting functions, so that
+# the statistics can be computed without loading them.
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+# Titan mean radius (km), used for great-circle distances between boxes:
+R_Titan = 2574.73
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+class BoxSpatialIndex:
+    """
+    Spatial index over the central pixels (lat, lon) of 3x3 pixels boxes.
 
-from matplotlib.patches import Rectangle
+    Boxes are binned over a regular grid of 'dlat' x 'dlon' degrees tiles. Row indices are sorted by
+    tile, so that the rows of any tile are a contiguous slice of 'order', between 'start[t]' and
+    'start[t+1]'. Region and radius queries only visit the candidate tiles, and per-tile statistics
+    are computed with 'np.bincount' reductions.
+
+    Latitudes are planetocentric North (-90°, 90°), longitudes are West (0°, 360°), as in 'Pav_DF'.
+    Boxes with NaN or infinite coordinates are put in a sentinel tile ('ntiles'), never returned by queries
+    nor counted in per-tile statistics.
+    """
+    def __init__(self, lat, lon, dlat=1., dlon=1.):
+        """
+        Inputs:
+          - lat (numpy array) -------: latitudes of the central pixels of boxes.
+          - lon (numpy array) -------: West longitudes of the central pixels of boxes.
+          - dlat, dlon (float) ------: size of tiles in degrees.
+        """
+        self.lat  = np.ravel(np.asarray(lat, dtype=float))
+        with np.errstate(invalid='ignore'):
+            self.lon = np.ravel(np.asarray(lon, dtype=float)) % 360.
+        self.dlat = dlat
+        self.dlon = dlon
+
+        self.nlat = int(np.ceil(180. / dlat))
+        self.nlon = int(np.ceil(360. / dlon))
+        self.lat_edges = np.linspace(-90., -90. + self.nlat * dlat, self.nlat + 1)
+        self.lon_edges = np.linspace(0., self.nlon * dlon, self.nlon + 1)
+        self.ntiles    = self.nlat * self.nlon
+
+        self.tile = self.tile_of(self.lat, self.lon)
+
+        # Rows sorted by tile, and offsets of each tile in this sorted list (boxes of the sentinel tile,
+        # sorted last, are left out):
+        self.count = np.bincount(self.tile, minlength=self.ntiles + 1)[:self.ntiles]
+        self.start = np.concatenate(([0], np.cumsum(self.count)))
+        self.order = np.argsort(self.tile, kind='stable')[:self.start[-1]]
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def from_DataFrame(cls, Pav_DF, dlat=1., dlon=1.):
+        """
+        Build the index from the 'lat' and 'lon' columns of the DataFrame of boxes.
+        """
+        return cls(Pav_DF['lat'].to_numpy(), Pav_DF['lon'].to_numpy(), dlat=dlat, dlon=dlon)
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def tile_of(self, lat, lon):
+        """
+        Flat index (ilat * nlon + ilon) of the tiles containing the points (lat, lon), 'ntiles' for
+        points with NaN or infinite coordinates.
+        """
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        with np.errstate(invalid='ignore'):
+            ilat = np.clip(np.where(ok, (lat + 90.) // self.dlat, 0).astype(int), 0, self.nlat - 1)
+            ilon = np.clip(np.where(ok, (lon % 360.) // self.dlon, 0).astype(int), 0, self.nlon - 1)
+        return np.where(ok, ilat * self.nlon + ilon, self.ntiles)
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def counts(self):
+        """
+        Number of boxes per tile, as a (nlat, nlon) array.
+        """
+        return self.count.reshape(self.nlat, self.nlon)
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def density(self):
+        """
+        Number of boxes per degree² in each tile, as a (nlat, nlon) array.
+        """
+        return self.counts() / (self.dlat * self.dlon)
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def _rows_in_tiles(self, ilat, ilon):
+        """
+        Row indices of all boxes located in the tiles given by the 1D arrays of latitude indices
+        'ilat' and longitude indices 'ilon' (all combinations are taken).
+        """
+        tiles = (np.asarray(ilat)[:, None] * self.nlon + np.asarray(ilon)[None, :]).ravel()
+        tiles = tiles[self.count[tiles] > 0]
+        if tiles.size == 0:
+            return np.array([], dtype=int)
+        return np.concatenate([self.order[self.start[t]:self.start[t+1]] for t in tiles])
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def _lon_tiles(self, lon_min, lon_max):
+        """
+        Longitude indices of tiles covering the West longitude range [lon_min, lon_max], the range
+        wraps through 0° when lon_min > lon_max.
+        """
+        if lon_max - lon_min >= 360.:
+            return np.arange(self.nlon)
+        a, b = lon_min % 360., lon_max % 360.
+        i0 = min(int(a // self.dlon), self.nlon - 1)
+        i1 = min(int(b // self.dlon), self.nlon - 1)
+        if a <= b:
+            return np.arange(i0, i1 + 1)
+        if i1 >= i0:
+            return np.arange(self.nlon) # Both ends in the same tile: the range covers all tiles.
+        return np.concatenate((np.arange(i0, self.nlon), np.arange(0, i1 + 1)))
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def region(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Boxes located inside a lat/lon rectangle.
+        Inputs:
+          - lat_min, lat_max (float) --: latitude range (°N).
+          - lon_min, lon_max (float) --: West longitude range (°W), wrapping through 0° if lon_min > lon_max.
+        Outputs:
+          - rows (numpy array) --------: sorted row indices (positions in 'Pav_DF') of selected boxes.
+        """
+        ilat = np.arange(int((max(lat_min, -90.) + 90.) // self.dlat),
+                         min(int((min(lat_max, 90.) + 90.) // self.dlat), self.nlat - 1) + 1)
+        ilon = self._lon_tiles(lon_min, lon_max)
+        rows = self._rows_in_tiles(ilat, ilon)
+
+        lat = self.lat[rows]
+        lon = self.lon[rows]
+        keep = (lat >= lat_min) & (lat <= lat_max)
+        if lon_max - lon_min < 360.:
+            a, b = lon_min % 360., lon_max % 360.
+            if a <= b:
+                keep &= (lon >= a) & (lon <= b)
+            else:
+                keep &= (lon >= a) | (lon <= b)
+        return np.sort(rows[keep])
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def radius(self, lat0, lon0, radius_km, return_distance=False):
+        """
+        Boxes located within a given great-circle distance (haversine formula) from a site.
+        Inputs:
+          - lat0, lon0 (float) -------: latitude (°N) and West longitude (°W) of the site.
+          - radius_km (float) --------: search radius (km).
+          - return_distance (bool) ---: if True, distances are returned too.
+        Outputs:
+          - rows (numpy array) -------: row indices of selected boxes, sorted by increasing distance.
+          - dist (numpy array) -------: corresponding distances (km), only if 'return_distance'.
+        """
+        dang = np.degrees(radius_km / R_Titan) # Angular radius (°).
+
+        lat_min = lat0 - dang
+        lat_max = lat0 + dang
+        if lat_min <= -90. or lat_max >= 90.:
+            # The search cap contains a pole: all longitudes are candidates.
+            rows = self.region(max(lat_min, -90.), min(lat_max, 90.), 0., 360.)
+        else:
+            dlon = np.degrees(np.arcsin(min(np.sin(np.radians(dang)) / np.cos(np.radians(lat0)), 1.)))
+            rows = self.region(lat_min, lat_max, lon0 - dlon, lon0 + dlon)
+
+        dist = haversine(lat0, lon0, self.lat[rows], self.lon[rows])
+        keep = dist <= radius_km
+        rows = rows[keep]
+        dist = dist[keep]
+        srt  = np.argsort(dist, kind='stable')
+
+        if return_distance:
+            return rows[srt], dist[srt]
+        return rows[srt]
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def tile_aggregate(self, values):
+        """
+        Per-tile statistics of a quantity attached to each box.
+        Inputs:
+          - values (numpy array) --: one value per box (e.g. the average DIsF over a band), NaN and
+                                     +/-Inf values are ignored.
+        Outputs:
+          - count (numpy array) ---: (nlat, nlon) number of valid values in each tile.
+          - mean (numpy array) ----: (nlat, nlon) mean in each tile (NaN for empty tiles).
+          - std (numpy array) -----: (nlat, nlon) standard deviation in each tile (NaN for empty tiles).
+        """
+        values = np.ravel(np.asarray(values, dtype=float))
+        ok     = np.isfinite(values) & (self.tile < self.ntiles) # Boxes of the sentinel tile are ignored.
+        tiles  = self.tile[ok]
+        v      = values[ok]
+        ntiles = self.ntiles
+
+        count = np.bincount(tiles, minlength=ntiles).astype(float)
+        s1    = np.bincount(tiles, weights=v,   minlength=ntiles)
+        s2    = np.bincount(tiles, weights=v*v, minlength=ntiles)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s1 / count
+            std  = np.sqrt(np.maximum(s2 / count - mean**2, 0.))
+
+        shape = (self.nlat, self.nlon)
+        return count.reshape(shape), mean.reshape(shape), std.reshape(shape)
+
+    # -------------------------------------------------------------------------------------------------------------------------------
+    def tile_band_stats(self, Pav_DF, i0, i1, quantity='DIsF'):
+        """
+        Per-tile statistics of a quantity averaged over a VIMS spectral band.
+        Inputs:
+          - Pav_DF (Pandas DataFrame) --: DataFrame of boxes (the one used to build the index).
+          - i0 (int) -------------------: first VIMS channel of the band.
+          - i1 (int) -------------------: last VIMS channel of the band.
+          - quantity (string) ----------: 'DIsF' (relative standard deviation) or 'IFav' (average I/F).
+        Outputs:
+          - count, mean, std (numpy arrays): see 'tile_aggregate'.
+        """
+        list_DIsF, list_IsFav = VIMS_band (i0, i1)
+        keys = list_DIsF if quantity == 'DIsF' else list_IsFav
+
+        arr = Pav_DF[keys].to_numpy(dtype=float)
+        arr[~np.isfinite(arr)] = np.nan
+        with np.errstate(invalid='ignore'):
+            band_av = np.nanmean(arr, axis=1) if arr.size else np.array([])
+
+        return self.tile_aggregate(band_av)
 
-from matplotlib.ticker import AutoMinorLocator
+# -----------------------------------------------------------------------------------------------------------------------------------
+def haversine(lat0, lon0, lat, lon, radius=R_Titan):
+    """
+    Great-circle distance between a point and a set of points, over Titan surface.
+    Inputs:
+      - lat0, lon0 (float) -------: latitude and longitude (°) of the reference point.
+      - lat, lon (numpy arrays) --: latitudes and longitudes (°) of the points.
+      - radius (float) -----------: radius of the body (km).
+    Outputs:
+      - distances (numpy array) --: distances in km.
+    """
+    phi0 = np.radians(lat0)
+    phi  = np.radians(lat)
+    dphi = phi - phi0
+    dlmb = np.radians(np.asarray(lon) - lon0)
+    a = np.sin(dphi / 2.)**2 + np.cos(phi0) * np.cos(phi) * np.sin(dlmb / 2.)**2
+    return 2. * radius * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
 
 # -----------------------------------------------------------------------------------------------------------------------------------
-def plot_boxes_map(bg, my_lon, my_lat, figname):
+def plot_boxes_map(bg, my_lon, my_lat, figname, index=None):
     """
     Plot the location of 3x3 pixels boxes over a map of Titan surface.
     Intputs:
@@ -30,7 +264,12 @@ def plot_boxes_map(bg, my_lon, my_lat, figname):
       - my_lon (numpy array) -----: longitudes.
       - my_lat (numpy array) -----: latitudes.
       - figname (string) ---------: name of the PNG, PDF, ... file in which the figure is saved.
+      - index (BoxSpatialIndex) --: precomputed spatial index of the boxes, built from 'my_lat' and
+                                    'my_lon' if not provided.
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as colors
+
     fig, ax = plt.subplots(figsize=(15*1.3, 6*1.3))
 
     ax.imshow(bg, extent=[360, 0, -90, 90], cmap='gray')
@@ -50,8 +289,14 @@ def plot_boxes_map(bg, my_lon, my_lat, figname):
     hmin= 0
     hmax= 50
 
-    h = ax.hist2d(mes_lon, mes_lat, bins=[360, 180], cmap='winter', \
-                  norm=colors.PowerNorm(gamma=1. / 5.), cmin=0.001, cmax=hmax)
+    # The density is read from the tile counts of the spatial index (1°x1° tiles by default), which
+    # can be built once and reused between runs instead of histogramming all boxes again:
+    if index is None:
+        index = BoxSpatialIndex(mes_lat, mes_lon)
+    dens = index.density()
+    dens = np.ma.masked_where((dens < 0.001) | (dens > hmax), dens)
+    mesh = ax.pcolormesh(index.lon_edges, index.lat_edges, dens, cmap='winter', \
+                         norm=colors.PowerNorm(gamma=1. / 5.))
 
     # Site Huygens
     lat_Huyg = 191
@@ -64,7 +309,7 @@ def plot_boxes_map(bg, my_lon, my_lat, figname):
     ax.scatter(lat_Selk, lon_Selk, s=80, c='gold', marker='s')
 
     ax.set_xlim(360, 0)
-    cbar = fig.colorbar(h[3], ax=ax)
+    cbar = fig.colorbar(mesh, ax=ax)
     ax.grid('grey')
     cbar.set_label('Density of 3x3 px boxes (Nbr box per degree$^2$)')
 
@@ -133,7 +378,8 @@ def concat_DIsF_expo (DF_pix, DF_cube, i0, i1):
     Outputs:
       - DIsF_moy --: Numpy array des valeurs moyennes des erreurs relatives des pavés 3x3 pixels,
                      la moyenne étant faite sur la bande considérée définie par (i0, i1) pour tous les
-                     pavés 3x3
+                     pavés 3x3 ; les canaux masqués (NaN, voir 'VIMS_uncert.valid_mask') sont exclus de la
+                     moyenne, et les pavés sans aucun canal valide dans la bande sont écartés.
       - expo_time -: les temps d'exposition (des cubes) correspondants.
     """
     list_DIsF = VIMS_band (i0, i1) # On récupère les mots clés définissant les canaux VIMS sur lesquels
@@ -148,6 +394,9 @@ def concat_DIsF_expo (DF_pix, DF_cube, i0, i1):
         exp_t = float(DF_cube[DF_cube['Cube name'] == cn]['Expo Time'])
 
         for dband in DIsF_band:
+            dband = dband[np.isfinite(dband)] # Canaux masqués exclus.
+            if dband.size == 0:
+                continue
             m = np.mean(dband)
             #print (dband, m)
             DIsF_moy  = np.append(DIsF_moy, m)
@@ -220,13 +469,88 @@ def rm_NaN_Inf_nega (arrIsF, arrDIsF):
     return IsF_clean, DIsF_clean
 
 # -----------------------------------------------------------------------------------------------------------------------------------
-def IsFavBand(Pav_DF, band, Dang):
+def Pav_where(Dang=None, lat_range=None, lon_range=None, res_max=None, box=None, masked_max=None):
     """
+    Build the query (PyTables condition) selecting boxes in a store of boxes written in 'table' format.
     Inputs:
-      - Pav_DF (Pandas DataFrame) ----: DataFrame containing data of 3x3 boxes extracted from VIMS cubes.
+      - Dang (float) ---------: max. relative standard deviations of angles (Dphase, Dinc, Deme < Dang).
+      - lat_range (tuple) ----: (lat_min, lat_max) latitude range (°N) of central pixels.
+      - lon_range (tuple) ----: (lon_min, lon_max) West longitude range (°W) of central pixels.
+      - res_max (float) ------: max. resolution (km) of central pixels.
+      - box (int) ------------: size of boxes.
+      - masked_max (float) ---: max. fraction of invalid I/F values in boxes ('Fmask' column).
+    Outputs:
+      - where (string) -------: the condition, None if there is no criterion.
+    """
+    cond = []
+    if Dang is not None:
+        cond += [f'Dphase < {Dang!r}', f'Dinc < {Dang!r}', f'Deme < {Dang!r}']
+    if lat_range is not None:
+        cond += [f'lat >= {lat_range[0]!r}', f'lat <= {lat_range[1]!r}']
+    if lon_range is not None:
+        cond += [f'lon >= {lon_range[0]!r}', f'lon <= {lon_range[1]!r}']
+    if res_max is not None:
+        cond += [f'res <= {res_max!r}']
+    if box is not None:
+        cond += [f'box == {int(box)}']
+    if masked_max is not None:
+        cond += [f'Fmask <= {masked_max!r}']
+    return ' & '.join(cond) if cond else None
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def read_Pav_chunks(store, columns=None, where=None, cubes=None, chunksize=200000, key='Paves3x3_data'):
+    """
+    Read, chunk by chunk, the boxes satisfying a query in a store of boxes written in 'table' format
+    (see 'VIMSU_1.write_DF_HDF5'). The selection is made by PyTables on the indexed data columns, and
+    only the requested columns of selected rows are loaded, so that the whole table never has to fit
+    in memory.
+    Inputs:
+      - store (HDFStore or string) --: the store, or the name of its file.
+      - columns (list) --------------: columns to be read (all if None).
+      - where (string) --------------: condition on data columns, see 'Pav_where'.
+      - cubes (list) ----------------: if given, only boxes of these cubes are read.
+      - chunksize (int) -------------: max. number of rows per chunk.
+      - key (string) ----------------: key of the table in the store.
+    Outputs:
+      - generator of DataFrames.
+    """
+    if isinstance(store, str):
+        with pd.HDFStore(store, mode='r') as st:
+            yield from read_Pav_chunks(st, columns, where, cubes, chunksize, key)
+        return
+
+    if where is None:
+        coords = np.arange(store.get_storer(key).nrows)
+    else:
+        coords = store.select_as_coordinates(key, where=where).to_numpy()
+
+    if cubes is not None:
+        # 'Cube name' is not a valid identifier for pandas queries, the condition is given to PyTables:
+        table = store.get_storer(key).table
+        col   = table.cols._f_col('Cube name')
+        sel   = [table.get_where_list('cn == name', condvars={'cn': col, 'name': str(cn).encode()})
+                 for cn in cubes]
+        coords = np.intersect1d(coords, np.concatenate(sel) if sel else np.array([], dtype=int))
+
+    for k in range(0, len(coords), chunksize):
+        yield store.select(key, where=coords[k:k+chunksize], columns=columns)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def IsFavBand(Pav_DF, band, Dang, box=None, where=None, cubes=None, chunksize=200000):
+    """
+    Inputs:
+      - Pav_DF (Pandas DataFrame) ----: DataFrame containing data of 3x3 boxes extracted from VIMS cubes,
+                                        or HDF5 store (or its file name) of boxes in 'table' format; in
+                                        that case only the selected rows and the needed channels are read.
+                                        Arrow and Parquet files (see 'VIMSU_arrow') are also accepted.
       - Band (list) ------------------: list specifying the properties of spectral bands used for the work.
       - Dang (float) -----------------: maximum relative standard deviation of angles between pixels in
                                         a given 3x3 boxes.
+      - box (int) --------------------: if given, only boxes of this size are used (multi-scale data,
+                                        with a 'box' column).
+      - where (string) ---------------: additional condition on data columns, see 'Pav_where' (files only).
+      - cubes (list) -----------------: if given, only boxes of these cubes are used (files only).
+      - chunksize (int) --------------: number of rows read at once (store only).
     Outputs:
       - IsFav_band_Da (list of Numpy array) --: average I/F for each band, for all 3x3 pixels boxes.
       - DIsF_band_Da (list of Numpy array) ---: relative standard deviation of I/F for each band, for
@@ -236,8 +560,56 @@ def IsFavBand(Pav_DF, band, Dang):
     IsFav_band_Da = [np.array([])]*nbr_band
     DIsF_band_Da  = [np.array([])]*nbr_band
 
-    for i in range(nbr_band):
-        IsFav_band_Da[i], DIsF_band_Da[i] = concat_VimsChan_lowAngDis (Pav_DF, band[i][0], band[i][1], Dang)
+    if isinstance(Pav_DF, str) and Pav_DF.endswith(('.arrow', '.feather', '.ipc', '.parquet', '.pq')):
+        # Arrow or Parquet file (see 'VIMSU_arrow'): only the angles and the spectral blocks are read.
+        from VIMSU_arrow import read_table, spectral_block, spectral_blocks, table_columns
+
+        scalars = ['Dinc', 'Deme', 'Dphase'] + (['box'] if box is not None else []) + \
+                  (['Cube name'] if cubes is not None else [])
+        if where is not None:
+            # Scalar columns of the file named in the condition (e.g. 'lat', 'res', 'Fmask'):
+            names    = set(re.findall(r'[A-Za-z_]\w*', where))
+            scalars += [c for c in table_columns(Pav_DF) if c in names and c not in spectral_blocks and c not in scalars]
+        table = read_table(Pav_DF, columns=scalars + ['DIsF', 'IFav'])
+        DF    = table.select(scalars).to_pandas()
+
+        keep = ((DF['Dphase'] < Dang) & (DF['Dinc'] < Dang) & (DF['Deme'] < Dang)).to_numpy()
+        if box is not None:
+            keep &= (DF['box'] == box).to_numpy()
+        if cubes is not None:
+            keep &= DF['Cube name'].isin(cubes).to_numpy()
+        if where is not None:
+            keep &= DF.eval(where).to_numpy()
+
+        DIsF_all  = spectral_block(table, 'DIsF')[keep]
+        IsFav_all = spectral_block(table, 'IFav')[keep]
+        # Same order as 'concat_VimsChan_lowAngDis': channel after channel, all boxes for each channel.
+        for i in range(nbr_band):
+            IsFav_band_Da[i] = IsFav_all[:, band[i][0]-1:band[i][1]].T.ravel()
+            DIsF_band_Da[i]  = DIsF_all[:, band[i][0]-1:band[i][1]].T.ravel()
+    elif isinstance(Pav_DF, (str, pd.HDFStore)):
+        # The angular (and other) criteria are applied by PyTables while reading:
+        # Each condition in brackets, so that a '|' in 'where' does not change the meaning of the query:
+        cond = ' & '.join(f'({c})' for c in [Pav_where(Dang=Dang, box=box), where] if c)
+        keys = [VIMS_band(b[0], b[1]) for b in band]
+        cols = sorted({k for kd, kf in keys for k in kd + kf}, key=lambda c: (c[:4], int(c[5:])))
+
+        parts = {c: [] for c in cols}
+        for chunk in read_Pav_chunks(Pav_DF, columns=cols, where=cond, cubes=cubes, chunksize=chunksize):
+            for c in cols:
+                parts[c].append(chunk[c].to_numpy())
+
+        # Same order as 'concat_VimsChan_lowAngDis': channel after channel, all boxes for each channel.
+        col_arr = {c: np.concatenate(parts[c]) if parts[c] else np.array([]) for c in cols}
+        for i, (list_DIsF, list_IsFav) in enumerate(keys):
+            IsFav_band_Da[i] = np.concatenate([col_arr[c] for c in list_IsFav])
+            DIsF_band_Da[i]  = np.concatenate([col_arr[c] for c in list_DIsF])
+    else:
+        if box is not None:
+            Pav_DF = Pav_DF[Pav_DF['box'] == box]
+
+        for i in range(nbr_band):
+            IsFav_band_Da[i], DIsF_band_Da[i] = concat_VimsChan_lowAngDis (Pav_DF, band[i][0], band[i][1], Dang)
 
     k=5
     #print (len(IsFav_band_Da[k]))
@@ -253,27 +625,506 @@ def IsFavBand(Pav_DF, band, Dang):
     #
 
 # -----------------------------------------------------------------------------------------------------------------------------------
-def plot_band_avIF_DIF(band, cubes_dir, cname, IsFav_band, DIsF_band, figname):
+# Versions of the cached functions, to be increased when their results change (old cached results are
+# then ignored):
+IsFavBand_version        = 2
+concat_DIsF_expo_version = 2
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def IsFavBand_cached(pav_file, band, Dang, box=None, where=None, cubes=None, cache=None):
+    """
+    Same as 'IsFavBand', for a HDF5 store of boxes, with the results kept in an on-disk cache: the
+    computation is made only once for a given content of the store and given parameters.
+    Inputs:
+      - pav_file (string) ------------: HDF5 store of boxes ('fixed' or 'table' format), or Arrow / Parquet
+                                        file (see 'VIMSU_arrow').
+      - band, Dang, box, where, cubes -: see 'IsFavBand'.
+      - cache (ResultCache) ----------: the cache, see 'VIMSU_cache'; the default one if None.
+    Outputs:
+      - the same as 'IsFavBand'.
+    """
+    from VIMSU_cache import ResultCache
+
+    if cache is None:
+        cache = ResultCache()
+
+    def compute():
+        if pav_file.endswith(('.arrow', '.feather', '.ipc', '.parquet', '.pq')):
+            return IsFavBand(pav_file, band, Dang, box=box, where=where, cubes=cubes)
+        with pd.HDFStore(pav_file, mode='r') as store:
+            if store.get_storer('Paves3x3_data').is_table:
+                return IsFavBand(store, band, Dang, box=box, where=where, cubes=cubes)
+            Pav_DF = store['Paves3x3_data']
+        if cubes is not None:
+            Pav_DF = Pav_DF[Pav_DF['Cube name'].isin(cubes)]
+        if where is not None:
+            Pav_DF = Pav_DF.query(where)
+        return IsFavBand(Pav_DF, band, Dang, box=box)
+
+    # Only the channels of the bands matter (not their colours):
+    res = cache.cached(compute, 'IsFavBand', IsFavBand_version, inputs=[pav_file],
+                       band=[[int(b[0]), int(b[1])] for b in band], Dang=float(Dang), box=box, where=where,
+                       cubes=None if cubes is None else sorted(cubes))
+    return list(res[0]), list(res[1])
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def concat_DIsF_expo_cached(pav_file, cubes_file, i0, i1, cache=None):
+    """
+    Same as 'concat_DIsF_expo', for HDF5 stores of boxes and of cubes, with the results kept in an
+    on-disk cache.
+    Inputs:
+      - pav_file (string) ----: HDF5 store of boxes.
+      - cubes_file (string) --: HDF5 store of cubes.
+      - i0, i1 (int) ---------: first and last VIMS channels of the band.
+      - cache (ResultCache) --: the cache, see 'VIMSU_cache'; the default one if None.
+    Outputs:
+      - the same as 'concat_DIsF_expo'.
+    """
+    from VIMSU_cache import ResultCache
+
+    if cache is None:
+        cache = ResultCache()
+
+    def compute():
+        DIsF_moy, expo_time = concat_DIsF_expo(pd.read_hdf(pav_file, 'Paves3x3_data'),
+                                               pd.read_hdf(cubes_file, 'Cubes_global_data'), i0, i1)
+        return [DIsF_moy], [expo_time]
+
+    res = cache.cached(compute, 'concat_DIsF_expo', concat_DIsF_expo_version, inputs=[pav_file, cubes_file],
+                       i0=int(i0), i1=int(i1))
+    return res[0][0], res[1][0]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def bin_band_avIF_DIF(IsFav_band, DIsF_band, bins=(320, 330), xlim=(-0.02, 0.30), ylim=(-3.2, 0.10)):
+    """
+    2D histograms of (average I/F, relative standard deviation) for each spectral band, computed
+    in a single vectorized pass over all bands.
+    Inputs:
+      - IsFav_band (list of numpy arrays) ---: average I/F for each band, for all 3x3 pixels boxes.
+      - DIsF_band (list of numpy arrays) ----: relative standard deviation of I/F for each band.
+      - bins (tuple of int) -----------------: number of bins along I/F and DIsF axes.
+      - xlim, ylim (tuples) -----------------: ranges of I/F and DIsF covered by the bins.
+    Outputs:
+      - H (numpy array) ---------------------: counts, with shape (nbr_band, bins[0], bins[1]).
+      - xedges, yedges (numpy arrays) -------: bin edges along I/F and DIsF axes.
+    These arrays can be given back to 'plot_band_avIF_DIF' to re-style the figure without binning again.
+    """
+    nbr_band = len(IsFav_band)
+    nx, ny   = bins
+    xedges   = np.linspace(xlim[0], xlim[1], nx + 1)
+    yedges   = np.linspace(ylim[0], ylim[1], ny + 1)
+
+    x = np.concatenate([np.asarray(a, dtype=float) for a in IsFav_band])
+    y = np.concatenate([np.asarray(a, dtype=float) for a in DIsF_band])
+    b = np.repeat(np.arange(nbr_band), [len(a) for a in IsFav_band])
+
+    ix = np.floor((x - xlim[0]) / (xlim[1] - xlim[0]) * nx)
+    iy = np.floor((y - ylim[0]) / (ylim[1] - ylim[0]) * ny)
+    ok = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny) # Also removes NaN.
+
+    flat = (b[ok] * nx + ix[ok].astype(int)) * ny + iy[ok].astype(int)
+    H = np.bincount(flat, minlength=nbr_band * nx * ny).reshape(nbr_band, nx, ny)
+
+    return H, xedges, yedges
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def IsF_bin_edges(IsF, bins=30, spacing='quantile', xlim=None):
+    """
+    Edges of the I/F bins used for the statistics of DIsF.
+    Inputs:
+      - IsF (numpy array) --: average I/F of the boxes (> 0).
+      - bins (int) ---------: number of bins.
+      - spacing (string) ---: 'quantile' (the same number of boxes in each bin), 'log' or 'linear'.
+      - xlim (tuple) -------: range of I/F covered by the bins (whole range of data if None).
+    Outputs:
+      - edges (numpy array) -: bins+1 increasing values.
+    """
+    IsF = np.asarray(IsF, dtype=float)
+    lo, hi = (IsF.min(), IsF.max()) if xlim is None else xlim
+    if spacing == 'quantile':
+        x = IsF[(IsF >= lo) & (IsF <= hi)]
+        return np.unique(np.quantile(x, np.linspace(0., 1., bins + 1)))
+    if spacing == 'log':
+        return np.geomspace(lo, hi, bins + 1)
+    if spacing == 'linear':
+        return np.linspace(lo, hi, bins + 1)
+    raise ValueError(f"Unknown spacing of bins '{spacing}', 'quantile', 'log' or 'linear' expected.")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _sort_in_bins(IsF, DIsF, edges):
+    """
+    Bin index of each box, and boxes sorted by bin then by DIsF: the boxes of a bin are then contiguous and
+    ordered, so that quantiles of all bins are obtained with a single 'searchsorted'.
+    """
+    nb = len(edges) - 1
+    ib = np.searchsorted(edges, IsF, side='right') - 1
+    ib[IsF == edges[-1]] = nb - 1 # The last bin includes its right edge.
+    ok = (ib >= 0) & (ib < nb) & np.isfinite(DIsF)
+    ib, x, y = ib[ok], IsF[ok], DIsF[ok]
+    order = np.lexsort((y, ib))
+    return ib[order], x[order], y[order]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _binned_reduce(ib, x, y, w, nb, q, moments=True):
+    """
+    Weighted statistics of y in each bin, for boxes sorted by '_sort_in_bins' ('w' are integer
+    weights: 1 for the data, numbers of draws of each box for bootstrap samples).
+    Outputs:
+      - n, x_mean (numpy arrays) --: per bin.
+      - mean, std (numpy arrays) --: per bin, None if not 'moments'.
+      - quant (numpy array) -------: quantiles 'q' (fractions), shape (len(q), nb), without interpolation.
+    """
+    # Cumulated sums at the bounds of bins (boxes of a bin are contiguous):
+    bounds = np.searchsorted(ib, np.arange(nb + 1))
+    cw  = np.cumsum(w)
+    cw0 = np.concatenate(([0], cw))
+    n   = np.diff(cw0[bounds]).astype(float)
+    full = n > 0
+    cx  = np.concatenate(([0.], np.cumsum(w * x)))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.diff(cx[bounds]) / n
+        mean = std = None
+        if moments:
+            y0   = np.average(y, weights=w) # Shift, for the accuracy of the variance.
+            mean = np.bincount(ib, weights=w*(y - y0), minlength=nb) / n
+            var  = np.bincount(ib, weights=w*(y - y0)**2, minlength=nb) / n - mean**2
+            std  = np.sqrt(np.maximum(var, 0.))
+            mean += y0
+            mean[~full] = std[~full] = np.nan
+    x_mean[~full] = np.nan
+
+    # Quantile q of a bin: first box of the bin whose cumulated weight reaches q times the bin weight.
+    start = cw0[bounds[:-1]]
+    quant = np.full((len(q), nb), np.nan)
+    for k, qk in enumerate(q):
+        idx = np.searchsorted(cw, start + np.maximum(qk * n, 0.5), side='left')
+        quant[k, full] = y[np.minimum(idx[full], len(y) - 1)]
+    return n, x_mean, mean, std, quant
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def binned_DIsF_stats(IsF, DIsF, bins=30, spacing='quantile', xlim=None, percentiles=(16., 84.)):
+    """
+    Statistics of DIsF (log10 of the relative standard deviation of I/F) in bins of average I/F, for one
+    band. Boxes are sorted once by bin and DIsF, and all the bins are reduced together ('bincount' and
+    'searchsorted'), so that millions of boxes are processed in a fraction of a second.
+    Inputs:
+      - IsF, DIsF (numpy arrays) --: average I/F and DIsF of the boxes of the band (see 'IsFavBand').
+      - bins (int or array) -------: number of bins, or their edges.
+      - spacing, xlim -------------: see 'IsF_bin_edges'.
+      - percentiles (tuple) -------: percentiles of DIsF computed in each bin (median is always computed),
+                                     as order statistics (no interpolation between boxes).
+    Outputs:
+      - stats (Pandas DataFrame) --: one row per bin, columns 'IsF_min', 'IsF_max', 'IsF_mean', 'N',
+                                     'mean', 'std', 'median', 'p<percentile>'.
+    """
+    IsF  = np.asarray(IsF, dtype=float)
+    DIsF = np.asarray(DIsF, dtype=float)
+    edges = IsF_bin_edges(IsF, bins, spacing, xlim) if np.isscalar(bins) else np.asarray(bins, dtype=float)
+    return _stats_frame(edges, *_sort_in_bins(IsF, DIsF, edges), percentiles)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _stats_frame(edges, ib, x, y, percentiles):
+    """
+    DataFrame of 'binned_DIsF_stats', for boxes already sorted by '_sort_in_bins'.
+    """
+    q = [0.5] + [p / 100. for p in percentiles]
+    n, x_mean, mean, std, quant = _binned_reduce(ib, x, y, np.ones(len(y)), len(edges) - 1, q)
+
+    stats = pd.DataFrame({'IsF_min': edges[:-1], 'IsF_max': edges[1:], 'IsF_mean': x_mean, 'N': n.astype(int),
+                          'mean': mean, 'std': std, 'median': quant[0]})
+    for p, qp in zip(percentiles, quant[1:]):
+        stats[f'p{p:g}'] = qp
+    return stats
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+# Uncertainty laws, giving DIsF = log10(sigma(I/F) / (I/F)) as a function of I/F:
+#   - 'power': sigma/I = 10**a * I**b, i.e. DIsF = a + b*log10(I).
+#   - 'noise': sigma = sqrt(s0**2 + (f*I)**2), a constant noise plus a term proportional to the signal,
+#              parameters (log10(s0), log10(f)).
+uncert_laws = {'power': ('a', 'b'),
+               'noise': ('log10_s0', 'log10_f')}
+
+def uncert_law(IsF, params, law='power'):
+    """
+    DIsF given by an uncertainty law (see 'uncert_laws') for average I/F values 'IsF'.
+    """
+    lx = np.log10(IsF)
+    if law == 'power':
+        return params[0] + params[1] * lx
+    if law == 'noise':
+        return 0.5 * np.logaddexp(2*np.log(10)*(params[0] - lx), 2*np.log(10)*params[1]) / np.log(10)
+    raise ValueError(f"Unknown law '{law}', expected one of {list(uncert_laws)}.")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _fit_law(x, y, sigma, law, p0=None, fixed=None):
+    """
+    Weighted least-squares fit of a law to binned medians. 'fixed' (array, NaN for the fitted parameters) gives
+    the values of the parameters of a 'noise' law that are not fitted.
+    """
+    ok = np.isfinite(x) & np.isfinite(y) & np.isfinite(sigma) & (sigma > 0)
+    x, y, sigma = x[ok], y[ok], sigma[ok]
+    if len(x) < 3:
+        return np.full(len(uncert_laws[law]), np.nan) # Not enough bins.
+    A = np.vstack([np.ones_like(x), np.log10(x)]).T / sigma[:, None]
+    power = np.linalg.lstsq(A, y / sigma, rcond=None)[0]
+    if law == 'power':
+        return power
+
+    from scipy.optimize import curve_fit
+
+    if p0 is None:
+        # Start: noise-dominated at low I/F, proportional at high I/F.
+        p0 = [np.log10(x.min()) + y[np.argmin(x)], y[np.argmax(x)]]
+    # Bounds of the parameters, to keep the fit in a physical range (a term not constrained by the data
+    # stops anywhere on the plateau of the chi2, see '_constrain_params'):
+    lo, hi = noise_bounds
+    p0 = np.clip(p0, lo, hi)
+    if fixed is None or not np.any(np.isfinite(fixed)):
+        popt, _ = curve_fit(lambda xx, a, b: uncert_law(xx, (a, b), law), x, y, p0=p0, sigma=sigma, bounds=(lo, hi),
+                            maxfev=2000)
+        return popt
+
+    # Only the parameters not fixed are fitted:
+    fit = ~np.isfinite(fixed)
+    def with_fixed(p):
+        pp = np.array(fixed, dtype=float)
+        pp[fit] = p
+        return pp
+    popt, _ = curve_fit(lambda xx, *p: uncert_law(xx, with_fixed(p), law), x, y, p0=p0[fit], sigma=sigma,
+                        bounds=(np.asarray(lo)[fit], np.asarray(hi)[fit]), maxfev=2000)
+    return with_fixed(popt)
+
+# Bounds of the parameters of the 'noise' law:
+noise_bounds = ([-10., -10.], [2., 2.])
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _chi2_law(x, y, sigma, law, params):
+    """
+    chi2 of a law with respect to binned medians (bins with NaN sigma are not used).
+    """
+    ok = np.isfinite(x) & np.isfinite(y) & np.isfinite(sigma) & (sigma > 0)
+    return np.sum(((y[ok] - uncert_law(x[ok], params, law)) / sigma[ok])**2)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _profile_excess(x, y, sigma, law, params, j, v, ci):
+    """
+    Profile of the chi2 of a 'noise' law fit: chi2 for the parameter 'j' set to 'v' (the other parameter fitted
+    again), minus the chi2 of the best fit 'params', minus the quantile 'ci' (%) of a chi2 with one degree of
+    freedom. Values of the parameter allowed at the 'ci' level give a negative excess.
+    """
+    from scipy.optimize import curve_fit
+    from scipy.stats import chi2
+
+    lo, hi = noise_bounds
+    k  = 1 - j
+    ok = np.isfinite(x) & np.isfinite(y) & np.isfinite(sigma) & (sigma > 0)
+
+    def with_v(p):
+        pp = np.empty(2)
+        pp[j], pp[k] = v, p
+        return pp
+
+    try:
+        pk, _ = curve_fit(lambda xx, p: uncert_law(xx, with_v(p), law), x[ok], y[ok], p0=[np.clip(params[k], lo[k], hi[k])],
+                          sigma=sigma[ok], bounds=([lo[k]], [hi[k]]))
+    except RuntimeError:
+        return np.inf
+    return _chi2_law(x, y, sigma, law, with_v(pk[0])) - _chi2_law(x, y, sigma, law, params) - chi2.ppf(ci / 100., 1)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def _constrain_params(x, y, sigma, law, params, ci):
+    """
+    Parameters of a 'noise' law fit not constrained by the data, e.g. the proportional term when the noise is
+    constant over the range of I/F: 'curve_fit' stops anywhere on the plateau of the chi2 for such a parameter,
+    its value and its bootstrap interval are meaningless. A parameter is constrained when the profile of the
+    chi2 (see '_profile_excess') rises above the 'ci' level on both sides of the best value, within the bounds;
+    otherwise only an upper limit is given, when the profile rises at the upper bound.
+    Outputs:
+      - free (numpy array) ---: boolean, per parameter.
+      - upper (numpy array) --: upper limits of the free parameters (NaN if none, or constrained parameter).
+    """
+    from scipy.optimize import brentq
+
+    params = np.asarray(params, dtype=float)
+    free   = np.zeros(len(params), dtype=bool)
+    upper  = np.full(len(params), np.nan)
+    if law != 'noise' or not np.all(np.isfinite(params)):
+        return free, upper
+
+    lo, hi = noise_bounds
+    for j in range(len(params)):
+        excess = lambda v: _profile_excess(x, y, sigma, law, params, j, v, ci)
+        e_lo, e_hi = excess(lo[j]), excess(hi[j])
+        if e_lo > 0. and e_hi > 0.:
+            continue
+        free[j] = True
+        if e_lo <= 0. < e_hi:
+            start    = min(max(params[j], lo[j]), hi[j])
+            upper[j] = brentq(excess, start, hi[j], xtol=1e-3) if excess(start) < 0. else start
+    return free, upper
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def fit_DIsF_law(IsF, DIsF, law='power', bins=30, spacing='quantile', xlim=None, n_boot=200, ci=95., \
+                 min_count=10, seed=None):
+    """
+    Fit of an uncertainty law to the median DIsF in bins of I/F, for one band, with bootstrap confidence
+    intervals of its parameters. Bootstrap samples are given as numbers of draws of the sorted boxes, so
+    that each sample costs a 'bincount', a 'cumsum' and a 'searchsorted', without sorting again.
+    Inputs:
+      - IsF, DIsF (numpy arrays) --: average I/F and DIsF of the boxes of the band (see 'IsFavBand').
+      - law (string) --------------: 'power' or 'noise', see 'uncert_laws'.
+      - bins, spacing, xlim -------: see 'binned_DIsF_stats'.
+      - n_boot (int) --------------: number of bootstrap samples (0: no confidence intervals).
+      - ci (float) ----------------: confidence level (%).
+      - min_count (int) -----------: bins with fewer boxes are not used in the fit; bands with fewer boxes
+                                     are not fitted at all (NaN parameters and confidence intervals).
+      - seed (int) ----------------: seed of the random generator.
+    Outputs:
+      - fit (dict) ----------------: 'law', 'N' (number of usable boxes: finite, positive I/F, inside
+                                     'xlim'), 'params' (dict name -> value), 'ci' (dict name -> (low, high)),
+                                     'boot' (numpy array of bootstrap parameters), 'stats' (see
+                                     'binned_DIsF_stats'). A parameter of the 'noise' law not constrained
+                                     by the data (see '_constrain_params') has a NaN value, and 'ci' gives
+                                     (NaN, upper limit at the 'ci' level).
+    """
+    IsF  = np.asarray(IsF, dtype=float)
+    DIsF = np.asarray(DIsF, dtype=float)
+    names = uncert_laws[law]
+
+    # Empty bands, or too few boxes (e.g. strict angular criterion): no fit.
+    usable = np.isfinite(IsF) & np.isfinite(DIsF) & (IsF > 0)
+    if xlim is not None:
+        usable &= (IsF >= xlim[0]) & (IsF <= xlim[1])
+    if usable.sum() < min_count:
+        stats = pd.DataFrame(columns=['IsF_min', 'IsF_max', 'IsF_mean', 'N', 'mean', 'std', 'median', 'p16', 'p84'])
+        return {'law': law,
+                'N': int(usable.sum()),
+                'params': dict.fromkeys(names, np.nan),
+                'ci': {nm: (np.nan, np.nan) for nm in names},
+                'boot': np.full((n_boot, len(names)), np.nan),
+                'stats': stats}
+
+    IsF, DIsF = IsF[usable], DIsF[usable]
+    if np.isscalar(bins):
+        bins  = max(min(bins, len(IsF) // min_count), 1) # Small bands: fewer bins, all of them usable.
+        edges = IsF_bin_edges(IsF, bins, spacing, xlim)
+    else:
+        edges = np.asarray(bins, dtype=float)
+    nb = len(edges) - 1
+    ib, x, y = _sort_in_bins(IsF, DIsF, edges)
+    stats = _stats_frame(edges, ib, x, y, percentiles=(16., 84.))
+
+    # Uncertainty of the median of a bin, from the spread of DIsF (gaussian approximation):
+    n     = stats['N'].to_numpy()
+    sigma = 1.2533 * 0.5 * (stats['p84'] - stats['p16']).to_numpy() / np.sqrt(np.maximum(n, 1))
+    sigma = np.where(sigma > 0, sigma, np.min(sigma[sigma > 0]) if np.any(sigma > 0) else 1.)
+    sigma[n < min_count] = np.nan # Not used in the fit.
+
+    xs, ys = stats['IsF_mean'].to_numpy(), stats['median'].to_numpy()
+    params = _fit_law(xs, ys, sigma, law)
+
+    # Parameters not constrained by the data (profile of the chi2): the corresponding term is negligible, it is
+    # set to its lower bound and the other parameters are fitted again (also for the bootstrap samples).
+    free, upper = _constrain_params(xs, ys, sigma, law, params, ci)
+    fixed = None
+    if free.any() and not free.all():
+        fixed  = np.where(free, noise_bounds[0], np.nan)
+        params = _fit_law(xs, ys, sigma, law, p0=params, fixed=fixed)
+
+    rng  = np.random.default_rng(seed)
+    boot = np.full((n_boot, len(params)), np.nan)
+    for k in range(n_boot):
+        w = np.bincount(rng.integers(0, len(y), len(y)), minlength=len(y)) # Draws with replacement.
+        _, xb, _, _, qb = _binned_reduce(ib, x, y, w, nb, [0.5], moments=False)
+        try:
+            boot[k] = _fit_law(xb, qb[0], sigma, law, p0=params, fixed=fixed)
+        except RuntimeError: # No convergence of 'curve_fit', the sample is not used.
+            pass
+
+    # Percentiles of the bootstrap parameters (NaN if all the samples failed, e.g. for small bands):
+    alpha  = (100. - ci) / 2.
+    bounds = np.full((2, len(params)), np.nan)
+    some   = np.isfinite(boot).any(axis=0)
+    if some.any():
+        bounds[:, some] = np.nanpercentile(boot[:, some], [alpha, 100. - alpha], axis=0)
+
+    # Parameters not constrained by the data: no value, only an upper limit.
+    bounds[0, free], bounds[1, free] = np.nan, upper[free]
+    params = np.where(free, np.nan, params)
+    return {'law': law,
+            'N': len(IsF),
+            'params': dict(zip(names, params)),
+            'ci': {nm: (bounds[0, i], bounds[1, i]) for i, nm in enumerate(names)},
+            'boot': boot,
+            'stats': stats}
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def fit_band_DIsF_law(band, IsFav_band, DIsF_band, law='power', **kwargs):
+    """
+    Uncertainty law of each spectral band, see 'fit_DIsF_law'.
+    Inputs:
+      - band (list) ------------------: bands [[i0, i1, color], ...], see 'IsFavBand'.
+      - IsFav_band, DIsF_band --------: outputs of 'IsFavBand'.
+      - law, kwargs ------------------: see 'fit_DIsF_law'.
+    Outputs:
+      - table (Pandas DataFrame) -----: one row per band: first and last channels, number of usable boxes, parameters
+                                        of the law and bounds of their confidence intervals.
+      - fits (list of dict) ----------: full outputs of 'fit_DIsF_law', with binned statistics.
+    """
+    rows = []
+    fits = []
+    for b, IsF, DIsF in zip(band, IsFav_band, DIsF_band):
+        fit = fit_DIsF_law(IsF, DIsF, law=law, **kwargs)
+        row = {'i0': b[0], 'i1': b[1], 'N': fit['N'], 'law': law}
+        for nm, v in fit['params'].items():
+            row[nm] = v
+            row[nm + '_low'], row[nm + '_high'] = fit['ci'][nm]
+        rows.append(row)
+        fits.append(fit)
+    return pd.DataFrame(rows), fits
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def plot_band_avIF_DIF(band, cubes_dir, cname, IsFav_band, DIsF_band, figname, mode='scatter', density=None, \
+                       ref_spectrum=None, px=(3, 4), dpi=300):
     """
     Inputs:
  #     - nbr_band (int) ----------------------: number of spectral bands considered.
       - band (list) -------------------------: contains the specification of employed spectral bands.
       - cubes_dir (string) ------------------: name of the VIMS cubes directory.
-      - cname (string) ----------------------: an example
+      - cname (string) ----------------------: an example cube, whose spectrum is plotted as a reference.
       - IsFav_band (list of numpy arrays) ---: average I/F for each band, for all 3x3 pixels boxes.
       - DIsF_band (list of numpy arrays) ----: relative standard deviation of I/F for each band, for
                                                all 3x3 pixels boxes.
       - figPDFname (string) -----------------: name of the PDF file in which the figure is saved.
+      - mode (string) -----------------------: 'scatter' (one marker per box) or 'density' (2D histograms
+                                               drawn as images, much faster for large datasets).
+      - density (tuple) ---------------------: output of 'bin_band_avIF_DIF', computed if not provided in
+                                               'density' mode.
+      - ref_spectrum (tuple) ----------------: (wavelengths, I/F) of the reference spectrum, read in the
+                                               pixel 'px' of cube 'cname' if not provided.
+      - px (tuple) --------------------------: (sample, line) of the reference pixel.
+      - dpi (int) ---------------------------: resolution of the saved figure.
+    Outputs:
+      - density (tuple) ---------------------: the binned data in 'density' mode, None otherwise.
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as colors
+    from matplotlib.patches import Rectangle
+    from matplotlib.ticker import AutoMinorLocator
+    from pyvims import VIMS
+
     # ---------------------------------------------------------------------------
     fig, (ax0, ax1) = plt.subplots(2, 1, figsize=(15, 10), tight_layout=True)
     # ---------------------------------------------------------------------------
 
     nbr_band = len(band)
-    cub_VIMS = VIMS('1732876622_1', root=cubes_dir)
-    px = [3, 4]
-    cann_lambda = cub_VIMS.wvlns
-    spectre = cub_VIMS[px].spectrum
+    if ref_spectrum is None:
+        cub_VIMS = VIMS(cname, root=cubes_dir)
+        cann_lambda = cub_VIMS.wvlns
+        spectre = cub_VIMS[list(px)].spectrum
+    else:
+        cann_lambda, spectre = ref_spectrum
 
     BANDS = {
         1: (band[0][0], band[0][1], band[0][2]),
@@ -306,7 +1157,7 @@ def plot_band_avIF_DIF(band, cubes_dir, cname, IsFav_band, DIsF_band, figname):
     ax0.scatter(cann_lambda, spectre, color='steelblue', s=10)
 
     for i, (b0, b1, color) in BANDS.items():
-        w0, w1 = cub_VIMS.wvlns[b0], cub_VIMS.wvlns[b1]
+        w0, w1 = cann_lambda[b0], cann_lambda[b1]
 
         print(f'Band {i}: {b0}-{b1} | {w0:.3f}-{w1:.3f} µm')
 
@@ -327,12 +1178,35 @@ def plot_band_avIF_DIF(band, cubes_dir, cname, IsFav_band, DIsF_band, figname):
 
     malpha = 0.1
 
-    for i in range(nbr_band):
-        ax1.scatter(IsFav_band[i], DIsF_band[i], color=band[i][2], s=2, marker='.', alpha=malpha)
+    if mode == 'density':
+        if density is None:
+            density = bin_band_avIF_DIF(IsFav_band, DIsF_band)
+        H, xedges, yedges = density
+        extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
+        # Each band is painted in its own colour, with an opacity following the log of the box density,
+        # and the bands are composited ("over" operator) into a single image, drawn once:
+        rgb_acc = np.zeros(H.shape[2:0:-1] + (3,))
+        a_acc   = np.zeros(H.shape[2:0:-1])
+        for i in range(nbr_band):
+            dens  = np.log1p(H[i].T)
+            alpha = dens / dens.max() if dens.max() > 0 else dens
+            rgb_acc = np.asarray(colors.to_rgb(band[i][2])) * alpha[..., None] + rgb_acc * (1. - alpha[..., None])
+            a_acc   = alpha + a_acc * (1. - alpha)
+        rgba = np.zeros(a_acc.shape + (4,))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rgba[..., :3] = np.where(a_acc[..., None] > 0, rgb_acc / a_acc[..., None], 0.)
+        rgba[..., 3] = a_acc
+        ax1.imshow(rgba, extent=extent, origin='lower', aspect='auto', interpolation='nearest')
+        ax1.set_xlim(-0.02, 0.30)
+        ax1.set_ylim(-3.2, 0.10)
+    else:
+        density = None
+        for i in range(nbr_band):
+            ax1.scatter(IsFav_band[i], DIsF_band[i], color=band[i][2], s=2, marker='.', alpha=malpha)
     #
     # ---------------------------------------------------------------------------
     # On sauvegarde dans un fichier :
-    fig.savefig(figname, dpi=300, facecolor='w', edgecolor='w',
+    fig.savefig(figname, dpi=dpi, facecolor='w', edgecolor='w',
             orientation='landscape')
 
-    return
+    return density
@@ -0,0 +1,193 @@
+"""
+Export of the extracted data to Apache Arrow (IPC / Feather v2) and Parquet files, and memory-mapped loading.
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Arrow / Parquet files of cubes and boxes data
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import json
+import os.path
+import re
+
+import numpy as np
+
+# 'pyarrow' (and 'pandas') are imported in the functions using them, 'pyarrow' is only needed for these
+# files.
+
+# Number of VIMS channels, length of the spectral columns:
+Nchan_VIMS = 256
+
+# Spectral blocks of the DataFrame of boxes ('DIsF_1', ..., 'DIsF_256' and 'IFav_1', ..., 'IFav_256'), each one
+# stored as a single column of fixed-size lists:
+spectral_blocks = ['DIsF', 'IFav']
+
+# Extensions of the two formats:
+arrow_ext   = ('.arrow', '.feather', '.ipc')
+parquet_ext = ('.parquet', '.pq')
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def DF_to_table(DF, metadata=None):
+    """
+    Arrow table of a DataFrame of cubes or of boxes; the 256 columns of each spectral block (e.g. 'DIsF_1',
+    ..., 'DIsF_256') are gathered in one column ('DIsF') of fixed-size lists of 256 values.
+    Inputs:
+      - DF (Pandas DataFrame) --: 'Cubes_DF' or 'Pav_DF'.
+      - metadata (dict) --------: description of the columns, kept in the schema.
+    Outputs:
+      - table (pyarrow Table).
+    """
+    import pyarrow as pa
+
+    DF = DF.infer_objects() # Columns built row by row have the 'object' type.
+    arrays, names = [], []
+    done = set()
+    for col in DF.columns:
+        m = re.fullmatch(r'(\w+)_(\d+)', col)
+        if m is not None and m.group(1) in spectral_blocks:
+            block = m.group(1)
+            if block in done:
+                continue
+            cols = [f'{block}_{i+1}' for i in range(Nchan_VIMS)]
+            values = np.ascontiguousarray(DF[cols].to_numpy(dtype=np.float64)).ravel()
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values), Nchan_VIMS))
+            names.append(block)
+            done.add(block)
+        else:
+            arrays.append(pa.array(DF[col].to_numpy() if DF[col].dtype != object else DF[col].astype(str)))
+            names.append(col)
+
+    meta = {'VIMSU_blocks': json.dumps(sorted(done))}
+    if metadata is not None:
+        meta['VIMSU_metadata'] = json.dumps(metadata)
+    return pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(meta)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def write_DF_arrow(DF, filename, metadata=None, row_group_size=131072):
+    """
+    Write a DataFrame of cubes or of boxes in an Arrow IPC (Feather v2) file, or in a Parquet file, according to
+    the extension of 'filename' (see 'arrow_ext' and 'parquet_ext').
+    Arrow files are not compressed, so that they can be memory-mapped and read without copy; Parquet files
+    are compressed (zstd), they are smaller but must be decoded.
+    Inputs:
+      - DF (Pandas DataFrame) --: 'Cubes_DF' or 'Pav_DF'.
+      - filename (string) ------: output file.
+      - metadata (dict) --------: description of the columns.
+      - row_group_size (int) ---: rows per row group of Parquet files (Arrow files are written as a single
+                                  record batch, so that spectral blocks are contiguous in the file).
+    """
+    import pyarrow as pa
+
+    table = DF_to_table(DF, metadata)
+    if filename.endswith(arrow_ext):
+        with pa.OSFile(filename, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table.combine_chunks())
+    elif filename.endswith(parquet_ext):
+        import pyarrow.parquet as pq
+        pq.write_table(table, filename, compression='zstd', row_group_size=row_group_size)
+    else:
+        raise ValueError(f"Unknown extension of '{filename}', expected one of {arrow_ext + parquet_ext}.")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def read_table(filename, columns=None, memory_map=True):
+    """
+    Read an Arrow IPC or Parquet file written by 'write_DF_arrow'. With Arrow files, the file is memory-mapped:
+    opening is immediate, and only the pages of the columns actually used are read from the disk.
+    Inputs:
+      - filename (string) --: the file.
+      - columns (list) -----: columns to be read (all if None), e.g. ['Dinc', 'Deme', 'Dphase', 'DIsF'].
+      - memory_map (bool) --: memory mapping of Arrow files.
+    Outputs:
+      - table (pyarrow Table).
+    """
+    import pyarrow as pa
+
+    if filename.endswith(arrow_ext):
+        source = pa.memory_map(filename, 'r') if memory_map else pa.OSFile(filename, 'rb')
+        table  = pa.ipc.open_file(source).read_all()
+        return table if columns is None else table.select(columns)
+    if filename.endswith(parquet_ext):
+        import pyarrow.parquet as pq
+        return pq.read_table(filename, columns=columns, memory_map=memory_map)
+    raise ValueError(f"Unknown extension of '{filename}', expected one of {arrow_ext + parquet_ext}.")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def table_columns(filename):
+    """
+    Names of the columns of an Arrow IPC or Parquet file written by 'write_DF_arrow', read from its schema only.
+    """
+    import pyarrow as pa
+
+    if filename.endswith(arrow_ext):
+        with pa.memory_map(filename, 'r') as source:
+            return pa.ipc.open_file(source).schema.names
+    if filename.endswith(parquet_ext):
+        import pyarrow.parquet as pq
+        return pq.read_schema(filename).names
+    raise ValueError(f"Unknown extension of '{filename}', expected one of {arrow_ext + parquet_ext}.")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def table_metadata(table):
+    """
+    Description of the columns recorded by 'write_DF_arrow' (None if there is none).
+    """
+    meta = table.schema.metadata or {}
+    return json.loads(meta[b'VIMSU_metadata']) if b'VIMSU_metadata' in meta else None
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def spectral_block(table, block):
+    """
+    Spectral block of a table as a 2D NumPy array of shape (number of rows, 256), without copy when the
+    column is made of a single chunk (Arrow files written by 'write_DF_arrow' and memory-mapped).
+    Inputs:
+      - table (pyarrow Table) --: see 'read_table'.
+      - block (string) ---------: 'DIsF' or 'IFav'.
+    Outputs:
+      - arr (numpy array) ------: arr[k, i-1] is the value of channel i for the k-th row.
+    """
+    col = table.column(block)
+    parts = []
+    for chunk in col.chunks:
+        # 'values' ignores the offset of sliced arrays, 'flatten' takes it into account:
+        flat = chunk.flatten().to_numpy(zero_copy_only=True)
+        parts.append(flat.reshape(-1, Nchan_VIMS))
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts) if parts else np.empty((0, Nchan_VIMS))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def table_to_DF(table):
+    """
+    DataFrame with the original layout ('DIsF_1', ..., 'IFav_256' columns) of a table read by 'read_table'.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    parts = []
+    for name in table.column_names:
+        if name in spectral_blocks and pa.types.is_fixed_size_list(table.schema.field(name).type):
+            parts.append(pd.DataFrame(spectral_block(table, name),
+                                      columns=[f'{name}_{i+1}' for i in range(Nchan_VIMS)]))
+        else:
+            parts.append(table.column(name).to_pandas().rename(name).to_frame())
+    return pd.concat(parts, axis=1)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def convert_HDF5(hdf5_file, key, out_file):
+    """
+    Conversion of a HDF5 store (e.g. 'stoDFrame_PavData_NEW.hdf5') into an Arrow or Parquet file.
+    Inputs:
+      - hdf5_file (string) --: the store.
+      - key (string) --------: key of the DataFrame in the store ('Cubes_global_data' or 'Paves3x3_data').
+      - out_file (string) ---: output file, see 'write_DF_arrow'.
+    """
+    import pandas as pd
+
+    with pd.HDFStore(hdf5_file, mode='r') as store:
+        DF = store[key]
+        metadata = getattr(store.get_storer(key).attrs, 'metadata', None)
+    write_DF_arrow(DF, out_file, metadata)
+    return os.path.getsize(out_file)
@@ -0,0 +1,446 @@
+"""
+Command-line interface: headless batch runs of the extraction and of the analysis.
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+
+Examples:
+  - extraction of the 4th shard (among 16) of the list of cubes, e.g. in a job array:
+      python VIMSU_batch.py extract --shard 3/16 --out-dir SHARDS
+  - merge of all the shards into the canonical HDF5 stores:
+      python VIMSU_batch.py merge --shard-dir SHARDS --out-cubes stoDFrame_CubeData.hdf5 \\
+                                  --out-pav stoDFrame_PavData.hdf5
+  - catalogue of the cubes (from their labels only), and list of the cubes with at least 32x32 pixels:
+      python VIMSU_batch.py catalog --cubes-dir VIMS_CALCUBES --where 'Nsample >= 32 & Nline >= 32'
+  - analysis (figure DIsF vs I/F):
+      python VIMSU_batch.py analyse --pav-file stoDFrame_PavData.hdf5 --dang 3
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Batch command-line entry point for IR photometric uncertainties
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import argparse
+import glob
+import os.path
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from VIMSU_fetch import VIMS_DATA_PORTAL
+
+# Spectral bands used in the paper: first and last VIMS channels, Matplotlib color.
+default_bands = [[7,     8, 'olive'],
+                 [16,   18, 'hotpink'],
+                 [30,   34, 'slategray'],
+                 [50,   53, 'coral'],
+                 [88,   93, 'deepskyblue'],
+                 [170, 180, 'goldenrod']]
+
+# Names of the shard files, in the output directory of 'extract':
+shard_fmt = '{kind}_shard{i:04d}of{N:04d}.hdf5'
+shard_re  = re.compile(r'(CubeData|PavData)_shard(\d+)of(\d+)\.hdf5$')
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def parse_shard(txt):
+    """
+    Parse a shard specification 'i/N' (0 <= i < N).
+    """
+    m = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', txt)
+    if m is None:
+        raise argparse.ArgumentTypeError(f"bad shard '{txt}', expected 'i/N'")
+    i, N = int(m.group(1)), int(m.group(2))
+    if N < 1 or i >= N:
+        raise argparse.ArgumentTypeError(f"bad shard '{txt}', 0 <= i < N is required")
+    return i, N
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def read_cubes_list(cub_list_CSV):
+    """
+    Read the list of cube names in the CSV file (the first line is the header).
+    """
+    clist = np.loadtxt(cub_list_CSV, delimiter=",", dtype=str)
+    return np.delete(clist, 0)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_extract(args):
+    """
+    Extraction of 3x3 boxes for the whole list of cubes, or for one of its shards.
+    """
+    from VIMSU_1 import VIMS_u, write_DF_HDF5, Cubes_metadata, Pav_metadata, Cubes_key, Pav_key, Pav_data_columns
+
+    for path, what in [(args.list, 'CSV file'), (args.cubes_dir, 'cubes directory')]:
+        if not os.path.exists(path):
+            sys.exit(f" > The {what} '{path}' is not available, we stop!")
+
+    # Stratified choice of central pixels, based on the geometry of cubes:
+    sampling = None
+    if args.stratified:
+        sampling = {'Dang': args.strata_dang, 'n_stratum': args.per_stratum}
+
+    vu = VIMS_u(args.list, args.cubes_dir, args.frac, shard=args.shard, base_url=args.base_url,
+                max_workers=args.max_workers, boxes=args.boxes, sampling=sampling, max_masked=args.max_masked,
+                IsF_max=args.isf_max, mask_channels=args.mask_channels)
+    if not hasattr(vu, 'Pav_DF'):
+        sys.exit(" > Initialization failed, we stop!")
+
+    if args.shard is None:
+        cubes_file = args.out_cubes
+        pav_file   = args.out_pav
+    else:
+        os.makedirs(args.out_dir, exist_ok=True)
+        i, N = args.shard
+        cubes_file = os.path.join(args.out_dir, shard_fmt.format(kind='CubeData', i=i, N=N))
+        pav_file   = os.path.join(args.out_dir, shard_fmt.format(kind='PavData',  i=i, N=N))
+
+    if args.pipeline > 0:
+        # The results are appended to the stores as soon as each cube is processed:
+        vu.extract_pipelined(cubes_dir=args.cubes_dir, prefetch=args.pipeline, io_workers=args.io_workers,
+                             out_cubes=cubes_file, out_pav=pav_file)
+    else:
+        Cubes_DF, Pav_DF = vu.extract_3x3box(cubes_dir=args.cubes_dir)
+        write_DF_HDF5(Cubes_DF, cubes_file, Cubes_key, Cubes_metadata)
+        write_DF_HDF5(Pav_DF,   pav_file,   Pav_key,   Pav_metadata, data_columns=Pav_data_columns)
+    print (" > Data of cubes written in -: ", cubes_file)
+    print (" > Data of boxes written in -: ", pav_file)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_fetch(args):
+    """
+    Download (concurrently) the cubes of the list, or of one of its shards, missing in the directory of cubes.
+    """
+    from VIMSU_1 import shard_list
+    from VIMSU_fetch import prefetch_cubes
+
+    clist = read_cubes_list(args.list)
+    if args.shard is not None:
+        clist = shard_list(clist, *args.shard)
+    os.makedirs(args.cubes_dir, exist_ok=True)
+
+    fetched, failed = prefetch_cubes(clist, args.cubes_dir, base_url=args.base_url, max_workers=args.max_workers,
+                                     retries=args.retries, verify_existing=args.verify)
+    print (f" > {len(fetched)} cube(s) downloaded, {len(failed)} failure(s).")
+    if failed:
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_catalog(args):
+    """
+    Catalogue of the cubes (dimensions, exposure, Ls, temperatures) from their labels only, and optionally
+    the list of the cubes satisfying a condition, to be used by 'extract'.
+    """
+    from VIMSU_1 import write_DF_HDF5
+    from VIMSU_catalog import build_catalog, select_cubes, Catalog_key, Catalog_metadata, Catalog_data_columns
+
+    clist = read_cubes_list(args.list) if args.list else None
+    catalog, failed = build_catalog(args.cubes_dir, clist, max_workers=args.max_workers)
+    for fname, msg in failed.items():
+        print ("   - Label not read: ", fname, msg)
+
+    write_DF_HDF5(catalog, args.out, Catalog_key, Catalog_metadata, data_columns=Catalog_data_columns)
+    print (f" > Catalogue of {len(catalog)} cubes written in -: ", args.out)
+
+    if args.where:
+        selected = select_cubes(args.out, args.where)
+        pd.DataFrame({'Cube name': selected}).to_csv(args.out_list, index=False)
+        print (f" > {len(selected)} cubes satisfy '{args.where}', list written in -: ", args.out_list)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def find_shards(shard_dir):
+    """
+    Look for the shard files in a directory.
+    Outputs:
+      - N (int) ------------: number of shards.
+      - cubes_files (dict) -: shard index -> name of the 'CubeData' file.
+      - pav_files (dict) ---: shard index -> name of the 'PavData' file.
+    """
+    cubes_files = {}
+    pav_files   = {}
+    Ns = set()
+    for fname in sorted(glob.glob(os.path.join(shard_dir, '*_shard*of*.hdf5'))):
+        m = shard_re.search(fname)
+        if m is None:
+            continue
+        kind, i, N = m.group(1), int(m.group(2)), int(m.group(3))
+        Ns.add(N)
+        (cubes_files if kind == 'CubeData' else pav_files)[i] = fname
+
+    if len(Ns) != 1:
+        raise ValueError(f"Shard files in '{shard_dir}' do not share a single number of shards: {sorted(Ns)}")
+    return Ns.pop(), cubes_files, pav_files
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def concat_shards(files, key):
+    """
+    Concatenate the DataFrames stored under 'key' in shard files. A shard without any row may have no such
+    key (files written by older versions, or empty frames in 'table' format): it counts as zero rows.
+    """
+    frames = []
+    for fname in files:
+        with pd.HDFStore(fname, mode='r') as store:
+            if key in store:
+                frames.append(store[key])
+    full = [DF for DF in frames if len(DF)] # Empty frames could change the types of columns.
+    if full:
+        return pd.concat(full, ignore_index=True)
+    return frames[0] if frames else pd.DataFrame(columns=['Cube name'])
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def merge_shards(shard_dir, clist=None):
+    """
+    Concatenate the DataFrames of all the shards, and check the result.
+    Inputs:
+      - shard_dir (string) ---: directory containing the shard files written by 'extract'.
+      - clist (numpy array) --: expected list of cube names, if given the merged data must contain each of
+                                them exactly once, and are sorted in the same order.
+    Outputs:
+      - Cubes_DF, Pav_DF -----: the merged DataFrames.
+    Raises a ValueError if a shard is missing, or if cubes are missing or duplicated.
+    """
+    from VIMSU_1 import Cubes_key, Pav_key
+
+    N, cubes_files, pav_files = find_shards(shard_dir)
+
+    missing = [i for i in range(N) if i not in cubes_files or i not in pav_files]
+    if missing:
+        raise ValueError(f'Missing shard(s) among {N}: {missing}')
+
+    Cubes_DF = concat_shards([cubes_files[i] for i in range(N)], Cubes_key)
+    Pav_DF   = concat_shards([pav_files[i]   for i in range(N)], Pav_key)
+
+    names = Cubes_DF['Cube name']
+    dupli = sorted(set(names[names.duplicated()]))
+    if dupli:
+        raise ValueError(f'Duplicated cube(s) in shards: {dupli}')
+
+    orphans = sorted(set(Pav_DF['Cube name']) - set(names))
+    if orphans:
+        raise ValueError(f'Boxes belong to cube(s) absent from the cubes data: {orphans}')
+
+    if clist is not None:
+        lacking = [cn for cn in clist if cn not in set(names)]
+        if lacking:
+            raise ValueError(f'Missing cube(s) in shards: {lacking}')
+        extra = sorted(set(names) - set(clist))
+        if extra:
+            raise ValueError(f'Cube(s) in shards but not in the list of cubes: {extra}')
+
+        # Same order as a single run over the list:
+        rank = {cn: k for k, cn in enumerate(clist)}
+        Cubes_DF = Cubes_DF.iloc[np.argsort(Cubes_DF['Cube name'].map(rank).to_numpy(), kind='stable')]
+        Pav_DF   = Pav_DF.iloc[np.argsort(Pav_DF['Cube name'].map(rank).to_numpy(), kind='stable')]
+        Cubes_DF = Cubes_DF.reset_index(drop=True)
+        Pav_DF   = Pav_DF.reset_index(drop=True)
+
+    return Cubes_DF, Pav_DF
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_merge(args):
+    """
+    Merge of the shards into the canonical 'Cubes_global_data' and 'Paves3x3_data' stores.
+    """
+    from VIMSU_1 import write_DF_HDF5, Cubes_metadata, Pav_metadata, Cubes_key, Pav_key, Pav_data_columns
+
+    clist = read_cubes_list(args.list) if args.list else None
+    try:
+        Cubes_DF, Pav_DF = merge_shards(args.shard_dir, clist)
+    except ValueError as err:
+        sys.exit(f' > Merge failed: {err}')
+
+    write_DF_HDF5(Cubes_DF, args.out_cubes, Cubes_key, Cubes_metadata)
+    write_DF_HDF5(Pav_DF,   args.out_pav,   Pav_key,   Pav_metadata, data_columns=Pav_data_columns)
+    print (f" > {len(Cubes_DF)} cubes and {len(Pav_DF)} boxes merged.")
+    print (" > Data of cubes written in -: ", args.out_cubes)
+    print (" > Data of boxes written in -: ", args.out_pav)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_convert(args):
+    """
+    Conversion of a store of boxes written in 'fixed' format (e.g. 'stoDFrame_PavData_NEW.hdf5') into the
+    queryable 'table' format, with indexed data columns, or into an Arrow or Parquet file (according to the
+    extension of the output file, see 'VIMSU_arrow'). The store of cubes can be converted as well.
+    """
+    from VIMSU_1 import write_DF_HDF5, Pav_key, Cubes_key, Pav_data_columns
+    from VIMSU_arrow import write_DF_arrow, arrow_ext, parquet_ext
+
+    for in_file, out_file, key, what in [(args.pav_file, args.out_pav, Pav_key, 'boxes'),
+                                         (args.cubes_file, args.out_cubes, Cubes_key, 'cubes')]:
+        if not in_file or not out_file:
+            continue
+        with pd.HDFStore(in_file, mode='r') as store:
+            DF       = store[key]
+            metadata = getattr(store.get_storer(key).attrs, 'metadata', None)
+
+        if out_file.endswith(arrow_ext + parquet_ext):
+            write_DF_arrow(DF, out_file, metadata)
+        else:
+            write_DF_HDF5(DF, out_file, key, metadata, data_columns=Pav_data_columns if key == Pav_key else list(DF.columns))
+        print (f" > {len(DF)} {what} written in -: ", out_file)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def box_sizes(pav_file):
+    """
+    Sizes of the boxes of a store of boxes (HDF5, Arrow or Parquet), read from the 'box' column only (the whole
+    DataFrame for a 'fixed' HDF5 store). Stores written before multi-scale extractions have no 'box' column,
+    their boxes are 3x3.
+    """
+    from VIMSU_1 import Pav_key
+    from VIMSU_arrow import arrow_ext, parquet_ext, read_table, table_columns
+
+    if pav_file.endswith(arrow_ext + parquet_ext):
+        if 'box' not in table_columns(pav_file):
+            return [3]
+        box = read_table(pav_file, columns=['box']).column('box').to_numpy()
+    else:
+        with pd.HDFStore(pav_file, mode='r') as store:
+            if store.get_storer(Pav_key).is_table:
+                if 'box' not in store.select(Pav_key, stop=0).columns:
+                    return [3]
+                box = store.select(Pav_key, columns=['box'])['box'].to_numpy()
+            else:
+                DF = store[Pav_key]
+                if 'box' not in DF.columns:
+                    return [3]
+                box = DF['box'].to_numpy()
+    return sorted(int(b) for b in np.unique(box))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cmd_analyse(args):
+    """
+    Part TWO analysis: average I/F and relative standard deviation of boxes, per spectral band.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import VIMSU_2 as v2
+    from VIMSU_1 import Pav_key
+    from VIMSU_arrow import arrow_ext, parquet_ext
+
+    # Boxes of several sizes (multi-scale extraction) must not be mixed in the statistics of a band:
+    if args.box is None:
+        sizes = box_sizes(args.pav_file)
+        if len(sizes) > 1:
+            sys.exit(f" > The store holds boxes of sizes {sizes}, choose one with '--box', we stop!")
+
+    if args.cache_dir:
+        from VIMSU_cache import ResultCache
+        cache = ResultCache(args.cache_dir, int(args.cache_size * 1024**2))
+        IsFav_band, DIsF_band = v2.IsFavBand_cached(args.pav_file, default_bands, args.dang, box=args.box,
+                                                    cache=cache)
+    elif args.pav_file.endswith(arrow_ext + parquet_ext):
+        # Memory-mapped Arrow file (or Parquet file): only the angles and the spectral blocks are read.
+        IsFav_band, DIsF_band = v2.IsFavBand(args.pav_file, default_bands, args.dang, box=args.box)
+    else:
+        with pd.HDFStore(args.pav_file, mode='r') as store:
+            if store.get_storer(Pav_key).is_table:
+                # Only the boxes satisfying the angular criterion, and the channels of the bands, are read:
+                IsFav_band, DIsF_band = v2.IsFavBand(store, default_bands, args.dang, box=args.box)
+            else:
+                IsFav_band, DIsF_band = v2.IsFavBand(store[Pav_key], default_bands, args.dang, box=args.box)
+    for i in range(len(default_bands)):
+        print (' > Band ', i, ' : ', len(IsFav_band[i]), ' points')
+    print (' > Total  : ', sum(len(a) for a in IsFav_band), ' points')
+
+    if args.fit_law:
+        table, _ = v2.fit_band_DIsF_law(default_bands, IsFav_band, DIsF_band, law=args.fit_law,
+                                        n_boot=args.n_boot, seed=0)
+        print ("")
+        print (table.to_string(index=False))
+        if args.out_law:
+            table.to_csv(args.out_law, index=False)
+            print (" > Uncertainty laws written in -: ", args.out_law)
+
+    if args.figname:
+        v2.plot_band_avIF_DIF(default_bands, args.cubes_dir, args.ref_cube, IsFav_band, DIsF_band,
+                              args.figname, mode=args.mode)
+        print (" > Figure written in -: ", args.figname)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='VIMS-IR photometric uncertainties, batch processing.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('extract', help='extraction of 3x3 boxes (Part ONE)')
+    p.add_argument('--list', default='VIMSuncert_cubes_list.csv', help='CSV file with the list of cubes')
+    p.add_argument('--cubes-dir', default='VIMS_CALCUBES', help='directory containing the cubes')
+    p.add_argument('--frac', type=float, default=0.10, help='fraction of pixels used as box centers')
+    p.add_argument('--boxes', type=int, nargs='+', default=[3], help='sizes of pixels boxes (odd), e.g. 3 5 7')
+    p.add_argument('--stratified', action='store_true',
+                   help='box centers drawn in classes of incidence, emergence and latitude')
+    p.add_argument('--strata-dang', type=float, default=None,
+                   help='stratified choice: centers of boxes whose angles disperse more are discarded')
+    p.add_argument('--per-stratum', type=int, default=None,
+                   help="stratified choice: number of centers per class (given by '--frac' if not set)")
+    p.add_argument('--max-masked', type=float, default=None,
+                   help='boxes with a larger fraction of invalid I/F values are not kept (all kept if not set)')
+    p.add_argument('--mask-channels', type=int, nargs=2, default=None, metavar=('I0', 'I1'),
+                   help='VIMS channels (1-based) over which the fraction of invalid I/F values is computed (all if not set)')
+    p.add_argument('--isf-max', type=float, default=None, help='I/F saturation threshold (none if not set)')
+    p.add_argument('--shard', type=parse_shard, default=None, help="process only shard 'i/N' (0 <= i < N)")
+    p.add_argument('--base-url', default=VIMS_DATA_PORTAL, help='VIMS Data Portal, or mirror, for missing cubes')
+    p.add_argument('--max-workers', type=int, default=8, help='number of concurrent downloads')
+    p.add_argument('--pipeline', type=int, default=0, help='number of cubes read in advance (0: sequential run)')
+    p.add_argument('--io-workers', type=int, default=1, help='number of reading threads of the pipelined run')
+    p.add_argument('--out-dir', default='SHARDS', help='output directory of shard files')
+    p.add_argument('--out-cubes', default='stoDFrame_CubeData.hdf5', help='output store of cubes (no shard)')
+    p.add_argument('--out-pav', default='stoDFrame_PavData.hdf5', help='output store of boxes (no shard)')
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser('fetch', help='download of missing cubes')
+    p.add_argument('--list', default='VIMSuncert_cubes_list.csv', help='CSV file with the list of cubes')
+    p.add_argument('--cubes-dir', default='VIMS_CALCUBES', help='directory containing the cubes')
+    p.add_argument('--shard', type=parse_shard, default=None, help="fetch only shard 'i/N' (0 <= i < N)")
+    p.add_argument('--base-url', default=VIMS_DATA_PORTAL, help='VIMS Data Portal, or mirror')
+    p.add_argument('--max-workers', type=int, default=8, help='number of concurrent downloads')
+    p.add_argument('--retries', type=int, default=3, help='number of attempts per cube')
+    p.add_argument('--verify', action='store_true', help='check present cubes against the manifest')
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser('catalog', help='catalogue of cubes, from their labels only')
+    p.add_argument('--cubes-dir', default='VIMS_CALCUBES', help='directory containing the cubes')
+    p.add_argument('--list', default='', help="CSV file with the list of cubes ('' for all the cubes of the directory)")
+    p.add_argument('--max-workers', type=int, default=None, help='number of processes')
+    p.add_argument('--out', default='stoDFrame_CubeCatalog.hdf5', help='output store of the catalogue')
+    p.add_argument('--where', default='', help="condition selecting cubes, e.g. 'Nsample >= 32 & dT1 < 61'")
+    p.add_argument('--out-list', default='VIMSuncert_cubes_selected.csv', help='CSV list of the selected cubes')
+    p.set_defaults(func=cmd_catalog)
+
+    p = sub.add_parser('merge', help='merge of shard outputs')
+    p.add_argument('--shard-dir', default='SHARDS', help='directory of shard files')
+    p.add_argument('--list', default='VIMSuncert_cubes_list.csv',
+                   help="CSV file with the expected list of cubes ('' to skip the check)")
+    p.add_argument('--out-cubes', default='stoDFrame_CubeData.hdf5', help='merged store of cubes')
+    p.add_argument('--out-pav', default='stoDFrame_PavData.hdf5', help='merged store of boxes')
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser('convert', help="conversion of stores to the queryable 'table' format, Arrow or Parquet")
+    p.add_argument('--pav-file', default='ANALYSIS_HDF5/stoDFrame_PavData_NEW.hdf5', help='store of boxes')
+    p.add_argument('--out-pav', default='stoDFrame_PavData_table.hdf5',
+                   help="converted store of boxes ('.hdf5', '.arrow' or '.parquet')")
+    p.add_argument('--cubes-file', default='', help='store of cubes, to be converted as well')
+    p.add_argument('--out-cubes', default='', help="converted store of cubes ('.hdf5', '.arrow' or '.parquet')")
+    p.set_defaults(func=cmd_convert)
+
+    p = sub.add_parser('analyse', help='analysis of boxes (Part TWO)')
+    p.add_argument('--pav-file', default='ANALYSIS_HDF5/stoDFrame_PavData_NEW.hdf5', help='store of boxes')
+    p.add_argument('--dang', type=float, default=3., help='max. relative standard deviation of angles')
+    p.add_argument('--box', type=int, default=None,
+                   help='size of boxes used, required if the store holds several sizes (multi-scale data)')
+    p.add_argument('--figname', default='fig_DIsF_IsFaverage.png', help="output figure ('' for none)")
+    p.add_argument('--mode', choices=['scatter', 'density'], default='density', help='rendering mode')
+    p.add_argument('--cubes-dir', default='VIMS_CALCUBES', help='directory of the reference cube')
+    p.add_argument('--ref-cube', default='1732876622_1', help='cube of the reference spectrum')
+    p.add_argument('--fit-law', choices=['', 'power', 'noise'], default='', help='uncertainty law fitted to each band')
+    p.add_argument('--n-boot', type=int, default=200, help='number of bootstrap samples of the fit')
+    p.add_argument('--out-law', default='', help='CSV file of the fitted laws')
+    p.add_argument('--cache-dir', default='CACHE_VIMSU', help="directory of the cache of results ('' for none)")
+    p.add_argument('--cache-size', type=float, default=2048., help='maximum size of the cache (MB)')
+    p.set_defaults(func=cmd_analyse)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
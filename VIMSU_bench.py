@@ -0,0 +1,144 @@
+"""
+Benchmarks of the VIMS-IR uncertainties tools.
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+
+Usage:
+    python VIMSU_bench.py imports
+    python VIMSU_bench.py formats --pav-file ANALYSIS_HDF5/stoDFrame_PavData_NEW.hdf5
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Benchmarks: import time of modules, file formats of the data, ...
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import argparse
+import os.path
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Modules whose import dominates the start-up time of a worker:
+heavy_modules = ['pandas', 'matplotlib.pyplot', 'scipy.interpolate', 'pyvims', 'titan.orbit']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def time_import(statement, repeat=5):
+    """
+    Wall-clock time of a fresh Python interpreter executing an import statement, i.e. what a
+    newly spawned worker pays before doing anything.
+    Inputs:
+      - statement (string) --: Python code to run, e.g. 'import VIMSU_2'.
+      - repeat (int) --------: number of runs.
+    Outputs:
+      - times (numpy array) -: durations of each run (seconds).
+      - loaded (list) -------: heavy modules loaded by the statement.
+    """
+    code = (statement + '\nimport sys\n'
+            + f'print(",".join(m for m in {heavy_modules!r} if m in sys.modules))')
+    here  = os.path.dirname(os.path.abspath(__file__))
+    times = np.zeros(repeat)
+    for k in range(repeat):
+        tic = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code], cwd=here, capture_output=True, text=True, check=True)
+        times[k] = time.perf_counter() - tic
+    loaded = [m for m in out.stdout.strip().split(',') if m]
+    return times, loaded
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def bench_imports(repeat=5):
+    """
+    Import time of the modules of the package, compared to an empty interpreter and to the heavy
+    dependencies alone.
+    """
+    statements = ['pass', 'import numpy', 'import pandas', 'import matplotlib.pyplot', 'import pyvims',
+                  'import VIMSU_1', 'import VIMSU_2', 'import VIMSU_batch', 'import VIMS_uncertainties']
+
+    print (f" > Import times (median over {repeat} fresh interpreters):")
+    print ("")
+    for st in statements:
+        times, loaded = time_import(st, repeat)
+        print (f"   {st[:40]:40s} : {np.median(times)*1e3:8.1f} ms   loaded: {', '.join(loaded) or '-'}")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def best_time(func, repeat=5):
+    """
+    Smallest wall-clock time (seconds) of 'repeat' calls of 'func()', and its last result.
+    """
+    times = np.zeros(repeat)
+    for k in range(repeat):
+        tic = time.perf_counter()
+        res = func()
+        times[k] = time.perf_counter() - tic
+    return times.min(), res
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def bench_formats(cubes_file, pav_file, work_dir, dang=3., repeat=5):
+    """
+    Size and load time of the data of cubes and of boxes in HDF5 (as shipped), Arrow IPC (memory-mapped)
+    and Parquet files, and time of the band selection of Part TWO ('VIMSU_2.IsFavBand') from each file.
+    The HDF5 files are converted in 'work_dir'. Files are read from the page cache (warm runs).
+    """
+    import pandas as pd
+    import VIMSU_2 as v2
+    from VIMSU_1 import Cubes_key, Pav_key
+    from VIMSU_arrow import convert_HDF5, read_table, table_to_DF
+    from VIMSU_batch import default_bands
+
+    os.makedirs(work_dir, exist_ok=True)
+    print (f" > Size and load time (best of {repeat} runs):")
+    print ("")
+    for hdf5_file, key in [(cubes_file, Cubes_key), (pav_file, Pav_key)]:
+        if not os.path.isfile(hdf5_file):
+            print (f"   {hdf5_file}: not available, skipped.")
+            continue
+        base  = os.path.join(work_dir, os.path.splitext(os.path.basename(hdf5_file))[0])
+        files = {'HDF5': hdf5_file, 'Arrow': base + '.arrow', 'Parquet': base + '.parquet'}
+        convert_HDF5(hdf5_file, key, files['Arrow'])
+        convert_HDF5(hdf5_file, key, files['Parquet'])
+
+        print (f"   {os.path.basename(hdf5_file)}:")
+        for fmt, fname in files.items():
+            size = os.path.getsize(fname) / 1024**2
+            if fmt == 'HDF5':
+                t_open, _ = best_time(lambda: pd.read_hdf(fname, key), repeat)
+                t_DF = t_open
+            else:
+                t_open, _ = best_time(lambda: read_table(fname), repeat)
+                t_DF, _   = best_time(lambda: table_to_DF(read_table(fname)), repeat)
+            line = f"     {fmt:8s}: {size:9.2f} MB, open {t_open*1e3:9.2f} ms, DataFrame {t_DF*1e3:9.2f} ms"
+            if key == Pav_key:
+                if fmt == 'HDF5':
+                    t_band, _ = best_time(lambda: v2.IsFavBand(pd.read_hdf(fname, key), default_bands, dang), repeat)
+                else:
+                    t_band, _ = best_time(lambda: v2.IsFavBand(fname, default_bands, dang), repeat)
+                line += f", bands {t_band*1e3:9.2f} ms"
+            print (line)
+        print ("")
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the VIMS-IR uncertainties tools.')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('imports', help='import time of modules')
+    p.add_argument('--repeat', type=int, default=5, help='number of runs')
+    p.set_defaults(func=lambda args: bench_imports(args.repeat))
+
+    p = sub.add_parser('formats', help='size and load time of HDF5, Arrow and Parquet files')
+    p.add_argument('--cubes-file', default='ANALYSIS_HDF5/stoDFrame_CubeData_NEW.hdf5', help='HDF5 store of cubes')
+    p.add_argument('--pav-file', default='ANALYSIS_HDF5/stoDFrame_PavData_NEW.hdf5', help='HDF5 store of boxes')
+    p.add_argument('--work-dir', default='BENCH_FORMATS', help='directory of the converted files')
+    p.add_argument('--dang', type=float, default=3., help='max. relative standard deviation of angles')
+    p.add_argument('--repeat', type=int, default=5, help='number of runs')
+    p.set_defaults(func=lambda args: bench_formats(args.cubes_file, args.pav_file, args.work_dir, args.dang,
+                                                   args.repeat))
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+On-disk cache of the results of the analysis (Part TWO).
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Cache of NumPy arrays, keyed by the parameters of the computation
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import hashlib
+import json
+import os
+import os.path
+
+import numpy as np
+
+from VIMSU_fetch import file_digest
+
+# Default directory and maximum size (bytes) of the cache:
+cache_dir_default = 'CACHE_VIMSU'
+cache_max_bytes   = 2 * 1024**3
+
+# Name of the file recording the checksums of input stores, in the directory of the cache:
+digests_name = 'DIGESTS.json'
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+class ResultCache:
+    """
+    Cache of the results of functions returning NumPy arrays (or tuples of lists of arrays, like
+    'VIMSU_2.IsFavBand'). Each result is an uncompressed '.npz' file named after a hash of the
+    parameters of the computation; the least recently used files are removed when the size of the
+    cache exceeds 'max_bytes'.
+    """
+    def __init__(self, cache_dir=cache_dir_default, max_bytes=cache_max_bytes):
+        """
+        Inputs:
+          - cache_dir (string) --: directory of the cache (created if needed).
+          - max_bytes (int) -----: maximum size of the cache (bytes).
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def input_digest(self, filename):
+        """
+        SHA-256 checksum of an input file (e.g. a HDF5 store). It is recorded with the size and the
+        modification time of the file, so that it is computed again only when the file changes.
+        """
+        fname = os.path.join(self.cache_dir, digests_name)
+        try:
+            with open(fname) as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            digests = {}
+
+        path = os.path.abspath(filename)
+        st   = os.stat(path)
+        entry = digests.get(path)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['sha256']
+
+        size, sha = file_digest(path)
+        digests[path] = {'size': size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha}
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(digests, f, indent=1)
+        os.replace(fname + '.tmp', fname)
+        return sha
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def key(self, name, version, inputs=(), **params):
+        """
+        Key of a result.
+        Inputs:
+          - name (string) ----: name of the function.
+          - version (int) ----: version of the function, to be increased when its results change.
+          - inputs (list) ----: input files, identified by their content.
+          - params -----------: other parameters (JSON serializable: numbers, strings, lists, ...).
+        Outputs:
+          - key (string) -----: hex string.
+        """
+        desc = {'name': name, 'version': version,
+                'inputs': [self.input_digest(f) for f in inputs], 'params': params}
+        return hashlib.sha256(json.dumps(desc, sort_keys=True, default=repr).encode()).hexdigest()
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def get(self, key):
+        """
+        Result recorded for a key, None if there is none. Results made of lists of arrays are
+        returned as a tuple of lists.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {k: f[k] for k in f.files}
+        except (OSError, ValueError):
+            return None
+        os.utime(path) # Most recently used.
+
+        if 'array' in arrays:
+            return arrays['array']
+        nout = 1 + max(int(k.split('_')[0][1:]) for k in arrays)
+        res  = tuple([] for _ in range(nout))
+        for k in sorted(arrays, key=lambda k: tuple(int(x) for x in k[1:].split('_'))):
+            res[int(k.split('_')[0][1:])].append(arrays[k])
+        return res
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def put(self, key, result):
+        """
+        Record a result: a NumPy array, or a tuple of lists of arrays.
+        """
+        if isinstance(result, np.ndarray):
+            arrays = {'array': result}
+        else:
+            arrays = {f'r{i}_{j}': np.asarray(a) for i, out in enumerate(result) for j, a in enumerate(out)}
+
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+        self.evict(keep=path)
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def evict(self, keep=None):
+        """
+        Remove the least recently used results until the size of the cache is below 'max_bytes'.
+        """
+        files = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.npz'):
+                path = os.path.join(self.cache_dir, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime_ns, st.st_size, path))
+
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+    # ---------------------------------------------------------------------------------------------------------------------------
+    def cached(self, func, name, version, inputs=(), **params):
+        """
+        Result of 'func()', taken from the cache if it was already computed with the same inputs and
+        parameters.
+        """
+        key = self.key(name, version, inputs, **params)
+        res = self.get(key)
+        if res is None:
+            res = func()
+            self.put(key, res)
+        return res
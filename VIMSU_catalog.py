@@ -0,0 +1,212 @@
+"""
+Catalogue of VIMS cubes, built from their ISIS labels only.
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Catalogue of the cubes of a directory: dimensions, exposure, Ls, temperatures
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import os
+import os.path
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+# Key of the catalogue in its HDF5 store:
+Catalog_key = 'Cubes_catalog'
+
+# Clock drift correction of the VIMS-IR exposure durations (the same as 'pyvims.VIMS.VIMS_SEC'):
+VIMS_SEC = 1.01725
+
+# Descriptions of the columns, the same as 'VIMSU_1.Cubes_metadata' for common columns:
+Catalog_metadata = {'Cube name' : 'Cube identification',
+                    'Nsample'   : "Max. index value in 'sample' axis",
+                    'Nline'     : "Max. index value in 'line' axis",
+                    'Npix'      : 'Total number of cube pixels',
+                    'Expo Time' : 'Exposure time',
+                    'Ls'        : 'Solar longitude (in degrees)',
+                    'dT1'       : 'Detector temperature 1 (Detector IR high resolution) in K',
+                    'dT2'       : 'Detector temperature 2 (Detector IR low resolution) in K',
+                    'dT3'       : 'Detector temperature 3 (Detector Visible) in K',
+                    'iT1'       : 'Instrument temperature 1 (Instrument IR spectrometer) in K',
+                    'iT2'       : 'Instrument temperature 2 (Instrument grating) in K',
+                    'oT1'       : 'Optics temperature 1 (Optics IR primary) in K',
+                    'oT2'       : 'Optics temperature 2 (Optics IR secondary) in K',
+                    'oT3'       : 'Optics temperature 3 (Optics Visible) in K',
+                    'Time'      : 'Mid time of the acquisition (UTC)',
+                    'Mode'      : "Sampling mode ('NORMAL', 'HI-RES', ...)",
+                    'Target'    : 'Target name'}
+
+# Indexed columns of the catalogue, usable in queries:
+Catalog_data_columns = ['Cube name', 'Nsample', 'Nline', 'Npix', 'Expo Time', 'Ls',
+                        'dT1', 'dT2', 'dT3', 'iT1', 'iT2', 'oT1', 'oT2', 'oT3', 'Mode', 'Target']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def parse_pvl(text):
+    """
+    Minimal reader of PVL labels ('KEY = value' statements), enough for the keywords we need: objects
+    and groups are flattened, and the first occurrence of a keyword is kept.
+    Inputs:
+      - text (string) --: the label.
+    Outputs:
+      - keys (dict) ----: keyword -> value (string, float, or list for '(a, b, ...)' values).
+    """
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S) # Comments.
+    keys = {}
+    stmt = ''
+    for line in text.splitlines():
+        stmt += ' ' + line.strip() if stmt else line.strip()
+        if stmt.count('(') > stmt.count(')'):
+            continue # Value continued on the next line.
+        key, sep, value = stmt.partition('=')
+        stmt = ''
+        key = key.strip()
+        if not sep or key in keys or key in ('Object', 'Group', 'End_Object', 'End_Group'):
+            continue
+        keys[key] = parse_value(value.strip())
+    return keys
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def parse_value(value):
+    """
+    Value of a PVL keyword: number, string, or list of them; units ('<IR>') and quotes are removed.
+    """
+    value = re.sub(r'<[^>]*>', '', value).strip()
+    if value.startswith('(') and value.endswith(')'):
+        return [parse_value(v) for v in value[1:-1].split(',')]
+    value = value.strip('"')
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def read_label(filename):
+    """
+    Read the labels of an ISIS cube, without its pixel data: the ISIS label at the start of the file,
+    and the original PDS label stored as a blob.
+    Inputs:
+      - filename (string) --: the cube file.
+    Outputs:
+      - isis (dict) --------: keywords of the ISIS label.
+      - orig (dict) --------: keywords of the original label (e.g. 'DETECTOR_TEMPERATURE').
+    """
+    with open(filename, 'rb') as f:
+        head = b''
+        while b'\nEnd\n' not in head and b'\nEnd\r\n' not in head:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            head += chunk
+        text = head.decode('latin-1')
+        text = text[:re.search(r'\nEnd\r?\n', text).start()]
+
+        # Position of the original label, in the last object of the ISIS label:
+        orig = {}
+        m = re.search(r'Object\s*=\s*OriginalLabel.*?StartByte\s*=\s*(\d+).*?Bytes\s*=\s*(\d+)', text, re.S)
+        if m is not None:
+            f.seek(int(m.group(1)) - 1)
+            orig = parse_pvl(f.read(int(m.group(2))).decode('latin-1'))
+
+    return parse_pvl(text), orig
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def label_time(value):
+    """
+    Date of an ISIS label ('2006-266T19:54:30.764', day of year, or '2006-09-23T19:54:30.764').
+    """
+    value = str(value).rstrip('Z')
+    fmt = '%Y-%jT%H:%M:%S' if re.match(r'\d{4}-\d{3}T', value) else '%Y-%m-%dT%H:%M:%S'
+    if '.' in value:
+        fmt += '.%f'
+    return datetime.strptime(value, fmt)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cube_record(filename):
+    """
+    Row of the catalogue for a cube, the same quantities as the 'Cubes_DF' of 'VIMSU_1.VIMS_u' (which
+    loads the whole cube to get them).
+    Inputs:
+      - filename (string) --: the cube file ('C<cube name>_ir.cub').
+    Outputs:
+      - record (dict) ------: column -> value, see 'Catalog_metadata'.
+    """
+    from titan import orbit
+
+    isis, orig = read_label(filename)
+    cname = re.sub(r'_ir\.cub$', '', os.path.basename(filename)).lstrip('C')
+
+    # Same conventions as 'pyvims': mid time, IR exposure corrected for the clock drift.
+    start = label_time(isis['StartTime'])
+    stop  = label_time(isis['StopTime'])
+    mid   = start + (stop - start) / 2
+    expo  = isis['ExposureDuration']
+    expo  = (expo[0] if isinstance(expo, list) else expo) * VIMS_SEC / 1e3
+
+    NS, NL = int(isis['Samples']), int(isis['Lines'])
+    dT = orig.get('DETECTOR_TEMPERATURE',   [np.nan]*3)
+    iT = orig.get('INSTRUMENT_TEMPERATURE', [np.nan]*2)
+    oT = orig.get('OPTICS_TEMPERATURE',     [np.nan]*3)
+
+    record = {'Cube name': cname, 'Nsample': NS, 'Nline': NL, 'Npix': NS*NL, 'Expo Time': expo,
+              'Ls': orbit.Ls(mid.strftime('%Y-%m-%d'))}
+    record.update({f'dT{i+1}': float(T) for i, T in enumerate(dT)})
+    record.update({f'iT{i+1}': float(T) for i, T in enumerate(iT)})
+    record.update({f'oT{i+1}': float(T) for i, T in enumerate(oT)})
+    record.update({'Time': mid, 'Mode': str(isis.get('SamplingMode', '')), 'Target': str(isis.get('TargetName', ''))})
+    return record
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def build_catalog(cubes_dir, clist=None, max_workers=None):
+    """
+    Catalogue of the cubes of a directory, built in parallel from their labels.
+    Inputs:
+      - cubes_dir (string) --: directory of cubes.
+      - clist (list) --------: cube identifiers; all the '*_ir.cub' files of the directory if None.
+      - max_workers (int) ---: number of processes (number of CPUs if None).
+    Outputs:
+      - catalog (Pandas DataFrame) --: one row per cube, columns of 'Catalog_metadata'.
+      - failed (dict) ---------------: cube file -> error message, for unreadable labels.
+    """
+    import pandas as pd
+
+    if clist is None:
+        files = sorted(f for f in os.listdir(cubes_dir) if f.endswith('_ir.cub'))
+    else:
+        files = ["C" + cname + "_ir.cub" for cname in clist]
+    paths = [os.path.join(cubes_dir, f) for f in files]
+
+    records = []
+    failed  = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(cube_record, p) for p in paths]
+        for f, fut in zip(files, futures):
+            try:
+                records.append(fut.result())
+            except Exception as err: # Missing file, or label we cannot read.
+                failed[f] = f'{type(err).__name__}: {err}'
+
+    catalog = pd.DataFrame(records, columns=list(Catalog_metadata))
+    return catalog, failed
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def select_cubes(catalog_file, where=None):
+    """
+    Identifiers of the cubes of a catalogue satisfying a condition, without reading any pixel data.
+    Inputs:
+      - catalog_file (string) --: HDF5 store of the catalogue.
+      - where (string) ---------: condition on the indexed columns, e.g. "Nsample >= 32 & dT1 < 61"
+                                  ('Cube name' and 'Expo Time' cannot be used, they are not Python
+                                  identifiers).
+    Outputs:
+      - clist (list) -----------: cube identifiers.
+    """
+    import pandas as pd
+
+    catalog = pd.read_hdf(catalog_file, Catalog_key, where=where, columns=['Cube name'])
+    return catalog['Cube name'].to_list()
@@ -0,0 +1,200 @@
+"""
+Concurrent download of VIMS cubes, with verification.
+D. Cordier, CNRS, France
+https://orcid.org/0000-0003-4515-6271
+Licence: GPLv3
+"""
+# -----------------------------------------------------------------------------------------------------------------------------------
+#
+#                 Prefetch of the VIMS cubes from the VIMS Data Portal (or from any mirror)
+#
+# -----------------------------------------------------------------------------------------------------------------------------------
+import hashlib
+import json
+import os
+import os.path
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Default location of the cubes, the same as 'pyvims':
+VIMS_DATA_PORTAL = 'https://vims.univ-nantes.fr'
+
+# Name of the manifest (size and SHA-256 checksum of each cube), in the directory of cubes:
+manifest_name = 'MANIFEST.json'
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def cube_fname(cname):
+    """
+    Name of the calibrated IR cube file, for a cube identifier like '1537734379_1'.
+    """
+    return "C" + cname + "_ir.cub"
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    Size (bytes) and SHA-256 checksum (hex string) of a file.
+    """
+    sha  = hashlib.sha256()
+    size = 0
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return size, sha.hexdigest()
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def read_manifest(cubes_dir):
+    """
+    Read the manifest of the directory of cubes, an empty one is returned if it does not exist.
+    Outputs:
+      - manifest (dict) --: file name -> {'size': ..., 'sha256': ...}
+    """
+    fname = os.path.join(cubes_dir, manifest_name)
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def write_manifest(cubes_dir, manifest):
+    """
+    Write the manifest of the directory of cubes (atomically, through a temporary file).
+    """
+    fname = os.path.join(cubes_dir, manifest_name)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=1)
+        f.write('\n')
+    os.replace(fname + '.tmp', fname)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def build_manifest(cubes_dir):
+    """
+    Compute the manifest of all the cubes present in a directory, and write it.
+    """
+    manifest = read_manifest(cubes_dir)
+    for fname in sorted(os.listdir(cubes_dir)):
+        if fname.endswith('_ir.cub'):
+            size, sha = file_digest(os.path.join(cubes_dir, fname))
+            manifest[fname] = {'size': size, 'sha256': sha}
+    write_manifest(cubes_dir, manifest)
+    return manifest
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def download_cube(cname, cubes_dir, base_url=VIMS_DATA_PORTAL, expected=None, retries=3, timeout=60.):
+    """
+    Download one cube, with retries. The data are written in a temporary file, moved to its final name
+    only once verified, so that an interrupted download never leaves a truncated cube.
+    Inputs:
+      - cname (string) ------: cube identifier.
+      - cubes_dir (string) --: directory of cubes.
+      - base_url (string) ---: root URL, the cube is fetched from '<base_url>/cube/<file name>'.
+      - expected (dict) -----: {'size': ..., 'sha256': ...} from the manifest, if known.
+      - retries (int) -------: number of attempts.
+      - timeout (float) -----: network timeout (seconds).
+    Outputs:
+      - entry (dict) --------: size and checksum of the downloaded file.
+    Raises an IOError if all attempts fail.
+    """
+    fname = cube_fname(cname)
+    url   = base_url.rstrip('/') + '/cube/' + fname
+    dest  = os.path.join(cubes_dir, fname)
+    part  = dest + '.part'
+
+    error = None
+    for attempt in range(retries):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as r, open(part, 'wb') as f:
+                length = r.headers.get('Content-Length')
+                while True:
+                    chunk = r.read(1 << 20)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+
+            size, sha = file_digest(part)
+            if length is not None and size != int(length):
+                raise IOError(f'{fname}: truncated download ({size} bytes instead of {length})')
+            if expected is not None and (size != expected['size'] or sha != expected['sha256']):
+                raise IOError(f'{fname}: size or checksum differs from the manifest')
+
+            os.replace(part, dest)
+            return {'size': size, 'sha256': sha}
+
+        except (OSError, ValueError) as err: # 'urllib' errors are OSError.
+            error = err
+            if os.path.exists(part):
+                os.remove(part)
+            if isinstance(err, urllib.error.HTTPError) and err.code == 404:
+                break # Not available, no need to try again.
+            if attempt < retries - 1:
+                time.sleep(2**attempt)
+
+    raise IOError(f'{fname}: download failed after {attempt + 1} attempt(s): {error}')
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def prefetch_cubes(clist, cubes_dir, base_url=VIMS_DATA_PORTAL, max_workers=8, retries=3, verify_existing=False):
+    """
+    Download concurrently all the cubes of a list which are not present in the directory of cubes.
+    Downloaded cubes are checked against the manifest when they are listed there, and recorded in the
+    manifest otherwise.
+    Inputs:
+      - clist (list) -----------: cube identifiers.
+      - cubes_dir (string) -----: directory of cubes.
+      - base_url (string) ------: root URL of the VIMS Data Portal, or of a mirror.
+      - max_workers (int) ------: number of concurrent downloads.
+      - retries (int) ----------: number of attempts per cube.
+      - verify_existing (bool) -: if True, cubes already present are checked against the manifest as well,
+                                  and downloaded again if they differ.
+    Outputs:
+      - fetched (list) ---------: identifiers of downloaded cubes.
+      - failed (dict) ----------: identifier -> error message, for cubes which could not be downloaded.
+    """
+    manifest = read_manifest(cubes_dir)
+    lock     = threading.Lock()
+
+    todo = []
+    for cname in clist:
+        fname = cube_fname(cname)
+        dest  = os.path.join(cubes_dir, fname)
+        if not os.path.isfile(dest):
+            todo.append(cname)
+        elif verify_existing and fname in manifest:
+            size, sha = file_digest(dest)
+            if size != manifest[fname]['size'] or sha != manifest[fname]['sha256']:
+                print ("   - This cube differs from the manifest, we download it again: ", fname)
+                todo.append(cname)
+
+    fetched = []
+    failed  = {}
+    new_entries = {}
+
+    def task(cname):
+        fname = cube_fname(cname)
+        try:
+            entry = download_cube(cname, cubes_dir, base_url, manifest.get(fname), retries)
+        except IOError as err:
+            with lock:
+                failed[cname] = str(err)
+            return
+        with lock:
+            new_entries[fname] = entry
+            fetched.append(cname)
+        print ("   - Cube downloaded: ", fname)
+
+    if todo:
+        print (f" > {len(todo)} cube(s) to be downloaded from {base_url}, {max_workers} at a time.")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(task, todo))
+        if new_entries:
+            # The manifest is read again, in case other jobs sharing the directory updated it meanwhile:
+            manifest = read_manifest(cubes_dir)
+            manifest.update(new_entries)
+            write_manifest(cubes_dir, manifest)
+
+    for cname, msg in failed.items():
+        print ("   - Download failed: ", msg)
+
+    return fetched, failed
@@ -15,25 +15,110 @@ import sys
 # L'inévitable bibliothèque 'Numpy' :
 import numpy as np
 
-# Pour pouvoir faire de belles figures :
-import matplotlib.pyplot as plt
-
 # On importer la classe 'VIMS' :
 from pyvims import VIMS
 
-# Pour pouvoir faire de l'interpolation "smoothée" avec des splines :
-from scipy.interpolate import UnivariateSpline
+# Les modules suivants ne sont importés qu'au premier usage, dans les méthodes qui en ont besoin,
+# pour que les processus qui ne font que des calculs démarrent plus vite :
+#   - 'matplotlib.pyplot' pour pouvoir faire de belles figures,
+#   - 'scipy.interpolate.UnivariateSpline' pour faire de l'interpolation "smoothée" avec des splines,
+#   - 'titan.orbit' pour pouvoir calculer la longitude solaire du cube.
+
+# ------------------------------------------------------------------------------------
+def check_box(box):
+    """
+    Check the size of boxes: an odd number of pixels, at least 3.
+    """
+    if int(box) != box or box < 3 or box % 2 == 0:
+        print (' > Problem in "VIMS_uncert": box size must be an odd integer >= 3, not', box)
+        sys.exit('we stop')
+
+# ------------------------------------------------------------------------------------
+def integral_image(arr):
+    """
+    Summed-area table of an array, along its two last axes (line, sample), with a first row and
+    a first column of zeros: sat[..., l, s] is the sum of arr[..., :l, :s].
+    """
+    arr = np.asarray(arr, dtype=float)
+    sat = np.zeros(arr.shape[:-2] + (arr.shape[-2] + 1, arr.shape[-1] + 1))
+    sat[..., 1:, 1:] = arr.cumsum(axis=-2).cumsum(axis=-1)
+    return sat
+
+# ------------------------------------------------------------------------------------
+def box_sum(sat, ns, nl, box):
+    """
+    Sums over the boxes of box x box pixels centered on pixels (ns, nl) (1-based 'sample' and 'line',
+    as for 'VIMS' objects), computed in O(1) per box from the summed-area table 'sat'.
+    > output: array of shape sat.shape[:-2] + (len(ns),)
+    """
+    h  = box // 2
+    l0 = np.asarray(nl) - 1 - h
+    l1 = np.asarray(nl) + h
+    s0 = np.asarray(ns) - 1 - h
+    s1 = np.asarray(ns) + h
+    return sat[..., l1, s1] - sat[..., l0, s1] - sat[..., l1, s0] + sat[..., l0, s0]
 
-# Pour pouvoir calculer la longitude solaire du cube :
-from titan import orbit
+# ------------------------------------------------------------------------------------
+def log10_relat_std(std, av):
+    """
+    log10 of relative standard deviations std/av. As in the original per-box loops, the aberrant
+    values which occur for a few pixels (relative std not in ]0, 1[, or undefined) are replaced by 0.5.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ectr = np.asarray(std) / np.asarray(av)
+    ectr = np.where((ectr > 0.) & (ectr < 1.), ectr, 0.5)
+    return np.log10(ectr)
+
+# ------------------------------------------------------------------------------------
+# Valeurs spéciales ISIS (NULL, LRS, LIS, HIS, HRS) : ce sont les valeurs extrêmes du type des données,
+# on les reconnaît avec la même tolérance que 'pyvims', qui les remplace en principe par des NaN.
+ISIS_special_abs = 1e-6 * np.finfo(np.float32).max
+
+# Seuil de saturation de I/F (valeurs supérieures invalides), aucun par défaut : voir 'VIMS_uncert.valid_mask'.
+IsF_saturation = None
+
+# ------------------------------------------------------------------------------------
+# Strates par défaut du tirage stratifié des pixels centraux (voir 'choice_pix_strata') : bornes
+# des classes d'angle d'incidence, d'angle d'émergence (en degrés) et de latitude. Les pixels hors
+# de ces bornes (incidences ou émergences rasantes, hors du disque) ne sont pas tirés.
+strata_default = {'inc': (0., 30., 60., 80.),
+                  'eme': (0., 30., 60., 80.),
+                  'lat': (-90., -30., 30., 90.)}
+
+# ------------------------------------------------------------------------------------
+def allocate_strata(counts, n_total):
+    """
+    Distribution of 'n_total' draws among strata containing 'counts' candidate pixels: each stratum
+    gets the same number of draws, but not more than its number of candidates; what cannot be drawn
+    in small strata is shared among the others.
+    > output: array of the numbers of draws per stratum.
+    """
+    counts = np.asarray(counts, dtype=int)
+    alloc  = np.zeros_like(counts)
+    left   = min(int(n_total), int(counts.sum()))
+    open_  = counts > 0
+    while left > 0:
+        share = max(left // int(open_.sum()), 1)
+        for k in np.flatnonzero(open_):
+            add       = min(share, counts[k] - alloc[k], left)
+            alloc[k] += add
+            left     -= add
+            if alloc[k] == counts[k]:
+                open_[k] = False
+            if left == 0:
+                break
+    return alloc
 
 # ------------------------------------------------------------------------------------
 # Définition de la classe 'VIMS_uncert' qui hérite de 'VIMS' :
 class VIMS_uncert(VIMS):
     """Classe héritant de la classe 'VIMS' et proposant en plus des méthodes d'estimation d'incertitudes"""
 
+    # Seuil de saturation de I/F, à fixer avant les premiers calculs sur le cube (voir 'valid_mask') :
+    IsF_max = IsF_saturation
+
     # --------------------------------------------------------------------------------
-    def nbpix_util(self, root='.'):
+    def nbpix_util(self, root='.', box=3):
         """Calculate the number of usefull pixels in a cube.
 
         Determine the number of pixels that could be chosen,
@@ -53,6 +138,8 @@ class VIMS_uncert(VIMS):
         |   |   |   |   |   |   |
         -------------------------
 
+        For boxes of NxN pixels (N odd), a border of (N-1)/2 pixels is excluded.
+
         Returns
         -------
         int
@@ -61,21 +148,23 @@ class VIMS_uncert(VIMS):
             n_util   : Number of usefull pixels.
 
         """
+        check_box(box)
+        h = box // 2
 
-        cube = VIMS(self.img_id, root=root)
-        nbpix= cube.NP
-        n_sample= cube.NS
-        n_line  = cube.NL
-        n_util  = nbpix - (2*n_sample + 2 * (n_line-2)) # On retire le nbr de pixels sur les bords du cube.
+        n_sample= self.NS
+        n_line  = self.NL
+        n_util  = max(n_sample - 2*h, 0) * max(n_line - 2*h, 0) # On retire les pixels sur les bords du cube.
         return n_sample, n_line, n_util
 
     # --------------------------------------------------------------------------------
-    def choice_pix(self, frac, root='.'):
+    def choice_pix(self, frac, root='.', box=3):
         """
         Random choise of pixels in the cube:
         > input:
             - frac: float
                     the fraction of useful pixels, must be positive and smaller than 1.
+            - box: int
+                    size of the boxes (odd), central pixels are chosen so that the boxes fit in the cube.
         > output: two lists giving sample et line of chosen pixels
             - ns_rand: list of indexes 'sample' for the central chosen pixels.
             - nl_rand: list of indexes 'line' for central chosen pixels.
@@ -83,15 +172,16 @@ class VIMS_uncert(VIMS):
         if frac <= 0. or frac > 1.:
             print (' > Problem in "VIMS_uncert": frac bad value!')
             sys.exit('we stop')
-        n_sample, n_line, n_util= self.nbpix_util(root)
+        n_sample, n_line, n_util= self.nbpix_util(root, box)
         n_pix = int(frac*n_util)
+        h     = box // 2
 
 
         #ns_rand = np.array([rand.randrange(2, n_sample) for i in range(n_pix)])
         #nl_rand = np.array([rand.randrange(2, n_line)   for i in range(n_pix)])
 
-        ns_rand = np.array([np.random.randint(2, n_sample) for i in range(n_pix)])
-        nl_rand = np.array([np.random.randint(2, n_line)   for i in range(n_pix)])
+        ns_rand = np.array([np.random.randint(1+h, n_sample+1-h) for i in range(n_pix)], dtype=int)
+        nl_rand = np.array([np.random.randint(1+h, n_line+1-h)   for i in range(n_pix)], dtype=int)
 
         #print (frac, n_sample, n_line, n_util, n_pix, '\n\n', ns_rand, '\n\n', nl_rand)
 
@@ -99,13 +189,86 @@ class VIMS_uncert(VIMS):
         return ns_rand, nl_rand
 
     # --------------------------------------------------------------------------------
-    def plot_pix_distri(self, frac, root='.', plotdir= '.', figname='Untitled.png'):
+    def choice_pix_strata(self, frac, root='.', box=3, Dang=None, strata=None, n_stratum=None):
+        """
+        Stratified choice of pixels in the cube, based on its geometry. Central pixels whose box does
+        not satisfy the angular criterion of the analysis (relative standard deviations of incidence,
+        emergence and phase angles below 'Dang', as in 'VIMSU_2.IsFavBand') are discarded before any
+        I/F statistics is computed; the others are drawn, without replacement, in classes of incidence,
+        emergence and latitude, so that all the geometries are represented.
+        > input:
+            - frac: float
+                    the fraction of useful pixels, must be positive and smaller than 1; it gives the total
+                    number of chosen pixels when 'n_stratum' is None.
+            - box: int
+                    size of the boxes (odd), central pixels are chosen so that the boxes fit in the cube.
+            - Dang: float
+                    max. relative standard deviation of angles over the boxes (no criterion if None).
+            - strata: dict
+                    'inc', 'eme', 'lat' -> bounds of the classes ('strata_default' if None).
+            - n_stratum: int
+                    number of pixels chosen in each class (all of them if the class is smaller).
+        > output: two arrays giving sample et line of chosen pixels, as 'choice_pix'.
+        """
+        if frac <= 0. or frac > 1.:
+            print (' > Problem in "VIMS_uncert": frac bad value!')
+            sys.exit('we stop')
+        n_sample, n_line, n_util = self.nbpix_util(root, box)
+        h = box // 2
+        if strata is None:
+            strata = strata_default
+
+        # Tous les pixels centraux possibles :
+        nl_all, ns_all = np.mgrid[1+h:n_line+1-h, 1+h:n_sample+1-h]
+        ns_all, nl_all = ns_all.ravel(), nl_all.ravel()
+
+        # Critère de dispersion des angles sur les pavés, pour tous les pixels centraux en une fois :
+        keep = np.ones(ns_all.size, dtype=bool)
+        if Dang is not None:
+            stats = self.box_stats(ns_all, nl_all, box, quantities=('inc', 'eme', 'phase'))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                for name in ('inc', 'eme', 'phase'):
+                    keep &= stats[name + '_std'] / stats[name + '_av'] < Dang
+
+        # Numéro de la strate de chaque pixel central (-1 : hors des strates) :
+        geom    = {'inc': self.inc, 'eme': self.eme, 'lat': self.lat}
+        stratum = np.zeros(ns_all.size, dtype=int)
+        for name, edges in strata.items():
+            edges = np.asarray(edges, dtype=float)
+            val   = np.asarray(geom[name], dtype=float)[nl_all-1, ns_all-1]
+            with np.errstate(invalid='ignore'):
+                inside = (val >= edges[0]) & (val <= edges[-1])
+            keep   &= inside
+            k       = np.searchsorted(edges, np.where(inside, val, edges[0]), side='right') - 1
+            stratum = stratum * (edges.size - 1) + np.clip(k, 0, edges.size - 2)
+        stratum = np.where(keep, stratum, -1)
+
+        # Répartition des tirages entre les strates, puis tirage sans remise dans chacune :
+        labels, counts = np.unique(stratum[keep], return_counts=True)
+        if n_stratum is None:
+            alloc = allocate_strata(counts, int(frac*n_util))
+        else:
+            alloc = np.minimum(counts, int(n_stratum))
+        chosen = [np.random.choice(np.flatnonzero(stratum == lab), n, replace=False)
+                  for lab, n in zip(labels, alloc) if n > 0]
+        chosen = np.concatenate(chosen) if chosen else np.empty(0, dtype=int)
+        np.random.shuffle(chosen)
+        return ns_all[chosen], nl_all[chosen]
+
+    # --------------------------------------------------------------------------------
+    def plot_pix_distri(self, frac, root='.', plotdir= '.', figname='Untitled.png', box=3, sampling=None):
         """
         Plot, over the considered cube, of the randomly chosen pixels.
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
+            - sampling: options of the stratified choice of pixels (see 'comp_logect_pave_multi').
         """
-        ns_rand, nl_rand = self.choice_pix(frac, root)
+        import matplotlib.pyplot as plt
+
+        if sampling is None:
+            ns_rand, nl_rand = self.choice_pix(frac, root, box)
+        else:
+            ns_rand, nl_rand = self.choice_pix_strata(frac, root, box, **sampling)
 
         fig, axes = plt.subplots(sharey=True, figsize=(12, 6))
         plt.rcParams.update({'figure.max_open_warning': 0})
@@ -119,12 +282,189 @@ class VIMS_uncert(VIMS):
         fig.savefig(plotdir + figname)
 
     # --------------------------------------------------------------------------------
-    def comp_logect(self, frac, root='.'):
+    def valid_mask(self):
+        """
+        Valid I/F values of the cube, determined once for the whole cube: values which are not NaN,
+        strictly positive, not ISIS special values (see 'ISIS_special_abs') and, if 'IsF_max' is set,
+        not saturated (I/F < IsF_max). Invalid values are never used in the statistics of boxes.
+        > output: boolean array of the shape of the data (number of VIMS channels, NL, NS).
+        """
+        try:
+            return self._uncert_valid
+        except AttributeError:
+            pass
+
+        data = np.asarray(self.data, dtype=float)
+        with np.errstate(invalid='ignore'):
+            valid = np.isfinite(data) & (data > 0.) & (np.abs(data) < ISIS_special_abs)
+            if self.IsF_max is not None:
+                valid &= data < self.IsF_max
+        self._uncert_valid = valid
+        return self._uncert_valid
+
+    # --------------------------------------------------------------------------------
+    def integral_images(self):
+        """
+        Summed-area tables of I/F (all VIMS channels) and of I/F², and the same for incidence,
+        emergence and phase angles. They are computed once per cube, and kept.
+        To limit round-off errors in the variances, each quantity is shifted by its mean over
+        the cube (this does not change standard deviations).
+        Invalid values (see 'valid_mask'; NaN for angles) are replaced by zeros, and counted in a
+        third table, so that they do not spread over all the following boxes.
+        > output: dictionary, quantity -> (shift, sat of x - shift, sat of (x - shift)², sat of the
+                  number of invalid values)
+        """
+        try:
+            return self._uncert_sat
+        except AttributeError:
+            pass
+
+        self._uncert_sat = {}
+        planes = {'IsF': self.data, 'inc': self.inc, 'eme': self.eme, 'phase': self.phase}
+        for name, arr in planes.items():
+            arr   = np.asarray(arr, dtype=float)
+            valid = self.valid_mask() if name == 'IsF' else np.isfinite(arr)
+            count = np.maximum(valid.sum(axis=(-2, -1), keepdims=True), 1)
+            shift = np.where(valid, arr, 0.).sum(axis=(-2, -1), keepdims=True) / count
+            x     = np.where(valid, arr - shift, 0.)
+            self._uncert_sat[name] = (shift[..., 0, 0], integral_image(x), integral_image(x*x), integral_image(~valid))
+        return self._uncert_sat
+
+    # --------------------------------------------------------------------------------
+    def box_stats(self, ns, nl, box=3, quantities=None):
+        """
+        Means and standard deviations, over boxes of box x box pixels, of I/F (for all VIMS channels)
+        and of incidence, emergence and phase angles. Each box costs O(1) whatever its size, thanks
+        to summed-area tables (see 'integral_images').
+        > input:
+            - ns, nl: arrays of 'sample' and 'line' (1-based) of the central pixels of the boxes.
+            - box: size of the boxes (odd), they must fit in the cube.
+            - quantities: names of the quantities ('IsF', 'inc', 'eme', 'phase'), all if None.
+        > output: dictionary with
+            - 'IsF_av', 'IsF_std', 'IsF_masked': arrays of shape (number of boxes, number of VIMS channels).
+            - 'inc_av', 'inc_std', 'inc_masked', 'eme_av', ..., 'phase_masked': arrays of shape
+              (number of boxes,).
+            The '_masked' arrays give the fraction of invalid values in the boxes; averages and standard
+            deviations are NaN when the box contains invalid values.
+        """
+        check_box(box)
+        n = float(box * box)
+
+        stats = {}
+        for name, (shift, sat1, sat2, satm) in self.integral_images().items():
+            if quantities is not None and name not in quantities:
+                continue
+            m1  = box_sum(sat1, ns, nl, box) / n
+            m2  = box_sum(sat2, ns, nl, box) / n
+            msk = np.rint(box_sum(satm, ns, nl, box)) / n
+            std = np.where(msk > 0., np.nan, np.sqrt(np.maximum(m2 - m1*m1, 0.)))
+            av  = np.where(msk > 0., np.nan, m1 + np.asarray(shift)[..., None])
+            if name == 'IsF':
+                av, std, msk = av.T, std.T, msk.T
+            stats[name + '_av']     = av
+            stats[name + '_std']    = std
+            stats[name + '_masked'] = msk
+        return stats
+
+    # --------------------------------------------------------------------------------
+    def masked_fraction(self, ns, nl, box=3, channels=None):
+        """
+        Fraction of invalid I/F values (see 'valid_mask') in boxes, over a range of VIMS channels.
+        > input:
+            - ns, nl: arrays of 'sample' and 'line' (1-based) of the central pixels of the boxes.
+            - box: size of the boxes (odd), they must fit in the cube.
+            - channels: (i0, i1), first and last VIMS channels (1-based, as the 'DIsF_i' columns of the
+              boxes DataFrame) over which the fraction is computed, all channels if None.
+        > output: array of shape (number of boxes,).
+        """
+        check_box(box)
+        satm = self.integral_images()['IsF'][3]
+        if channels is not None:
+            satm = satm[channels[0]-1:channels[1]]
+        return np.rint(box_sum(satm, ns, nl, box)).sum(axis=0) / float(box * box * satm.shape[0])
+
+    # --------------------------------------------------------------------------------
+    def inside(self, ns, nl, box=3):
+        """
+        Boxes which fit in the cube.
+        > input:
+            - ns, nl: arrays of 'sample' and 'line' (1-based) of the central pixels of the boxes.
+            - box: size of the boxes (odd).
+        > output: boolean array, True for the boxes entirely in the cube.
+        """
+        check_box(box)
+        h  = box // 2
+        ns = np.asarray(ns)
+        nl = np.asarray(nl)
+        return (ns >= 1+h) & (ns <= self.NS-h) & (nl >= 1+h) & (nl <= self.NL-h)
+
+    # --------------------------------------------------------------------------------
+    def box_spectra(self, ns=None, nl=None, mask=None, box=3, max_masked=None, mask_channels=None):
+        """
+        Statistics of the boxes centered on given pixels (e.g. the footprint of a landing site, or a
+        mosaic seam), in one call: the quantities of the columns of the boxes DataFrame of
+        'VIMSU_1.VIMS_u', as NumPy arrays. Boxes which do not fit in the cube are left out.
+        > input:
+            - ns, nl: arrays of 'sample' and 'line' (1-based) of the central pixels of the boxes.
+            - mask: boolean array of shape (NL, NS), True for the central pixels (instead of 'ns', 'nl').
+            - box: size of the boxes (odd).
+            - max_masked: boxes with a larger fraction of invalid I/F values (see 'valid_mask') are left out.
+            - mask_channels: (i0, i1), VIMS channels (1-based) over which the fraction of invalid values
+              is computed (see 'masked_fraction'), all channels if None.
+        > output: dictionary with
+            - 'index': positions of the kept boxes in 'ns' and 'nl' (or among the pixels of 'mask', in
+              C order).
+            - 's', 'l': 'sample' and 'line' of their central pixels.
+            - 'lat', 'lon', 'res': latitude, longitude and resolution of their central pixels.
+            - 'DIsF', 'IFav': arrays of shape (number of boxes, number of VIMS channels), log10 of the
+              relative standard deviations of I/F (see 'log10_relat_std') and averages of I/F; NaN for the
+              channels with invalid values in the box.
+            - 'Fmask': fraction of invalid I/F values in the boxes, over the channels 'mask_channels'.
+            - 'Dinc', 'incAv', 'Deme', 'emeAv', 'Dphase', 'phaseAv': relative standard deviations and
+              averages of incidence, emergence and phase angles.
+        """
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != (self.NL, self.NS):
+                print (' > Problem in "VIMS_uncert": mask of shape', mask.shape, 'instead of', (self.NL, self.NS))
+                sys.exit('we stop')
+            nl, ns = np.nonzero(mask)
+            ns, nl = ns + 1, nl + 1
+        ns = np.atleast_1d(np.asarray(ns, dtype=int))
+        nl = np.atleast_1d(np.asarray(nl, dtype=int))
+        if ns.shape != nl.shape or ns.ndim != 1:
+            print (' > Problem in "VIMS_uncert": ns and nl must be 1D arrays of the same size', ns.shape, nl.shape)
+            sys.exit('we stop')
+
+        # On écarte, en une fois, les pavés qui débordent du cube, puis ceux qui ont trop de valeurs invalides :
+        index  = np.flatnonzero(self.inside(ns, nl, box))
+        ns, nl = ns[index], nl[index]
+        if max_masked is not None:
+            keep   = self.masked_fraction(ns, nl, box, mask_channels) <= max_masked
+            index, ns, nl = index[keep], ns[keep], nl[keep]
+
+        stats = self.box_stats(ns, nl, box)
+        out   = {'index': index, 's': ns, 'l': nl,
+                 'lat'  : np.asarray(self.lat)[nl-1, ns-1], # Planetocentric North latitude
+                 'lon'  : np.asarray(self.lon)[nl-1, ns-1], # Planetocentric West longitude.
+                 'res'  : np.asarray(self.res)[nl-1, ns-1],
+                 'DIsF' : np.where(stats['IsF_masked'] > 0., np.nan, log10_relat_std(stats['IsF_std'], stats['IsF_av'])),
+                 'IFav' : stats['IsF_av'],
+                 'Fmask': self.masked_fraction(ns, nl, box, mask_channels)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name in ('inc', 'eme', 'phase'):
+                out['D' + name]  = stats[name + '_std'] / stats[name + '_av']
+                out[name + 'Av'] = stats[name + '_av']
+        return out
+
+    # --------------------------------------------------------------------------------
+    def comp_logect(self, frac, root='.', box=3):
         """
         Détermination de l'écart-type relatif en fonction du canal VIMS, ceci pour la fraction 'frac'
         de pixels choisis.
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
+            - box: size of the pixels blocks (odd, 3 by default).
         > output:
             - nb_pix: number of 3x3 pixels blocks.
             - cano: list of VIMS channels.
@@ -132,6 +472,8 @@ class VIMS_uncert(VIMS):
                   corresponding to the 'npix' 3x3 blocks.
             - spl_func_list: list of fitting function (based on splines).
         """
+        from scipy.interpolate import UnivariateSpline
+
         nb_VIMS_channels = 256
 
         cano = np.array([i for i in range(nb_VIMS_channels)]) # Construction de la liste des indices des canaux VIMS.
@@ -140,40 +482,20 @@ class VIMS_uncert(VIMS):
                        # correspond à un pixel.
 
         # Construction des listes de coordonnées des pixels choisis :
-        ns_rand, nl_rand = self.choice_pix(frac, root)
+        ns_rand, nl_rand = self.choice_pix(frac, root, box)
         nb_pix = ns_rand.size
 
+        # Moyennes et écart-types de I/F sur les pavés, pour tous les canaux VIMS en une fois :
+        stats = self.box_stats(ns_rand, nl_rand, box)
+        log10_ectype_relat_arr = log10_relat_std(stats['IsF_std'], stats['IsF_av'])
+
         for i in  range(nb_pix):
-            s = ns_rand[i]
-            l = nl_rand[i]
-            pixels = [ [s-1, l-1], [s, l-1], [s+1, l-1],
-                       [s-1, l  ], [s, l  ], [s+1, l],
-                       [s-1, l+1], [s, l+1], [s+1, l+1] ]
-            # Boucle sur les canaux VIMS :
-            log10_ectype_relat = np.array([])
-            for can in range(nb_VIMS_channels):
-                IsF_block = np.array([]) # On construit une liste avec les I/F du canal VIMS considéré,
-                                         # ceci sur les 9 pixels du "pavé" considéré.
-                for pix in pixels:
-                    #print (pix)
-                    sa = pix[0]
-                    li = pix[1]
-                    IsF = self[sa, li].spectrum[can]
-                    IsF_block = np.append(IsF_block, IsF)
-                # On calcule, pour le canal en question, l'écart-type relatif pour les 9 pixels considérés :
-                #   - Rq. : on élimine les valeurs aberrantes qui surviennent pour quelques pixels, ceci en
-                #           remplaçant leur écart-type relatif par "0.5"
-                ectr = np.std(IsF_block)/np.mean(IsF_block) # l'écart-type relatif calculé sur le pavé de 9x9 pixels
-                if (ectr > 0.) and (ectr < 1.):
-                    log10_ectype_relat = np.append(log10_ectype_relat, np.log10(ectr))
-                else:
-                    ectr = 0.5
-                    log10_ectype_relat = np.append(log10_ectype_relat, np.log10(ectr))
+            log10_ectype_relat = log10_ectype_relat_arr[i]
 
             # On stocke le dataset des écart-types relatifs "observés" de chaque pavé de pixels :
             log10_ectype_relat_list.append(log10_ectype_relat)
 
-            # Construction de la fonction de fit par splines, une par pavé de pixels :
+            # Construction de la fonction de fit par splines, une par pavé de pixels :
             spl = UnivariateSpline(cano, log10_ectype_relat, k=5)
             spl_func_list.append(spl)
         # On renvoit deux listes de listes, la première avec les 256 valeurs observées pour chaque
@@ -189,6 +511,8 @@ class VIMS_uncert(VIMS):
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
         """
+        import matplotlib.pyplot as plt
+
         npix, cann, log10_ectype_relat_list, spl_func_list = self.comp_logect(frac)
         fig, ax = plt.subplots()
         plt.xlabel('VIMS channels')
@@ -202,6 +526,8 @@ class VIMS_uncert(VIMS):
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
         """
+        import matplotlib.pyplot as plt
+
         npix, cann, log10_ectype_relat_list, spl_func_list = self.comp_logect(frac, root)
         fig, ax = plt.subplots()
         plt.xlabel('VIMS channels')
@@ -243,6 +569,8 @@ class VIMS_uncert(VIMS):
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
         """
+        import matplotlib.pyplot as plt
+
         npix, cann, log10_ectype_relat_list, spl_func_list = self.comp_logect(frac, root)
         cann, smoothed_fit= self.det_smoothed_fit(frac, root)
         fig, ax = plt.subplots()
@@ -281,13 +609,14 @@ class VIMS_uncert(VIMS):
     # ================================================================================
     # 5 octobre 2020 : version qui pour un cube donné sort toutes les caractéristiques
     #                  de tous les pavés de 3x3 pixels.
-    def comp_logect_pave(self, frac, root='.'):
+    def comp_logect_pave(self, frac, root='.', box=3):
         """
         Détermination de l'écart-type relatif en fonction du canal VIMS, ceci pour la fraction 'frac'
         de pixels choisis.
 
         > input:
             - frac: the fraction of useful pixels, must be positive and smaller than 1.
+            - box: size of the pixels boxes (odd, 3 by default).
         > output:
             - N_sample : dimension 'sample' du cube utilisé.
             - N_line   : dimension 'line' du cube utilisé.
@@ -310,6 +639,49 @@ class VIMS_uncert(VIMS):
             - ectr_phase : écart-types relatifs sur les angles de phase, sur les pavés.
             - phase_av   : valeurs moyennes des angles de phases, sur les pavés.
         """
+        N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, \
+        ns_rand, nl_rand, latC_pav, lonC_pav, res_av, per_box = self.comp_logect_pave_multi(frac, root, boxes=[box])
+
+        log10_ectype_relat, IsF_av, ectr_inc, inc_av, ectr_eme, eme_av, ectr_phase, phase_av, Fmask = per_box[box]
+
+        # ----------------------------------------------------------
+        # Sorties :
+        return N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, \
+               ns_rand, nl_rand, latC_pav, lonC_pav, res_av, log10_ectype_relat, IsF_av, \
+               ectr_inc, inc_av, \
+               ectr_eme, eme_av, \
+               ectr_phase, phase_av
+
+    # --------------------------------------------------------------------------------
+    def comp_logect_pave_multi(self, frac, root='.', boxes=(3,), sampling=None, max_masked=None, mask_channels=None):
+        """
+        Même chose que 'comp_logect_pave', mais pour plusieurs tailles de pavés (3x3, 5x5, 7x7, ...)
+        en une seule passe, pour une étude multi-échelles. Les pavés de toutes les tailles sont centrés
+        sur les mêmes pixels, tirés au sort de sorte que le plus grand pavé soit dans le cube.
+
+        > input:
+            - frac: the fraction of useful pixels, must be positive and smaller than 1.
+            - boxes: list of the sizes of pixels boxes (odd).
+            - sampling: None for a uniform choice of the central pixels ('choice_pix'), or dictionary of
+              the options of the stratified choice ('Dang', 'strata', 'n_stratum', see 'choice_pix_strata',
+              the angular criterion being applied to the largest boxes).
+            - max_masked: the central pixels whose boxes (of any size) have a larger fraction of invalid I/F
+              values (see 'valid_mask') are left out; no box is left out if None.
+            - mask_channels: (i0, i1), VIMS channels (1-based) over which the fraction of invalid values is
+              computed, e.g. the band to be analysed; all channels if None (see 'masked_fraction').
+        > output:
+            - N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, ns_rand, nl_rand,
+              latC_pav, lonC_pav, res_av: see 'comp_logect_pave'.
+            - per_box: dictionnaire, taille de pavé -> (log10_ectype_relat, IsF_av, ectr_inc, inc_av,
+              ectr_eme, eme_av, ectr_phase, phase_av, Fmask), voir 'comp_logect_pave'; 'Fmask' est la
+              fraction de valeurs invalides de I/F dans les pavés (voir 'box_spectra'), les canaux ayant des
+              valeurs invalides dans un pavé y ont des 'log10_ectype_relat' et 'IsF_av' NaN.
+        """
+        from titan import orbit
+
+        for box in boxes:
+            check_box(box)
+
         nb_VIMS_channels = 256
 
         # ----------------------------------------------------------
@@ -326,113 +698,36 @@ class VIMS_uncert(VIMS):
         instru_temp = self.isis['INSTRUMENT_TEMPERATURE']
         opt_temp    = self.isis['OPTICS_TEMPERATURE']
 
-        # ----------------------------------------------------------
-        log10_ectype_relat_list = [] # On stocke la liste des lois d'écart-type relatifs. Chaque élément de cette liste
-                                     # correspond à un pixel.
-
         # ----------------------------------------------------------
         # Construction des listes de coordonnées des pixels centraux (i.e. pixels aux centres des
-        # pavés 3x3 tirés au sort dans le cube) choisis :
-        ns_rand, nl_rand = self.choice_pix(frac, root)
-        nb_pix = ns_rand.size
-
-        # ----------------------------------------------------------
-        # Construction des tableaux des latitudes, longitudes et résolution
-        # moyenne des pixels centraux des pavés 3x3 :
-        latC_pav = np.array([])
-        lonC_pav = np.array([])
-        res_av   = np.array([])
-        for i in  range(nb_pix):
-            s = ns_rand[i]
-            l = nl_rand[i]
-            myLat = self[s, l].lat # Planetocentric North latitude
-            myLon = self[s, l].lon # Planetocentric West longitude.
-            myRes = self[s, l].res # :
-            latC_pav = np.append(latC_pav, myLat)
-            lonC_pav = np.append(lonC_pav, myLon)
-            res_av   = np.append(res_av, myRes)
+        # pavés tirés au sort dans le cube) choisis, valables pour le plus grand pavé :
+        if sampling is None:
+            ns_rand, nl_rand = self.choice_pix(frac, root, max(boxes))
+        else:
+            ns_rand, nl_rand = self.choice_pix_strata(frac, root, max(boxes), **sampling)
+
+        # On écarte les pixels centraux des pavés contenant trop de valeurs invalides (NaN, négatives, ...),
+        # avec le masque calculé une fois pour tout le cube :
+        if max_masked is not None:
+            keep = np.ones(ns_rand.size, dtype=bool)
+            for box in boxes:
+                keep &= self.masked_fraction(ns_rand, nl_rand, box, mask_channels) <= max_masked
+            ns_rand, nl_rand = ns_rand[keep], nl_rand[keep]
 
         # ----------------------------------------------------------
-        # Construction des tableaux d'écrat-types relatif et de moyenne de I/F
-        # ceci sur tous les pavés 3x3 et les canaux VIMS :
-        log10_ectype_relat = []
-        IsF_av             = []
-        for i in  range(nb_pix):
-            s = ns_rand[i]
-            l = nl_rand[i]
-            pixels = [ [s-1, l-1], [s, l-1], [s+1, l-1],
-                       [s-1, l  ], [s, l  ], [s+1, l],
-                       [s-1, l+1], [s, l+1], [s+1, l+1] ]
-
-            # Boucle sur les canaux VIMS :
-            log10_ectype_relat_temp = np.array([])
-            IsF_av_temp             = np.array([])
-            for can in range(nb_VIMS_channels):
-                IsF_block = np.array([]) # On construit une liste avec les I/F du canal VIMS considéré,
-                                         # ceci sur les 9 pixels du "pavé" considéré.
-                for pix in pixels:
-                    #print (pix)
-                    sa = pix[0]
-                    li = pix[1]
-                    IsF = self[sa, li].spectrum[can]
-                    IsF_block = np.append(IsF_block, IsF)
-                # On calcule, pour le canal en question, l'écart-type relatif pour les 9 pixels considérés :
-                #   - Rq. : on élimine les valeurs aberrantes qui surviennent pour quelques pixels, ceci en
-                #           remplaçant leur écart-type relatif par "0.5"
-                ectr = np.std(IsF_block)/np.mean(IsF_block) # l'écart-type relatif calculé sur le pavé de 3x3 pixels
-                if (ectr > 0.) and (ectr < 1.):
-                    log10_ectype_relat_temp = np.append(log10_ectype_relat_temp, np.log10(ectr))
-                else:
-                    ectr = 0.5
-                    log10_ectype_relat_temp = np.append(log10_ectype_relat_temp, np.log10(ectr))
-                # Et pour le canal en question du pavé considéré on calcul la moyenne de I/F :
-                IsF_av_temp = np.append(IsF_av_temp, np.mean(IsF_block))
-
-            log10_ectype_relat.append(log10_ectype_relat_temp)
-            IsF_av.append(IsF_av_temp)
+        # Écart-types relatifs et moyennes de I/F (tous les canaux VIMS) et des angles d'incidence,
+        # d'émergence et de phase, pour chaque taille de pavé (tables de sommes cumulées, voir 'box_spectra') :
+        per_box = {}
+        for box in boxes:
+            spec = self.box_spectra(ns_rand, nl_rand, box=box, mask_channels=mask_channels)
+            per_box[box] = (list(spec['DIsF']), list(spec['IFav']), spec['Dinc'], spec['incAv'], \
+                            spec['Deme'], spec['emeAv'], spec['Dphase'], spec['phaseAv'], spec['Fmask'])
 
         # ----------------------------------------------------------
-        # Construction des tableaux d'écart-types relatifs et de moyennes
-        # pour les angles : incidence, émergence et phase :
-        ectr_inc = np.array([])
-        inc_av   = np.array([])
-        ectr_eme = np.array([])
-        eme_av   = np.array([])
-        ectr_phase = np.array([])
-        phase_av   = np.array([])
-
-        for i in  range(nb_pix):
-            s = ns_rand[i]
-            l = nl_rand[i]
-            pixels = [ [s-1, l-1], [s, l-1], [s+1, l-1],
-                       [s-1, l  ], [s, l  ], [s+1, l],
-                       [s-1, l+1], [s, l+1], [s+1, l+1] ]
-
-            inc_temp   = np.array([])
-            eme_temp   = np.array([])
-            phase_temp = np.array([])
-
-            for pix in pixels:
-                #print (pix)
-                sa = pix[0]
-                li = pix[1]
-                inc_temp   = np.append(inc_temp, self[sa, li].inc)
-                eme_temp   = np.append(eme_temp, self[sa, li].eme)
-                phase_temp = np.append(phase_temp, self[sa, li].phase)
-
-            ectr_inc   = np.append(ectr_inc, np.std(inc_temp)/np.mean(inc_temp))
-            inc_av     = np.append(inc_av,   np.mean(inc_temp))
-
-            ectr_eme   = np.append(ectr_eme, np.std(eme_temp)/np.mean(eme_temp))
-            eme_av     = np.append(eme_av,   np.mean(eme_temp))
-
-            ectr_phase = np.append(ectr_phase, np.std(phase_temp)/np.mean(phase_temp))
-            phase_av   = np.append(phase_av,   np.mean(phase_temp))
+        # Latitudes, longitudes et résolution des pixels centraux des pavés :
+        latC_pav, lonC_pav, res_av = spec['lat'], spec['lon'], spec['res']
 
         # ----------------------------------------------------------
-        # Sorties :
+        # Sorties :
         return N_sample, N_line, Expo_time, Ls, detect_temp, instru_temp, opt_temp, \
-               ns_rand, nl_rand, latC_pav, lonC_pav, res_av, log10_ectype_relat, IsF_av, \
-               ectr_inc, inc_av, \
-               ectr_eme, eme_av, \
-               ectr_phase, phase_av
+               ns_rand, nl_rand, latC_pav, lonC_pav, res_av, per_box
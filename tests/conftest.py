@@ -0,0 +1,71 @@
+"""
+Common fixtures of the tests: the modules are imported from the root of the repository, and the cubes
+shipped in 'VIMS_CALCUBES' are used as test data.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CUBES_DIR = os.path.join(ROOT, 'VIMS_CALCUBES')
+
+# A few small cubes shipped with the repository:
+CUBES = ['1537734379_1', '1537734522_1', '1537734601_1']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='session')
+def cube_names():
+    return list(CUBES)
+
+@pytest.fixture(scope='session')
+def cubes_dir(tmp_path_factory):
+    """
+    Directory with links to the test cubes, so that the outputs written next to the cubes (plots of
+    the chosen boxes) stay out of the repository.
+    """
+    d = tmp_path_factory.mktemp('cubes')
+    for cname in CUBES:
+        fname = 'C' + cname + '_ir.cub'
+        os.symlink(os.path.join(CUBES_DIR, fname), d / fname)
+    return str(d) + '/'
+
+@pytest.fixture(scope='session')
+def cube_list(tmp_path_factory):
+    """
+    CSV list of the test cubes, as 'VIMSuncert_cubes_list.csv'.
+    """
+    fname = tmp_path_factory.mktemp('lists') / 'cubes.csv'
+    fname.write_text('Cube name\n' + '\n'.join(CUBES) + '\n')
+    return str(fname)
+
+@pytest.fixture(scope='session')
+def cube():
+    from VIMS_uncertainties import VIMS_uncert
+    return VIMS_uncert('C' + CUBES[0] + '_ir.cub', root=CUBES_DIR + '/')
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def extract(cube_list, cubes_dir, seed=5, pipelined=False, **kwargs):
+    """
+    Extraction of boxes (3x3 and 5x5) of the test cubes, with a given seed of the random choice of
+    central pixels.
+    """
+    import VIMSU_1 as v1
+
+    vu = v1.VIMS_u(cube_list, cubes_dir, 0.3, boxes=(3, 5), **kwargs)
+    np.random.seed(seed)
+    if pipelined:
+        Cubes_DF, Pav_DF, _ = vu.extract_pipelined(cubes_dir=cubes_dir, prefetch=2)
+        return Cubes_DF, Pav_DF
+    return vu.extract_3x3box(cubes_dir=cubes_dir)
+
+@pytest.fixture(scope='session')
+def extraction(cube_list, cubes_dir):
+    """
+    DataFrames of cubes and of boxes of a sequential extraction of the test cubes.
+    """
+    return extract(cube_list, cubes_dir)
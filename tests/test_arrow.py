@@ -0,0 +1,74 @@
+"""
+Tests of the Arrow / Parquet files of cubes and boxes (VIMSU_arrow), and of the selection of boxes read
+from them (VIMSU_2.IsFavBand).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import VIMSU_2 as v2
+import VIMSU_arrow as va
+import VIMSU_batch as vb
+from VIMSU_1 import Cubes_key, Cubes_metadata, Pav_key, Pav_metadata, write_DF_HDF5
+from VIMSU_cache import ResultCache
+from test_isfavband import Dang, assert_same, bands, reference, selections
+
+formats = ['.arrow', '.parquet']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module', params=formats)
+def pav_file(request, extraction, tmp_path_factory):
+    fname = str(tmp_path_factory.mktemp('arrow') / ('pav' + request.param))
+    va.write_DF_arrow(extraction[1], fname, Pav_metadata)
+    return fname
+
+@pytest.mark.parametrize('ext', formats)
+@pytest.mark.parametrize('k, metadata', [(0, Cubes_metadata), (1, Pav_metadata)])
+def test_round_trip(extraction, tmp_path, ext, k, metadata):
+    DF    = extraction[k]
+    fname = str(tmp_path / ('data' + ext))
+    va.write_DF_arrow(DF, fname, metadata)
+
+    table = va.read_table(fname)
+    assert va.table_metadata(table) == metadata
+    assert va.table_columns(fname) == table.column_names
+    pd.testing.assert_frame_equal(va.table_to_DF(table), DF.infer_objects().reset_index(drop=True))
+
+def test_spectral_blocks(extraction, pav_file):
+    table = va.read_table(pav_file, columns=['DIsF', 'IFav'])
+    for block in va.spectral_blocks:
+        cols = [f'{block}_{i+1}' for i in range(va.Nchan_VIMS)]
+        np.testing.assert_array_equal(va.spectral_block(table, block), extraction[1][cols].to_numpy(dtype=float))
+    if pav_file.endswith(va.arrow_ext):
+        assert not va.spectral_block(table, 'DIsF').flags.owndata # Memory-mapped, not copied.
+
+def test_unknown_extension(extraction, tmp_path):
+    with pytest.raises(ValueError, match='Unknown extension'):
+        va.write_DF_arrow(extraction[0], str(tmp_path / 'data.csv'))
+    with pytest.raises(ValueError, match='Unknown extension'):
+        va.read_table(str(tmp_path / 'data.csv'))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_IsFavBand_same_as_DataFrame(extraction, pav_file, cube_names):
+    Pav_DF = extraction[1]
+    for sel in selections(Pav_DF, cube_names):
+        assert_same(v2.IsFavBand(pav_file, bands, Dang, **sel), reference(Pav_DF, **sel))
+
+def test_where_on_any_scalar_column(extraction, pav_file):
+    Pav_DF = extraction[1]
+    for where in ['Fmask <= 0.025', '(lat < -58.) & (lon > 335.)', v2.Pav_where(res_max=6.4, masked_max=0.03)]:
+        ref = reference(Pav_DF, where=where)
+        assert len(ref[0][0]) > 0
+        assert_same(v2.IsFavBand(pav_file, bands, Dang, where=where), ref)
+
+def test_convert_command(extraction, tmp_path):
+    cubes_file, pav_file = str(tmp_path / 'cubes.hdf5'), str(tmp_path / 'pav.hdf5')
+    write_DF_HDF5(extraction[0], cubes_file, Cubes_key, Cubes_metadata)
+    write_DF_HDF5(extraction[1], pav_file, Pav_key, Pav_metadata)
+
+    out_cubes, out_pav = str(tmp_path / 'cubes.parquet'), str(tmp_path / 'pav.arrow')
+    vb.main(['convert', '--pav-file', pav_file, '--out-pav', out_pav, '--cubes-file', cubes_file, '--out-cubes', out_cubes])
+    pd.testing.assert_frame_equal(va.table_to_DF(va.read_table(out_cubes)), extraction[0].infer_objects())
+    assert vb.box_sizes(out_pav) == [3, 5]
+    cache = ResultCache(str(tmp_path / 'cache'))
+    assert_same(v2.IsFavBand_cached(out_pav, bands, Dang, box=5, cache=cache), reference(extraction[1], box=5))
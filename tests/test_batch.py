@@ -0,0 +1,112 @@
+"""
+Tests of the batch tool (VIMSU_batch): sharding of the list of cubes, merge of the shards, and checks of
+the stores given to 'analyse'.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import VIMSU_batch as vb
+from VIMSU_1 import Cubes_key, Pav_key, shard_list
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('n, N', [(10, 1), (10, 3), (7, 7), (3, 5)])
+def test_shard_list_partition(n, N):
+    clist = np.array([f'{k:04d}_1' for k in range(n)])
+    shards = [shard_list(clist, i, N) for i in range(N)]
+    merged = np.concatenate(shards)
+    assert sorted(merged) == sorted(clist)            # Each cube in exactly one shard...
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1 # ... and shards of the same size within one cube.
+
+@pytest.mark.parametrize('i, N', [(0, 0), (3, 3), (-1, 2)])
+def test_shard_list_bad(i, N):
+    with pytest.raises(ValueError):
+        shard_list(np.array(['a', 'b']), i, N)
+
+def test_parse_shard():
+    assert vb.parse_shard(' 3 / 16 ') == (3, 16)
+    for txt in ['16/16', '3', 'a/b']:
+        with pytest.raises(Exception):
+            vb.parse_shard(txt)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def shard_dir(tmp_path_factory, cube_list, cubes_dir):
+    """
+    The test cubes extracted in two shards, with the command-line tool.
+    """
+    out = tmp_path_factory.mktemp('shards')
+    for i in range(2):
+        np.random.seed(i)
+        vb.main(['extract', '--list', cube_list, '--cubes-dir', cubes_dir, '--frac', '0.3', '--boxes', '3', '5',
+                 '--shard', f'{i}/2', '--out-dir', str(out)])
+    return out
+
+def test_merge_round_trip(shard_dir, cube_names):
+    Cubes_DF, Pav_DF = vb.merge_shards(str(shard_dir), np.array(cube_names))
+
+    # Each cube once, in the order of the list, and the boxes of each cube as written in its shard:
+    assert Cubes_DF['Cube name'].tolist() == cube_names
+    assert list(pd.unique(Pav_DF['Cube name'])) == cube_names
+    _, cubes_files, pav_files = vb.find_shards(str(shard_dir))
+    for i, fname in pav_files.items():
+        shard = pd.read_hdf(fname, Pav_key)
+        for cname in shard_list(np.array(cube_names), i, 2):
+            a = shard[shard['Cube name'] == cname].reset_index(drop=True)
+            b = Pav_DF[Pav_DF['Cube name'] == cname].reset_index(drop=True)
+            pd.testing.assert_frame_equal(a, b)
+
+def test_merge_command(shard_dir, cube_list, tmp_path):
+    out_c, out_p = str(tmp_path / 'c.hdf5'), str(tmp_path / 'p.hdf5')
+    vb.main(['merge', '--shard-dir', str(shard_dir), '--list', cube_list, '--out-cubes', out_c, '--out-pav', out_p])
+    Cubes_DF, Pav_DF = vb.merge_shards(str(shard_dir), vb.read_cubes_list(cube_list))
+    pd.testing.assert_frame_equal(pd.read_hdf(out_c, Cubes_key), Cubes_DF)
+    pd.testing.assert_frame_equal(pd.read_hdf(out_p, Pav_key), Pav_DF)
+
+def test_merge_missing_shard(shard_dir, tmp_path):
+    for fname in os.listdir(shard_dir):
+        if 'shard0001' not in fname or 'PavData' not in fname:
+            shutil.copy(shard_dir / fname, tmp_path / fname)
+    with pytest.raises(ValueError, match='Missing shard'):
+        vb.merge_shards(str(tmp_path))
+
+def test_merge_missing_and_extra_cubes(shard_dir, cube_names):
+    with pytest.raises(ValueError, match='Missing cube'):
+        vb.merge_shards(str(shard_dir), np.array(cube_names + ['1234567890_1']))
+    with pytest.raises(ValueError, match='not in the list'):
+        vb.merge_shards(str(shard_dir), np.array(cube_names[1:]))
+
+def test_merge_duplicated_cubes(shard_dir, tmp_path):
+    # Shard 0 of 2 copied as shard 1: its cubes appear twice.
+    for kind in ('CubeData', 'PavData'):
+        src = shard_dir / vb.shard_fmt.format(kind=kind, i=0, N=2)
+        for i in range(2):
+            shutil.copy(src, tmp_path / vb.shard_fmt.format(kind=kind, i=i, N=2))
+    with pytest.raises(ValueError, match='Duplicated cube'):
+        vb.merge_shards(str(tmp_path))
+
+def test_merge_empty_shard(shard_dir, tmp_path, cube_names):
+    # A shard without any box (e.g. strict '--max-masked'): its store has an empty table.
+    from VIMSU_1 import Pav_data_columns, write_DF_HDF5
+    for fname in os.listdir(shard_dir):
+        shutil.copy(shard_dir / fname, tmp_path / fname)
+    fname = str(tmp_path / vb.shard_fmt.format(kind='PavData', i=1, N=2))
+    Pav_DF = pd.read_hdf(fname, Pav_key)
+    Pav_DF = Pav_DF[Pav_DF['Cube name'] == ''] # No row.
+    write_DF_HDF5(Pav_DF, fname, Pav_key, data_columns=Pav_data_columns)
+
+    Cubes_DF, merged = vb.merge_shards(str(tmp_path), np.array(cube_names))
+    assert len(Cubes_DF) == len(cube_names)
+    assert set(merged['Cube name']) == set(shard_list(np.array(cube_names), 0, 2))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_analyse_refuses_mixed_box_sizes(shard_dir, tmp_path):
+    fname = str(shard_dir / vb.shard_fmt.format(kind='PavData', i=0, N=2))
+    assert vb.box_sizes(fname) == [3, 5]
+    args = ['analyse', '--pav-file', fname, '--figname', '', '--cache-dir', str(tmp_path)]
+    with pytest.raises(SystemExit, match='--box'):
+        vb.main(args)
+    vb.main(args + ['--box', '5'])
@@ -0,0 +1,83 @@
+"""
+Tests of the statistics of boxes on given pixels (VIMS_uncert.box_spectra).
+"""
+import numpy as np
+import pytest
+
+from VIMS_uncertainties import log10_relat_std
+
+columns = ['s', 'l', 'lat', 'lon', 'res', 'Fmask', 'Dinc', 'incAv', 'Deme', 'emeAv', 'Dphase', 'phaseAv']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def assert_same_boxes(a, b):
+    assert set(a) == set(b)
+    for k in a:
+        np.testing.assert_array_equal(a[k], b[k], err_msg=k)
+
+@pytest.mark.parametrize('box', [3, 5])
+def test_same_as_box_stats(cube, box):
+    h = box // 2
+    # Some boxes go beyond the edges of the cube:
+    ns = np.array([1 + h, cube.NS - h, h, 5, 8, cube.NS - h + 1, 7, -2, 6])
+    nl = np.array([1 + h, cube.NL - h, 6, h, 9, 4, cube.NL + 3, 5, 6])
+    out = cube.box_spectra(ns, nl, box=box)
+    assert out['index'].tolist() == [0, 1, 4, 8]
+    assert out['s'].tolist() == ns[out['index']].tolist()
+    assert out['l'].tolist() == nl[out['index']].tolist()
+
+    for k, (s, l) in enumerate(zip(out['s'], out['l'])):
+        stats = cube.box_stats([s], [l], box)
+        valid = stats['IsF_masked'][0] == 0.
+        np.testing.assert_allclose(out['IFav'][k][valid], stats['IsF_av'][0][valid])
+        np.testing.assert_allclose(out['DIsF'][k][valid], log10_relat_std(stats['IsF_std'], stats['IsF_av'])[0][valid])
+        assert np.all(np.isnan(out['DIsF'][k][~valid]) & np.isnan(out['IFav'][k][~valid]))
+        assert out['Fmask'][k] == pytest.approx(stats['IsF_masked'][0].mean())
+        assert out['lat'][k] == np.asarray(cube.lat)[l-1, s-1]
+        for name in ('inc', 'eme', 'phase'):
+            assert out[name + 'Av'][k] == pytest.approx(stats[name + '_av'][0])
+            assert out['D' + name][k] == pytest.approx(stats[name + '_std'][0] / stats[name + '_av'][0])
+
+def test_same_as_extraction(cube, extraction):
+    # The boxes of the first test cube, extracted by 'VIMSU_1.VIMS_u':
+    Pav_DF = extraction[1]
+    for box in (3, 5):
+        rows = Pav_DF[(Pav_DF['Cube name'] == cube.img_id) & (Pav_DF['box'] == box)]
+        out  = cube.box_spectra(rows['s'].to_numpy(), rows['l'].to_numpy(), box=box)
+        assert len(out['index']) == len(rows)
+        for col in columns:
+            np.testing.assert_allclose(out[col], rows[col].to_numpy(dtype=float), rtol=1e-12, err_msg=col)
+        for block in ('DIsF', 'IFav'):
+            ref = rows[[f'{block}_{i+1}' for i in range(out[block].shape[1])]].to_numpy(dtype=float)
+            np.testing.assert_allclose(out[block], ref, rtol=1e-12, err_msg=block)
+
+def test_mask_input(cube):
+    mask = np.zeros((cube.NL, cube.NS), dtype=bool)
+    mask[0, :] = True # Out of the cube for 3x3 boxes.
+    mask[4:7, 3:9] = True
+    mask[10, 12] = True
+    out = cube.box_spectra(mask=mask, box=3)
+
+    nl, ns = np.nonzero(mask) # C order.
+    assert_same_boxes(out, cube.box_spectra(ns + 1, nl + 1, box=3))
+    assert len(out['index']) == 3*6 + 1
+    assert np.all(mask[out['l'] - 1, out['s'] - 1])
+
+def test_max_masked(cube):
+    nl, ns = np.mgrid[2:cube.NL, 2:cube.NS]
+    ns, nl = ns.ravel(), nl.ravel()
+    every  = cube.box_spectra(ns, nl, box=3, mask_channels=(150, 200))
+    limit  = float(np.median(every['Fmask']))
+    kept   = cube.box_spectra(ns, nl, box=3, max_masked=limit, mask_channels=(150, 200))
+    assert 0 < len(kept['index']) < len(every['index'])
+    assert kept['index'].tolist() == np.flatnonzero(every['Fmask'] <= limit).tolist()
+    np.testing.assert_array_equal(kept['DIsF'], every['DIsF'][kept['index']])
+
+    # No invalid value in channels 100 to 140 of the test cube: all the boxes are kept.
+    clean = cube.box_spectra(ns, nl, box=3, max_masked=0., mask_channels=(100, 140))
+    assert len(clean['index']) == len(ns) and np.all(clean['Fmask'] == 0.)
+
+def test_bad_inputs(cube):
+    with pytest.raises(SystemExit):
+        cube.box_spectra(mask=np.ones((cube.NL + 1, cube.NS), dtype=bool))
+    with pytest.raises(SystemExit):
+        cube.box_spectra([3, 4], [3])
@@ -0,0 +1,84 @@
+"""
+Tests of the statistics of boxes computed with summed-area tables (VIMS_uncert.box_stats), against the
+original per-pixel loops of 'comp_logect_pave' (3x3 boxes) and against direct computations on windows of
+the cube (any box size).
+"""
+import numpy as np
+import pytest
+
+from VIMS_uncertainties import integral_image, box_sum, log10_relat_std
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def legacy_box3(cube, s, l):
+    """
+    Statistics of the 3x3 box centred on (s, l), computed as in the original 'comp_logect_pave': pixel by
+    pixel with the 'pyvims' accessors, NumPy std and mean, aberrant relative std replaced by 0.5.
+    """
+    pixels  = [(s + ds, l + dl) for dl in (-1, 0, 1) for ds in (-1, 0, 1)]
+    spectra = np.array([cube[sa, li].spectrum for sa, li in pixels])
+    ectr    = np.std(spectra, axis=0) / np.mean(spectra, axis=0)
+    DIsF    = np.log10(np.where((ectr > 0.) & (ectr < 1.), ectr, 0.5))
+    angles  = {}
+    for name in ('inc', 'eme', 'phase'):
+        a = np.array([getattr(cube[sa, li], name) for sa, li in pixels])
+        angles[name] = (np.std(a) / np.mean(a), np.mean(a))
+    return DIsF, np.mean(spectra, axis=0), angles
+
+@pytest.fixture(scope='module')
+def centres(cube):
+    rng = np.random.default_rng(0)
+    return rng.integers(2, cube.NS, 25), rng.integers(2, cube.NL, 25)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_box3_matches_legacy_loop(cube, centres):
+    ns, nl = centres
+    stats  = cube.box_stats(ns, nl, box=3)
+    DIsF   = log10_relat_std(stats['IsF_std'], stats['IsF_av'])
+    for k, (s, l) in enumerate(zip(ns, nl)):
+        ref_DIsF, ref_av, ref_angles = legacy_box3(cube, s, l)
+
+        # Channels with invalid values in the box are NaN, the others are the same as the loops (which
+        # compute in single precision, as the spectra of 'pyvims'):
+        valid = stats['IsF_masked'][k] == 0.
+        assert np.all(np.isnan(stats['IsF_av'][k][~valid]))
+        np.testing.assert_allclose(stats['IsF_av'][k][valid], ref_av[valid], rtol=1e-6, atol=1e-9)
+        np.testing.assert_allclose(DIsF[k][valid], ref_DIsF[valid], atol=1e-4)
+
+        for name, (ectr, av) in ref_angles.items():
+            assert stats[name + '_av'][k] == pytest.approx(av, rel=1e-6)
+            assert stats[name + '_std'][k] / stats[name + '_av'][k] == pytest.approx(ectr, rel=1e-4, abs=1e-7)
+
+@pytest.mark.parametrize('box', [3, 5, 7])
+def test_any_box_size_matches_windows(cube, box):
+    h  = box // 2
+    nl, ns = np.mgrid[1+h:cube.NL+1-h, 1+h:cube.NS+1-h]
+    ns, nl = ns.ravel(), nl.ravel()
+    stats  = cube.box_stats(ns, nl, box=box)
+
+    data  = np.asarray(cube.data, dtype=float)
+    valid = cube.valid_mask()
+    for k in range(0, len(ns), 7):
+        win = (slice(None), slice(nl[k]-1-h, nl[k]+h), slice(ns[k]-1-h, ns[k]+h))
+        ok  = valid[win].all(axis=(1, 2))
+        w   = data[win].reshape(data.shape[0], -1)
+        np.testing.assert_allclose(stats['IsF_masked'][k], 1. - valid[win].mean(axis=(1, 2)))
+        np.testing.assert_allclose(stats['IsF_av'][k][ok],  w[ok].mean(axis=1), rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(stats['IsF_std'][k][ok], w[ok].std(axis=1),  rtol=1e-6, atol=1e-9)
+        inc = np.asarray(cube.inc, dtype=float)[win[1:]]
+        assert stats['inc_av'][k] == pytest.approx(inc.mean(), rel=1e-9)
+        assert stats['inc_std'][k] == pytest.approx(inc.std(), rel=1e-6, abs=1e-9)
+
+def test_box_sum():
+    rng = np.random.default_rng(1)
+    arr = rng.normal(size=(4, 9, 11))
+    sat = integral_image(arr)
+    ns, nl = np.array([3, 6, 9]), np.array([3, 5, 7])
+    for box in (3, 5):
+        h = box // 2
+        ref = [arr[:, l-1-h:l+h, s-1-h:s+h].sum(axis=(1, 2)) for s, l in zip(ns, nl)]
+        np.testing.assert_allclose(box_sum(sat, ns, nl, box), np.array(ref).T)
+
+def test_bad_box_size(cube):
+    for box in (2, 4, 1):
+        with pytest.raises(SystemExit):
+            cube.box_stats([5], [5], box=box)
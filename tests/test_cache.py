@@ -0,0 +1,127 @@
+"""
+Tests of the on-disk cache of the results of the analysis (VIMSU_cache.ResultCache).
+"""
+import os
+
+import numpy as np
+import pytest
+
+import VIMSU_2 as v2
+from VIMSU_1 import Pav_key, write_DF_HDF5
+from VIMSU_cache import ResultCache, digests_name
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+class Counter:
+    """
+    Function returning a given result, and counting its calls.
+    """
+    def __init__(self, result):
+        self.result = result
+        self.calls  = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+def result(seed=0):
+    rng = np.random.default_rng(seed)
+    return ([rng.normal(size=5), np.array([]), rng.normal(size=3)], [rng.normal(size=2)] * 3)
+
+def assert_same(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        assert len(x) == len(y)
+        for u, v in zip(x, y):
+            np.testing.assert_array_equal(u, v)
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'))
+
+@pytest.fixture
+def input_file(tmp_path):
+    fname = tmp_path / 'input.dat'
+    fname.write_bytes(b'0123456789' * 100)
+    return str(fname)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_hit_and_miss(cache, input_file):
+    func = Counter(result())
+    for _ in range(3):
+        res = cache.cached(func, 'f', 1, inputs=[input_file], band=[[7, 8]], Dang=0.05, box=None)
+        assert_same(res, func.result)
+    assert func.calls == 1
+
+    # Other parameters, or another version of the function: computed again.
+    cache.cached(func, 'f', 1, inputs=[input_file], band=[[7, 8]], Dang=0.04, box=None)
+    cache.cached(func, 'f', 2, inputs=[input_file], band=[[7, 8]], Dang=0.05, box=None)
+    cache.cached(func, 'g', 1, inputs=[input_file], band=[[7, 8]], Dang=0.05, box=None)
+    assert func.calls == 4
+
+def test_array_result(cache):
+    arr = np.arange(12.).reshape(3, 4)
+    func = Counter(arr)
+    np.testing.assert_array_equal(cache.cached(func, 'a', 1, x=1), arr)
+    np.testing.assert_array_equal(cache.cached(func, 'a', 1, x=1), arr)
+    assert func.calls == 1
+    assert cache.get('0' * 64) is None
+
+def test_input_change(cache, input_file):
+    func = Counter(result())
+    cache.cached(func, 'f', 1, inputs=[input_file])
+
+    # Same content, but the file was written again: the checksum is computed again, the result is kept.
+    st = os.stat(input_file)
+    os.utime(input_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    cache.cached(func, 'f', 1, inputs=[input_file])
+    assert func.calls == 1
+
+    # New content of the same size:
+    with open(input_file, 'r+b') as f:
+        f.write(b'9')
+    os.utime(input_file, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    cache.cached(func, 'f', 1, inputs=[input_file])
+    assert func.calls == 2
+    assert os.path.isfile(os.path.join(cache.cache_dir, digests_name))
+
+def test_lru_eviction(tmp_path):
+    big   = np.zeros(1000) # About 8 kB per result.
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=10**9)
+    for t, k in enumerate(['a', 'b']):
+        cache.put(k, big)
+        os.utime(cache._path(k), ns=(10**18 + t, 10**18 + t)) # 'a' is older than 'b'.
+    size = os.path.getsize(cache._path('a'))
+
+    # Room for two results: 'a' is used, so that 'b' is now the least recently used one.
+    cache.max_bytes = 2 * size + size // 2
+    assert cache.get('a') is not None
+    cache.put('c', big)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+    # A result larger than the whole cache is kept, alone:
+    cache.max_bytes = size // 2
+    cache.put('d', big)
+    assert sorted(f for f in os.listdir(cache.cache_dir) if f.endswith('.npz')) == ['d.npz']
+
+    cache.clear()
+    assert not [f for f in os.listdir(cache.cache_dir) if f.endswith('.npz')]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_IsFavBand_cached(extraction, tmp_path, monkeypatch):
+    bands = [[7, 8, 'olive'], [50, 53, 'coral']]
+    fname = str(tmp_path / 'pav.hdf5')
+    write_DF_HDF5(extraction[1], fname, Pav_key)
+    cache = ResultCache(str(tmp_path / 'cache'))
+
+    ref = v2.IsFavBand(extraction[1], bands, 0.01, box=3)
+    assert_same(v2.IsFavBand_cached(fname, bands, 0.01, box=3, cache=cache), ref)
+
+    # Second call served by the cache, whatever the colours of the bands:
+    def fail(*args, **kwargs):
+        raise AssertionError('not cached')
+    monkeypatch.setattr(v2, 'IsFavBand', fail)
+    bands[0][2] = 'red'
+    assert_same(v2.IsFavBand_cached(fname, bands, 0.01, box=3, cache=cache), ref)
+    with pytest.raises(AssertionError, match='not cached'):
+        v2.IsFavBand_cached(fname, bands, 0.01, box=5, cache=cache)
@@ -0,0 +1,69 @@
+"""
+Tests of the catalogue of cubes built from their labels only (VIMSU_catalog), against the values read
+from the whole cubes by 'pyvims' during the extraction.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import VIMSU_batch as vb
+import VIMSU_catalog as vc
+from VIMSU_1 import Cubes_metadata
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def catalog(cubes_dir, cube_names):
+    catalog, failed = vc.build_catalog(cubes_dir, cube_names, max_workers=2)
+    assert failed == {}
+    return catalog
+
+def test_same_as_full_load(catalog, extraction):
+    Cubes_DF = extraction[0]
+    assert list(catalog.columns) == list(vc.Catalog_metadata)
+    assert catalog['Cube name'].tolist() == Cubes_DF['Cube name'].tolist()
+    for col in Cubes_metadata:
+        if col == 'Cube name':
+            continue
+        a, b = catalog[col].to_numpy(), Cubes_DF[col].to_numpy()
+        if col in ('Nsample', 'Nline', 'Npix'):
+            assert np.array_equal(a, b.astype(int)), col
+        else:
+            np.testing.assert_allclose(a.astype(float), b.astype(float), rtol=1e-9, err_msg=col)
+
+def test_time_mode_target(catalog, cube):
+    row = catalog.iloc[0]
+    assert row['Cube name'] == cube.img_id
+    assert row['Mode'] == cube.mode
+    assert row['Target'] == cube.target_name
+    assert abs(row['Time'] - pd.Timestamp(cube.time).tz_localize(None)) < pd.Timedelta(milliseconds=1)
+
+def test_all_cubes_of_directory(catalog, cubes_dir):
+    whole, failed = vc.build_catalog(cubes_dir, max_workers=1)
+    assert failed == {}
+    pd.testing.assert_frame_equal(whole, catalog)
+
+def test_unreadable_cubes(cubes_dir, cube_names, tmp_path):
+    bad = tmp_path / 'C1234567890_1_ir.cub'
+    bad.write_bytes(b'not an ISIS cube')
+    for cname in cube_names:
+        os.symlink(os.path.join(cubes_dir, 'C' + cname + '_ir.cub'), tmp_path / ('C' + cname + '_ir.cub'))
+
+    catalog, failed = vc.build_catalog(str(tmp_path), cube_names + ['1234567890_1', '1111111111_1'], max_workers=2)
+    assert catalog['Cube name'].tolist() == cube_names
+    assert sorted(failed) == ['C1111111111_1_ir.cub', 'C1234567890_1_ir.cub']
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_catalog_command_and_selection(cubes_dir, catalog, tmp_path):
+    out, out_list = str(tmp_path / 'catalog.hdf5'), str(tmp_path / 'selected.csv')
+    dT3 = float(catalog['dT3'].min())
+    vb.main(['catalog', '--cubes-dir', cubes_dir, '--max-workers', '1', '--out', out,
+             '--where', f'dT3 <= {dT3!r} & Nsample >= 16', '--out-list', out_list])
+
+    pd.testing.assert_frame_equal(pd.read_hdf(out, vc.Catalog_key), catalog)
+    selected = catalog.loc[catalog['dT3'] <= dT3, 'Cube name'].tolist()
+    assert 0 < len(selected) < len(catalog)
+    assert vc.select_cubes(out, f'dT3 <= {dT3!r}') == selected
+    assert vb.read_cubes_list(out_list).tolist() == selected
+    assert vc.select_cubes(out) == catalog['Cube name'].tolist()
@@ -0,0 +1,51 @@
+"""
+Tests of the density rendering of DIsF vs I/F (VIMSU_2.bin_band_avIF_DIF and plot_band_avIF_DIF).
+"""
+import numpy as np
+import pytest
+
+import VIMSU_2 as v2
+
+bands = [[7, 8, 'olive'], [16, 18, 'hotpink'], [30, 34, 'slategray'],
+         [50, 53, 'coral'], [88, 93, 'deepskyblue'], [170, 180, 'goldenrod']]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def band_data():
+    rng = np.random.default_rng(2)
+    IsF  = [rng.uniform(-0.05, 0.35, 1000 + 10*k) for k in range(len(bands))]
+    DIsF = [rng.uniform(-3.5, 0.3, 1000 + 10*k) for k in range(len(bands))]
+    IsF[0][:5] = np.nan # NaN values are not binned.
+    return IsF, DIsF
+
+def test_bins_match_histogram2d(band_data):
+    IsF, DIsF = band_data
+    H, xedges, yedges = v2.bin_band_avIF_DIF(IsF, DIsF, bins=(40, 30))
+    assert H.shape == (len(bands), 40, 30)
+    for k in range(len(bands)):
+        ok = np.isfinite(IsF[k])
+        ref, _, _ = np.histogram2d(IsF[k][ok], DIsF[k][ok], bins=(xedges, yedges))
+        # 'histogram2d' includes the last edge in the last bin, 'bin_band_avIF_DIF' does not:
+        on_edge = (IsF[k][ok] == xedges[-1]) | (DIsF[k][ok] == yedges[-1])
+        assert not on_edge.any()
+        assert np.array_equal(H[k], ref.astype(int))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('mode', ['scatter', 'density'])
+def test_plot_modes(band_data, tmp_path, mode):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    IsF, DIsF = band_data
+    ref = (np.linspace(0.88, 5.1, 256), np.full(256, 0.05))
+    figname = str(tmp_path / f'{mode}.png')
+    density = v2.plot_band_avIF_DIF(bands, None, None, IsF, DIsF, figname, mode=mode, ref_spectrum=ref, dpi=30)
+    plt.close('all')
+
+    assert (tmp_path / f'{mode}.png').stat().st_size > 0
+    if mode == 'scatter':
+        assert density is None
+    else:
+        H, _, _ = density
+        assert np.array_equal(H, v2.bin_band_avIF_DIF(IsF, DIsF)[0])
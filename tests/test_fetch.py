@@ -0,0 +1,140 @@
+"""
+Tests of the download of cubes (VIMSU_fetch), from a local HTTP server standing for the VIMS Data Portal.
+"""
+import http.server
+import os
+import shutil
+import threading
+
+import pytest
+
+import VIMSU_fetch as vf
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+class Portal(http.server.ThreadingHTTPServer):
+    """
+    Server of the files of a directory under '/cube/'. 'behaviour' gives, per file name, a list of
+    answers to the successive requests: 'ok', an HTTP error code, 'corrupt' (one byte changed) or
+    'truncated' (the connection is closed before the end); 'ok' once the list is exhausted.
+    """
+    def __init__(self, root):
+        self.root      = root
+        self.behaviour = {}
+        self.requests  = {}
+        super().__init__(('127.0.0.1', 0), PortalHandler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class PortalHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fname = os.path.basename(self.path)
+        srv   = self.server
+        n     = srv.requests.get(fname, 0)
+        srv.requests[fname] = n + 1
+        todo  = srv.behaviour.get(fname, [])
+        what  = todo[n] if n < len(todo) else 'ok'
+
+        path = os.path.join(srv.root, fname)
+        if isinstance(what, int) or not os.path.isfile(path):
+            self.send_error(what if isinstance(what, int) else 404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        if what == 'corrupt':
+            data = data[:100] + bytes([data[100] ^ 0xff]) + data[101:]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[:len(data)//2] if what == 'truncated' else data)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def portal(cubes_dir, cube_names):
+    # The cubes are served from the directory of the shipped cubes (target of the links of 'cubes_dir'):
+    srv = Portal(os.path.dirname(os.path.realpath(os.path.join(cubes_dir, vf.cube_fname(cube_names[0])))))
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+@pytest.fixture(autouse=True)
+def no_wait(monkeypatch):
+    monkeypatch.setattr(vf.time, 'sleep', lambda s: None) # No delay between attempts.
+
+def digest(cname, root):
+    size, sha = vf.file_digest(os.path.join(root, vf.cube_fname(cname)))
+    return {'size': size, 'sha256': sha}
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_download_and_manifest(portal, cube_names, tmp_path):
+    fetched, failed = vf.prefetch_cubes(cube_names, str(tmp_path), base_url=portal.url, max_workers=2)
+    assert sorted(fetched) == sorted(cube_names)
+    assert failed == {}
+
+    manifest = vf.read_manifest(str(tmp_path))
+    for cname in cube_names:
+        assert manifest[vf.cube_fname(cname)] == digest(cname, portal.root) == digest(cname, str(tmp_path))
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.part')]
+
+    # Nothing to do the second time:
+    fetched, failed = vf.prefetch_cubes(cube_names, str(tmp_path), base_url=portal.url)
+    assert fetched == [] and failed == {}
+
+def test_retry_after_errors(portal, cube_names, tmp_path):
+    cname = cube_names[0]
+    portal.behaviour[vf.cube_fname(cname)] = [503, 'truncated']
+    fetched, failed = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url, retries=3)
+    assert fetched == [cname] and failed == {}
+    assert portal.requests[vf.cube_fname(cname)] == 3
+    assert digest(cname, str(tmp_path)) == digest(cname, portal.root)
+
+def test_failure_after_all_retries(portal, cube_names, tmp_path):
+    cname = cube_names[0]
+    portal.behaviour[vf.cube_fname(cname)] = [500, 'truncated', 500]
+    fetched, failed = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url, retries=3)
+    assert fetched == [] and cname in failed
+    assert portal.requests[vf.cube_fname(cname)] == 3
+    assert os.listdir(tmp_path) == [] # No partial file, and no manifest.
+
+def test_not_found_is_not_retried(portal, tmp_path):
+    fetched, failed = vf.prefetch_cubes(['1234567890_1'], str(tmp_path), base_url=portal.url, retries=3)
+    assert '1234567890_1' in failed
+    assert portal.requests[vf.cube_fname('1234567890_1')] == 1
+
+def test_checksum_verified_against_manifest(portal, cube_names, tmp_path):
+    cname = cube_names[0]
+    vf.write_manifest(str(tmp_path), {vf.cube_fname(cname): digest(cname, portal.root)})
+
+    # Corrupted on every attempt: the cube is rejected.
+    portal.behaviour[vf.cube_fname(cname)] = ['corrupt'] * 2
+    fetched, failed = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url, retries=2)
+    assert fetched == [] and 'checksum' in failed[cname]
+    assert not os.path.exists(tmp_path / vf.cube_fname(cname))
+
+    # Corrupted once only: the second attempt is kept.
+    portal.requests.clear()
+    portal.behaviour[vf.cube_fname(cname)] = ['corrupt']
+    fetched, failed = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url, retries=2)
+    assert fetched == [cname]
+    assert digest(cname, str(tmp_path)) == digest(cname, portal.root)
+
+def test_verify_existing(portal, cube_names, tmp_path):
+    cname = cube_names[0]
+    fname = vf.cube_fname(cname)
+    vf.write_manifest(str(tmp_path), {fname: digest(cname, portal.root)})
+    shutil.copy(os.path.join(portal.root, fname), tmp_path / fname)
+    with open(tmp_path / fname, 'r+b') as f: # Local copy damaged.
+        f.seek(200)
+        f.write(b'\0\0\0\0')
+
+    fetched, _ = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url)
+    assert fetched == [] # Not checked by default.
+    fetched, _ = vf.prefetch_cubes([cname], str(tmp_path), base_url=portal.url, verify_existing=True)
+    assert fetched == [cname]
+    assert digest(cname, str(tmp_path)) == digest(cname, portal.root)
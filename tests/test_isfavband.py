@@ -0,0 +1,73 @@
+"""
+Tests of the selection of boxes for the analysis (VIMSU_2.IsFavBand): the values read from a HDF5 store
+in 'table' format, with the criteria applied by PyTables, are the same as from the DataFrame in memory.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import VIMSU_2 as v2
+from VIMSU_1 import Pav_key, Pav_data_columns, write_DF_HDF5
+
+bands = [[7, 8, 'olive'], [16, 18, 'hotpink'], [30, 34, 'slategray'],
+         [50, 53, 'coral'], [88, 93, 'deepskyblue'], [170, 180, 'goldenrod']]
+Dang = 0.0092 # About half of the 5x5 boxes of the test cubes are rejected (Deme).
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def Pav_DF(extraction):
+    return extraction[1]
+
+@pytest.fixture(scope='module')
+def table_file(Pav_DF, tmp_path_factory):
+    fname = str(tmp_path_factory.mktemp('stores') / 'pav_table.hdf5')
+    write_DF_HDF5(Pav_DF, fname, Pav_key, data_columns=Pav_data_columns)
+    return fname
+
+def reference(Pav_DF, box=None, where=None, cubes=None):
+    """
+    'IsFavBand' on the DataFrame, with the same selection made by pandas.
+    """
+    if cubes is not None:
+        Pav_DF = Pav_DF[Pav_DF['Cube name'].isin(cubes)]
+    if where is not None:
+        Pav_DF = Pav_DF.query(where)
+    return v2.IsFavBand(Pav_DF, bands, Dang, box=box)
+
+def assert_same(res, ref):
+    for a, b in zip(res, ref):
+        assert len(a) == len(b) == len(bands)
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
+
+def selections(Pav_DF, cube_names):
+    res = float(Pav_DF['res'].median())
+    return [dict(), dict(box=3), dict(box=5), dict(where=f'res <= {res!r}'),
+            dict(where='(lat < -58.) | (Fmask > 0.03)'), dict(cubes=cube_names[1:]),
+            dict(box=3, where=f'res <= {res!r}', cubes=cube_names[:2])]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_selections_are_not_trivial(Pav_DF, cube_names):
+    # Each selection keeps some boxes, but not all of them:
+    for sel in selections(Pav_DF, cube_names)[1:]:
+        n = len(np.concatenate(reference(Pav_DF, **sel)[0]))
+        assert 0 < n < len(np.concatenate(reference(Pav_DF)[0]))
+
+def test_table_store_same_as_DataFrame(Pav_DF, table_file, cube_names):
+    with pd.HDFStore(table_file, mode='r') as store:
+        assert store.get_storer(Pav_key).is_table
+        for sel in selections(Pav_DF, cube_names):
+            ref = reference(Pav_DF, **sel)
+            assert_same(v2.IsFavBand(store, bands, Dang, **sel), ref)
+            # File name instead of the store, and small chunks:
+            assert_same(v2.IsFavBand(table_file, bands, Dang, chunksize=7, **sel), ref)
+
+def test_no_box_selected(Pav_DF, table_file):
+    IsFav, DIsF = v2.IsFavBand(table_file, bands, Dang, where='res < 0')
+    assert all(len(x) == 0 for x in IsFav + DIsF)
+
+def test_query_with_Pav_where(Pav_DF, table_file):
+    where = v2.Pav_where(lat_range=(-90., -58.), masked_max=0.025)
+    ref   = v2.IsFavBand(Pav_DF[(Pav_DF['lat'] >= -90.) & (Pav_DF['lat'] <= -58.) & (Pav_DF['Fmask'] <= 0.025)], bands, Dang)
+    assert len(ref[0][0]) > 0
+    assert_same(v2.IsFavBand(table_file, bands, Dang, where=where), ref)
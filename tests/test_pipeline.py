@@ -0,0 +1,61 @@
+"""
+Tests of the pipelined extraction (VIMS_u.extract_pipelined): same results and same stores as the
+sequential extraction, and early stop when the results cannot be written.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import VIMSU_1 as v1
+import VIMSU_batch as vb
+from VIMSU_1 import Cubes_key, Pav_key
+from conftest import extract
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('prefetch', [1, 2, 4])
+def test_same_as_sequential(extraction, cube_list, cubes_dir, prefetch):
+    vu = v1.VIMS_u(cube_list, cubes_dir, 0.3, boxes=(3, 5))
+    np.random.seed(5) # Same seed as 'extraction'.
+    Cubes_DF, Pav_DF, timings = vu.extract_pipelined(cubes_dir=cubes_dir, prefetch=prefetch)
+    pd.testing.assert_frame_equal(Cubes_DF, extraction[0])
+    pd.testing.assert_frame_equal(Pav_DF, extraction[1])
+    assert set(timings) == {'read', 'wait', 'compute', 'plot', 'write', 'total'}
+
+def test_same_stores_as_sequential(cube_list, cubes_dir, tmp_path):
+    files = {}
+    for mode, opts in [('seq', []), ('pipe', ['--pipeline', '2'])]:
+        files[mode] = (str(tmp_path / f'cubes_{mode}.hdf5'), str(tmp_path / f'pav_{mode}.hdf5'))
+        np.random.seed(3)
+        vb.main(['extract', '--list', cube_list, '--cubes-dir', cubes_dir, '--frac', '0.3', '--boxes', '3', '5',
+                 '--out-cubes', files[mode][0], '--out-pav', files[mode][1]] + opts)
+
+    for k, key in enumerate([Cubes_key, Pav_key]):
+        with pd.HDFStore(files['seq'][k], mode='r') as seq, pd.HDFStore(files['pipe'][k], mode='r') as pipe:
+            a, b = seq.get_storer(key), pipe.get_storer(key)
+            assert a.is_table == b.is_table == (key == Pav_key) # 'fixed' format for cubes, 'table' for boxes.
+            assert a.attrs.metadata == b.attrs.metadata
+            pd.testing.assert_frame_equal(seq[key], pipe[key])
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_stop_at_write_failure(cube_names, cubes_dir, tmp_path, monkeypatch):
+    # A long list (the test cubes several times), so that a late stop would be seen:
+    fname = tmp_path / 'cubes.csv'
+    fname.write_text('Cube name\n' + '\n'.join(cube_names * 4) + '\n')
+    vu = v1.VIMS_u(str(fname), cubes_dir, 0.3)
+
+    computed = []
+    cube_frames = vu.cube_frames
+    def counting(cname, cube, root):
+        computed.append(cname)
+        return cube_frames(cname, cube, root)
+    monkeypatch.setattr(vu, 'cube_frames', counting)
+
+    def fail(self, *args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(pd.HDFStore, 'append', fail)
+
+    with pytest.raises(OSError, match='disk full'):
+        vu.extract_pipelined(cubes_dir=cubes_dir, prefetch=2, out_pav=str(tmp_path / 'pav.hdf5'), plot=False)
+    # The writer fails with the first cube: at most the cubes of the queue ('prefetch') and the one being
+    # computed follow it, not the whole list.
+    assert len(computed) <= 1 + 2 + 1 < 4 * len(cube_names)
@@ -0,0 +1,66 @@
+"""
+Tests of 'BoxSpatialIndex' (VIMSU_2): region and radius queries against a brute-force selection.
+"""
+import numpy as np
+import pytest
+
+from VIMSU_2 import BoxSpatialIndex, haversine
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def boxes():
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(-90., 90., 5000)
+    lon = rng.uniform(0., 360., 5000)
+    lat[:3], lon[:3] = [np.nan, 10., np.inf], [20., np.nan, 30.] # Boxes without valid coordinates.
+    return lat, lon
+
+def brute_region(lat, lon, lat_min, lat_max, lon_min, lon_max):
+    with np.errstate(invalid='ignore'):
+        keep = (lat >= lat_min) & (lat <= lat_max) & np.isfinite(lat) & np.isfinite(lon)
+        if lon_max - lon_min < 360.:
+            a, b = lon_min % 360., lon_max % 360.
+            keep &= ((lon >= a) & (lon <= b)) if a <= b else ((lon >= a) | (lon <= b))
+    return np.flatnonzero(keep)
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('dlat, dlon', [(1., 1.), (5., 7.5)])
+@pytest.mark.parametrize('rect', [(-10., 10., 20., 40.),      # Simple rectangle.
+                                  (-90., 90., 0., 360.),      # Whole globe.
+                                  (30., 60., 350., 15.),      # Wrapping through 0°.
+                                  (-10., 10., 10.9, 10.5),    # Wrapping, both ends in the same tile.
+                                  (-95., -80., 100.3, 100.7), # Inside a single tile, beyond the pole.
+                                  (0., 0.5, -20., 20.)])      # Negative longitude.
+def test_region_brute_force(boxes, rect, dlat, dlon):
+    lat, lon = boxes
+    index = BoxSpatialIndex(lat, lon, dlat=dlat, dlon=dlon)
+    rows  = index.region(*rect)
+    assert np.array_equal(rows, brute_region(lat, lon % 360., *rect))
+
+def test_region_no_duplicates():
+    rows = BoxSpatialIndex([0.5, 0.5], [10.2, 200.]).region(-10., 10., 10.9, 10.5)
+    assert rows.tolist() == [0, 1]
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('site, radius_km', [((0., 180.), 500.), ((-10.6, 191.), 2000.), ((85., 10.), 800.),
+                                             ((-60., 359.), 1500.)])
+def test_radius_brute_force(boxes, site, radius_km):
+    lat, lon = boxes
+    index = BoxSpatialIndex(lat, lon)
+    rows, dist = index.radius(*site, radius_km, return_distance=True)
+
+    with np.errstate(invalid='ignore'):
+        d_all = haversine(*site, lat, lon % 360.)
+        ref   = np.flatnonzero(d_all <= radius_km)
+    assert np.array_equal(np.sort(rows), ref)
+    assert np.all(np.diff(dist) >= 0.)
+    assert np.allclose(dist, d_all[rows])
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_non_finite_coordinates_out_of_tiles(boxes):
+    lat, lon = boxes
+    index = BoxSpatialIndex(lat, lon)
+    assert index.counts().sum() == len(lat) - 3
+    assert len(index.order) == len(lat) - 3
+    count, mean, _ = index.tile_aggregate(np.ones(len(lat)))
+    assert count.sum() == len(lat) - 3
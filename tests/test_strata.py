@@ -0,0 +1,102 @@
+"""
+Tests of the stratified choice of the central pixels of boxes (VIMS_uncertainties.allocate_strata and
+VIMS_uncert.choice_pix_strata).
+"""
+import numpy as np
+import pytest
+
+from VIMS_uncertainties import allocate_strata
+
+# Classes of the geometry of the test cube (incidence 57-60.4°, emergence 53-59°, latitude -61.4 to -55.7°N):
+strata = {'inc': (57., 58., 59., 60.5), 'eme': (52., 55., 60.), 'lat': (-62., -58., -55.)}
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def check_allocation(counts, n_total):
+    alloc = allocate_strata(counts, n_total)
+    assert alloc.sum() == min(n_total, counts.sum())
+    assert np.all((alloc >= 0) & (alloc <= counts))
+    # Balanced: a stratum gets fewer draws than another (by more than one) only if it is exhausted.
+    for i in range(len(counts)):
+        if alloc[i] < counts[i]:
+            assert alloc[i] >= alloc.max() - 1
+    return alloc
+
+def test_allocate_examples():
+    assert check_allocation(np.array([10, 10, 10]), 9).tolist() == [3, 3, 3]
+    assert check_allocation(np.array([1, 50, 50]), 21).tolist() == [1, 10, 10]
+    assert check_allocation(np.array([0, 4, 100]), 30).tolist() == [0, 4, 26]
+    assert check_allocation(np.array([3, 2]), 10).tolist() == [3, 2]
+    assert check_allocation(np.array([5, 5]), 0).tolist() == [0, 0]
+    assert check_allocation(np.array([], dtype=int), 5).tolist() == []
+
+@pytest.mark.parametrize('seed', range(20))
+def test_allocate_random(seed):
+    rng    = np.random.default_rng(seed)
+    counts = rng.integers(0, 40, rng.integers(1, 30))
+    check_allocation(counts, int(rng.integers(0, 2 * counts.sum() + 2)))
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def stratum_of(cube, ns, nl):
+    """
+    Class of each pixel (tuple of the indices of its classes of incidence, emergence and latitude), None if
+    out of the classes.
+    """
+    labels = []
+    for s, l in zip(ns, nl):
+        lab = []
+        for name, edges in strata.items():
+            val = float(np.asarray(getattr(cube, name))[l-1, s-1])
+            if not edges[0] <= val <= edges[-1]:
+                lab = None
+                break
+            lab.append(min(np.searchsorted(edges, val, side='right') - 1, len(edges) - 2))
+        labels.append(None if lab is None else tuple(lab))
+    return labels
+
+@pytest.mark.parametrize('box', [3, 5])
+def test_choice_per_stratum(cube, box):
+    h = box // 2
+    nl_all, ns_all = np.mgrid[1+h:cube.NL+1-h, 1+h:cube.NS+1-h]
+    labels = stratum_of(cube, ns_all.ravel(), nl_all.ravel())
+    counts = {lab: labels.count(lab) for lab in set(labels) if lab is not None}
+    assert len(counts) > 3
+
+    np.random.seed(0)
+    ns, nl = cube.choice_pix_strata(0.3, box=box, strata=strata, n_stratum=4)
+    assert len(set(zip(ns, nl))) == len(ns) # Without replacement.
+    assert np.all((ns >= 1 + h) & (ns <= cube.NS - h) & (nl >= 1 + h) & (nl <= cube.NL - h))
+    chosen = stratum_of(cube, ns, nl)
+    for lab, n in counts.items():
+        assert chosen.count(lab) == min(n, 4)
+
+def test_choice_with_fraction(cube):
+    n_util = cube.nbpix_util(box=3)[2]
+    np.random.seed(1)
+    ns, nl = cube.choice_pix_strata(0.2, box=3, strata=strata)
+    assert len(ns) == int(0.2 * n_util)
+    assert len(set(zip(ns, nl))) == len(ns)
+
+    # Whole cube: all the central pixels inside the classes.
+    ns, nl = cube.choice_pix_strata(1., box=3, strata=strata)
+    assert len(ns) == n_util
+
+def test_choice_out_of_classes(cube):
+    narrow = dict(strata, inc=(58., 59., 60.))
+    ns, nl = cube.choice_pix_strata(1., box=3, strata=narrow)
+    inc = np.asarray(cube.inc)[nl-1, ns-1]
+    assert 0 < len(ns) < cube.nbpix_util(box=3)[2]
+    assert np.all((inc >= 58.) & (inc <= 60.))
+
+def test_choice_with_Dang(cube):
+    stats_all = cube.box_stats(*cube.choice_pix_strata(1., box=3, strata=strata), quantities=('inc', 'eme', 'phase'))
+    Dang = float(np.median(stats_all['eme_std'] / stats_all['eme_av']))
+
+    ns, nl = cube.choice_pix_strata(1., box=3, strata=strata, Dang=Dang)
+    assert 0 < len(ns) < len(stats_all['eme_av'])
+    stats = cube.box_stats(ns, nl, 3, quantities=('inc', 'eme', 'phase'))
+    for name in ('inc', 'eme', 'phase'):
+        assert np.all(stats[name + '_std'] / stats[name + '_av'] < Dang)
+
+def test_bad_fraction(cube):
+    with pytest.raises(SystemExit):
+        cube.choice_pix_strata(0., strata=strata)
@@ -0,0 +1,105 @@
+"""
+Tests of the fits of uncertainty laws to DIsF vs I/F (VIMSU_2.fit_DIsF_law), on synthetic bands drawn from
+known laws.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+import VIMSU_2 as v2
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def synthetic_band(law, params, n=20000, scatter=0.1, seed=0, lo=1e-3, hi=1.):
+    """
+    Boxes with I/F log-uniform in [lo, hi], and DIsF scattered (gaussian) around the law.
+    """
+    rng  = np.random.default_rng(seed)
+    IsF  = 10**rng.uniform(np.log10(lo), np.log10(hi), n)
+    DIsF = v2.uncert_law(IsF, params, law) + rng.normal(0., scatter, n)
+    return IsF, DIsF
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_power_law_recovered():
+    IsF, DIsF = synthetic_band('power', (-2.5, -0.5))
+    fit = v2.fit_DIsF_law(IsF, DIsF, law='power', n_boot=50, seed=1)
+    for nm, truth in zip(v2.uncert_laws['power'], (-2.5, -0.5)):
+        low, high = fit['ci'][nm]
+        assert abs(fit['params'][nm] - truth) < 0.02
+        assert low <= truth <= high
+
+def test_noise_law_recovered():
+    truth = (-3., -1.7)
+    IsF, DIsF = synthetic_band('noise', truth)
+    fit = v2.fit_DIsF_law(IsF, DIsF, law='noise', n_boot=50, seed=1)
+    for nm, t in zip(v2.uncert_laws['noise'], truth):
+        low, high = fit['ci'][nm]
+        assert abs(fit['params'][nm] - t) < 0.05
+        assert low < high
+        assert low - 0.02 <= t <= high + 0.02
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('truth, free, kept', [((-3., -8.), 'log10_f', 'log10_s0'),   # Constant noise only.
+                                               ((-8., -1.7), 'log10_s0', 'log10_f')]) # Proportional term only.
+def test_noise_law_unconstrained_term(truth, free, kept):
+    IsF, DIsF = synthetic_band('noise', truth)
+    fit = v2.fit_DIsF_law(IsF, DIsF, law='noise', n_boot=30, seed=1)
+
+    # No value for the term not constrained by the data, only an upper limit, above the true value:
+    assert np.isnan(fit['params'][free])
+    low, high = fit['ci'][free]
+    assert np.isnan(low)
+    assert truth[list(v2.uncert_laws['noise']).index(free)] < high < 0.
+
+    # The other parameter is still constrained, its interval contains the estimate:
+    t = truth[list(v2.uncert_laws['noise']).index(kept)]
+    low, high = fit['ci'][kept]
+    assert abs(fit['params'][kept] - t) < 0.05
+    assert low <= fit['params'][kept] <= high
+
+def test_profile_excess():
+    IsF, DIsF = synthetic_band('noise', (-3., -1.7))
+    fit = v2.fit_DIsF_law(IsF, DIsF, law='noise', n_boot=0)
+    stats = fit['stats']
+    n     = stats['N'].to_numpy()
+    sigma = 1.2533 * 0.5 * (stats['p84'] - stats['p16']).to_numpy() / np.sqrt(n)
+    x, y  = stats['IsF_mean'].to_numpy(), stats['median'].to_numpy()
+    best  = np.array([fit['params'][nm] for nm in v2.uncert_laws['noise']])
+
+    # Negative excess at the best fit, positive far from it, for both parameters:
+    for j in range(2):
+        assert v2._profile_excess(x, y, sigma, 'noise', best, j, best[j], 95.) < 0.
+        assert v2._profile_excess(x, y, sigma, 'noise', best, j, best[j] + 1., 95.) > 0.
+        assert v2._profile_excess(x, y, sigma, 'noise', best, j, best[j] - 1., 95.) > 0.
+    free, upper = v2._constrain_params(x, y, sigma, 'noise', best, 95.)
+    assert not free.any()
+    assert np.isnan(upper).all()
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_unusable_boxes_do_not_empty_bins():
+    IsF, DIsF = synthetic_band('power', (-2.5, -0.5), n=3000)
+    bad  = np.arange(len(IsF)) % 3 > 0 # Two thirds of the boxes cannot be used.
+    IsF  = np.where(bad & (np.arange(len(IsF)) % 2 == 0), np.nan, IsF)
+    DIsF = np.where(bad & (np.arange(len(IsF)) % 2 == 1), np.nan, DIsF)
+    IsF[:50] = 5. # Outside 'xlim'.
+
+    usable = np.isfinite(IsF) & np.isfinite(DIsF) & (IsF <= 1.)
+    fit = v2.fit_DIsF_law(IsF, DIsF, law='power', bins=30, xlim=(1e-3, 1.), n_boot=0, min_count=40)
+    assert fit['N'] == usable.sum()
+    assert fit['stats']['N'].sum() == usable.sum()
+    assert (fit['stats']['N'] >= 40).all()
+
+    table, _ = v2.fit_band_DIsF_law([[1, 2, 'k']], [IsF], [DIsF], law='power', n_boot=0, xlim=(1e-3, 1.))
+    assert table['N'].iloc[0] == usable.sum()
+
+def test_small_band_no_warning():
+    IsF, DIsF = synthetic_band('power', (-2.5, -0.5), n=25) # Two bins: no fit of the bootstrap samples.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        fit = v2.fit_DIsF_law(IsF, DIsF, law='power', n_boot=20, seed=0)
+    assert np.isnan(list(fit['ci']['a'])).all()
+
+def test_empty_band():
+    fit = v2.fit_DIsF_law(np.array([]), np.array([]), law='noise', n_boot=10)
+    assert fit['N'] == 0
+    assert np.isnan(list(fit['params'].values())).all()
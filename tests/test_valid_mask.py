@@ -0,0 +1,107 @@
+"""
+Tests of the invalid I/F values (VIMS_uncert.valid_mask), and of the fraction of invalid values in the
+boxes ('Fmask', VIMS_uncert.masked_fraction).
+"""
+import numpy as np
+import pytest
+
+from VIMS_uncertainties import VIMS_uncert
+from conftest import CUBES, CUBES_DIR, extract
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def fresh_cube():
+    """
+    A test cube of its own, whose data can be changed (the mask is computed once per cube).
+    """
+    return VIMS_uncert('C' + CUBES[0] + '_ir.cub', root=CUBES_DIR + '/')
+
+def brute_masked(valid, ns, nl, box, channels=None):
+    h = box // 2
+    if channels is not None:
+        valid = valid[channels[0]-1:channels[1]]
+    return np.array([1. - valid[:, l-1-h:l+h, s-1-h:s+h].mean() for s, l in zip(ns, nl)])
+
+def centres(cube, box):
+    h = box // 2
+    nl, ns = np.mgrid[1+h:cube.NL+1-h, 1+h:cube.NS+1-h]
+    return ns.ravel(), nl.ravel()
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('IsF_max', [None, 0.15])
+def test_valid_mask(fresh_cube, IsF_max):
+    data = fresh_cube.data
+    assert data.dtype == np.float32
+    bad = {(10, 3, 4): np.nan, (11, 3, 4): -0.02, (12, 5, 6): 0.,
+           (13, 7, 8): np.finfo(np.float32).min, # ISIS special values: NULL, LRS, ...
+           (14, 7, 8): np.finfo(np.float32).max, (15, 1, 1): -np.inf}
+    for pos, val in bad.items():
+        data[pos] = val
+    data[20, 9, 9] = 0.5 # Saturated if IsF_max is set.
+
+    fresh_cube.IsF_max = IsF_max
+    valid = fresh_cube.valid_mask()
+    with np.errstate(invalid='ignore'):
+        ref = np.isfinite(data) & (data > 0.) & (np.abs(data) < 1e30)
+        if IsF_max is not None:
+            ref &= data < IsF_max
+    assert np.array_equal(valid, ref)
+    for pos in bad:
+        assert not valid[pos]
+    assert valid[20, 9, 9] == (IsF_max is None)
+    assert fresh_cube.valid_mask() is valid # Computed once.
+
+    # The invalid values are not used: NaN in the statistics of the boxes which contain them.
+    stats = fresh_cube.box_stats([4, 8, 10], [3, 7, 10], box=3)
+    assert np.isnan(stats['IsF_av'][0, 10]) and np.isnan(stats['IsF_av'][0, 11])
+    assert np.isnan(stats['IsF_std'][1, 13]) and np.isnan(stats['IsF_std'][1, 14])
+    assert np.isnan(stats['IsF_av'][2, 20]) == (IsF_max is not None)
+    assert np.all(np.isfinite(stats['IsF_av'][stats['IsF_masked'] == 0.]))
+
+@pytest.mark.parametrize('box', [3, 5])
+@pytest.mark.parametrize('channels', [None, (150, 200), (143, 143), (1, 100)])
+def test_masked_fraction(cube, box, channels):
+    ns, nl = centres(cube, box)
+    Fmask  = cube.masked_fraction(ns, nl, box, channels)
+    np.testing.assert_allclose(Fmask, brute_masked(cube.valid_mask(), ns, nl, box, channels), atol=1e-12)
+    if channels == (1, 100):
+        assert np.all(Fmask == 0.) # No invalid value in these channels of the test cube.
+    else:
+        assert Fmask.max() > 0.
+
+# -----------------------------------------------------------------------------------------------------------------------------------
+def test_extracted_boxes(cube, extraction):
+    Pav_DF = extraction[1]
+    valid  = cube.valid_mask()
+    for box in (3, 5):
+        h    = box // 2
+        rows = Pav_DF[(Pav_DF['Cube name'] == cube.img_id) & (Pav_DF['box'] == box)]
+        ns, nl = rows['s'].to_numpy(), rows['l'].to_numpy()
+        np.testing.assert_allclose(rows['Fmask'].to_numpy(), brute_masked(valid, ns, nl, box), atol=1e-12)
+
+        # DIsF and IFav are NaN exactly for the channels with invalid values in the box:
+        DIsF = rows[[f'DIsF_{i+1}' for i in range(valid.shape[0])]].to_numpy(dtype=float)
+        IFav = rows[[f'IFav_{i+1}' for i in range(valid.shape[0])]].to_numpy(dtype=float)
+        for k, (s, l) in enumerate(zip(ns, nl)):
+            bad = ~valid[:, l-1-h:l+h, s-1-h:s+h].all(axis=(1, 2))
+            assert np.array_equal(np.isnan(DIsF[k]), bad)
+            assert np.array_equal(np.isnan(IFav[k]), bad)
+
+def test_extraction_options(cube_list, cubes_dir):
+    # Fraction over channels 150 to 200 only, boxes with more than 5 % of invalid values left out:
+    _, Pav_DF = extract(cube_list, cubes_dir, max_masked=0.05, mask_channels=(150, 200))
+    _, every  = extract(cube_list, cubes_dir, mask_channels=(150, 200))
+    assert 0 < len(Pav_DF) < len(every)
+    assert Pav_DF['Fmask'].max() <= 0.05
+
+    for cname in CUBES:
+        cube  = VIMS_uncert('C' + cname + '_ir.cub', root=CUBES_DIR + '/')
+        valid = cube.valid_mask()
+        for box in (3, 5):
+            rows = every[(every['Cube name'] == cname) & (every['box'] == box)]
+            ref  = brute_masked(valid, rows['s'].to_numpy(), rows['l'].to_numpy(), box, (150, 200))
+            np.testing.assert_allclose(rows['Fmask'].to_numpy(), ref, atol=1e-12)
+
+    # A saturation threshold below some I/F values of the cubes: more invalid values.
+    _, saturated = extract(cube_list, cubes_dir, IsF_max=0.1, mask_channels=(1, 100))
+    assert saturated['Fmask'].max() > 0.